@@ -0,0 +1,41 @@
+import sys
+from datetime import datetime
+from pathlib import Path
+
+# Add the parent directory (backend) to the Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.main import create_app
+
+
+def run_migration():
+    """
+    Move RAG vectors written before per-user namespaces (RAG_TENANT_NAMESPACES)
+    into each owner's namespace. Safe to run more than once.
+
+    Run it before setting RAG_TENANT_NAMESPACES=true for the web app and
+    workers; until then they keep searching the default namespace.
+    """
+    print(
+        f"Starting vector namespace migration at {datetime.utcnow().isoformat()} UTC..."
+    )
+
+    app = create_app()
+    with app.app_context():
+        rag_service = getattr(app, "rag_service", None)
+        if rag_service is None:
+            print("  EnhancedRAGService is not initialized. Nothing to migrate.")
+            return
+
+        # The migration writes per-user namespaces whatever the app setting is
+        rag_service.tenant_namespaces = True
+        migrated = rag_service.migrate_to_namespaces()
+        print(
+            f"  Moved {migrated['vectors']} vectors of {migrated['documents']} documents."
+        )
+
+    print("Migration finished.")
+
+
+if __name__ == "__main__":
+    run_migration()
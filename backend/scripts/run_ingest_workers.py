@@ -0,0 +1,34 @@
+import os
+import sys
+import argparse
+from pathlib import Path
+
+# Add the parent directory (backend) to the Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.config import DevelopmentConfig
+from src.services.job_queue import start_workers
+
+
+def run_workers():
+    """
+    Run file ingestion workers outside the web process. Start the web app
+    with INGEST_WORKERS=0 when using this.
+    """
+    parser = argparse.ArgumentParser(description="Run file ingestion workers")
+    parser.add_argument(
+        "--workers", type=int, default=int(os.environ.get("INGEST_WORKERS", 2))
+    )
+    args = parser.parse_args()
+
+    print(f"Starting {args.workers} ingestion workers...")
+    processes = start_workers(DevelopmentConfig, args.workers)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        print("Stopping ingestion workers.")
+
+
+if __name__ == "__main__":
+    run_workers()
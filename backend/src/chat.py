@@ -1,17 +1,27 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, abort, make_response, request, jsonify, current_app
 from .models import db, ChatSession, ChatMessage
-
-# Assuming rag_service and ai_service will be in a services sub-package
-# from .services.rag_service import RAGService
-# from .services.ai_service import AIService
+from .rag_service import get_local_rag_service
+from .services.lexical_index import RETRIEVAL_MODES
 import json
 
 # This blueprint assumes it will be registered in the main app factory
 chat_bp = Blueprint("chat", __name__, url_prefix="/api/chat")
 
-# It's better to initialize services within the application context
-# For now, we'll instantiate it here, but this might need to change
-# rag_service = RAGService()
+# Services are shared per app: the embedding model and FAISS index are loaded
+# once and reused by every request instead of being rebuilt per handler.
+
+
+def _rag_service():
+    """RAGService shard for the request's ``namespace`` (query string or JSON body)
+
+    Requests without a namespace use the shared default index.
+    """
+    data = request.get_json(silent=True) or {}
+    namespace = request.args.get("namespace") or data.get("namespace")
+    try:
+        return get_local_rag_service(namespace or None)
+    except ValueError as e:
+        abort(make_response(jsonify({"error": str(e)}), 400))
 
 
 @chat_bp.route("/sessions", methods=["GET"])
@@ -54,13 +64,8 @@ def get_chat_messages(session_id):
 @chat_bp.route("/sessions/<int:session_id>/messages", methods=["POST"])
 def send_message(session_id):
     """Send a message and get AI response"""
-    # This is a placeholder for where the RAG and AI services would be properly integrated
-    # For now, we'll simulate the behavior
-    from ..services.rag_service import RAGService
-    from ..services.ai_service import AIService
-
-    rag_service = RAGService()
-    ai_service = AIService()
+    rag_service = _rag_service()
+    ai_service = current_app.ai_service
 
     data = request.get_json()
     user_message = data.get("message", "")
@@ -121,9 +126,7 @@ def send_message(session_id):
 @chat_bp.route("/rag/documents", methods=["POST"])
 def add_rag_document():
     """Add document to RAG system"""
-    from ..services.rag_service import RAGService
-
-    rag_service = RAGService()
+    rag_service = _rag_service()
     data = request.get_json()
     text = data.get("text", "")
     metadata = data.get("metadata", {})
@@ -141,21 +144,21 @@ def add_rag_document():
 @chat_bp.route("/rag/documents/batch", methods=["POST"])
 def add_rag_documents_batch():
     """Add multiple documents to RAG system"""
-    from ..services.rag_service import RAGService
-
-    rag_service = RAGService()
+    rag_service = _rag_service()
     data = request.get_json()
     documents = data.get("documents", [])
 
-    if not documents:
+    if not documents or not isinstance(documents, list):
         return jsonify({"error": "No documents provided"}), 400
 
-    success_count = rag_service.add_documents_batch(documents)
+    result = rag_service.add_documents_batch(documents)
+    success_count = result["success_count"]
     return jsonify(
         {
             "message": f"Added {success_count} out of {len(documents)} documents",
             "success_count": success_count,
             "total_count": len(documents),
+            "failed": result["failed"],
         }
     )
 
@@ -163,26 +166,39 @@ def add_rag_documents_batch():
 @chat_bp.route("/rag/search", methods=["POST"])
 def search_rag():
     """Search RAG system"""
-    from ..services.rag_service import RAGService
-
-    rag_service = RAGService()
+    rag_service = _rag_service()
     data = request.get_json()
     query = data.get("query", "")
     k = data.get("k", 5)
+    mode = data.get("mode", "vector")
+    rerank = data.get("rerank")
 
     if not query.strip():
         return jsonify({"error": "Query cannot be empty"}), 400
+    if mode not in RETRIEVAL_MODES:
+        return (
+            jsonify({"error": f"mode must be one of {', '.join(RETRIEVAL_MODES)}"}),
+            400,
+        )
 
-    results = rag_service.search(query, k)
+    results = rag_service.search(query, k, mode=mode, rerank=rerank)
     return jsonify(results)
 
 
+@chat_bp.route("/rag/documents/<doc_id>", methods=["DELETE"])
+def delete_rag_document(doc_id):
+    """Remove a document (all of its chunks) from the RAG system"""
+    rag_service = _rag_service()
+    removed = rag_service.delete_document(doc_id)
+    if not removed:
+        return jsonify({"error": "Document not found"}), 404
+    return jsonify({"message": "Document deleted successfully", "chunks": removed})
+
+
 @chat_bp.route("/rag/stats", methods=["GET"])
 def get_rag_stats():
     """Get RAG system statistics"""
-    from ..services.rag_service import RAGService
-
-    rag_service = RAGService()
+    rag_service = _rag_service()
     stats = rag_service.get_stats()
     return jsonify(stats)
 
@@ -190,9 +206,7 @@ def get_rag_stats():
 @chat_bp.route("/rag/clear", methods=["POST"])
 def clear_rag():
     """Clear RAG system"""
-    from ..services.rag_service import RAGService
-
-    rag_service = RAGService()
+    rag_service = _rag_service()
     success = rag_service.clear_index()
     if success:
         return jsonify({"message": "RAG system cleared successfully"})
@@ -10,6 +10,160 @@ class Config:
 
     SECRET_KEY = os.environ.get("SECRET_KEY") or "a_very_secret_key"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Pre-load shared embedding models in a background thread at startup
+    MODEL_WARMUP = os.environ.get("MODEL_WARMUP", "true").lower() == "true"
+
+    # Embedding inference backend: "torch" or "onnx" (ONNX Runtime, optionally
+    # int8-quantized). ONNX falls back to PyTorch if its embeddings drift below
+    # the cosine parity threshold on a sample set.
+    EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch")
+    EMBEDDING_QUANTIZE = os.environ.get("EMBEDDING_QUANTIZE", "false").lower() == "true"
+    EMBEDDING_PARITY_MIN_COSINE = float(
+        os.environ.get("EMBEDDING_PARITY_MIN_COSINE", 0.99)
+    )
+    ONNX_MODEL_DIR = os.environ.get("ONNX_MODEL_DIR")
+    ONNX_NUM_THREADS = int(os.environ.get("ONNX_NUM_THREADS", 0))
+
+    # Persistent embedding cache keyed by (model, mode, sha256(text))
+    EMBEDDING_CACHE_ENABLED = (
+        os.environ.get("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    )
+    EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH")
+    EMBEDDING_CACHE_MEMORY_ITEMS = int(
+        os.environ.get("EMBEDDING_CACHE_MEMORY_ITEMS", 10000)
+    )
+
+    # Vector store for EnhancedRAGService: "pinecone", "local" (SQLite + FAISS on
+    # disk, no network) or "auto" (Pinecone when its keys are set). Without
+    # HF_TOKEN the embedding model also runs locally.
+    VECTOR_STORE = os.environ.get("VECTOR_STORE", "auto")
+    VECTOR_STORE_PATH = os.environ.get("VECTOR_STORE_PATH")
+    PINECONE_API_KEY = os.environ.get("PINECONE_API_KEY")
+    PINECONE_ENV = os.environ.get("PINECONE_ENV")
+    PINECONE_INDEX_NAME = os.environ.get("PINECONE_INDEX_NAME", "rag-index")
+    HF_TOKEN = os.environ.get("HF_TOKEN")
+    # Tenant partitions: each user's vectors live in their own namespace (Pinecone)
+    # or shard (local stores); cold shards are loaded lazily and the least
+    # recently used are dropped past either budget. Off by default: vectors
+    # written without it sit in the shared default namespace and would not be
+    # found. Run scripts/migrate_vector_namespaces.py first, then enable it.
+    RAG_TENANT_NAMESPACES = (
+        os.environ.get("RAG_TENANT_NAMESPACES", "false").lower() == "true"
+    )
+    RAG_TENANT_MAX_PARTITIONS = int(os.environ.get("RAG_TENANT_MAX_PARTITIONS", 32))
+    RAG_TENANT_MAX_VECTORS = int(os.environ.get("RAG_TENANT_MAX_VECTORS", 2000000))
+    # Identical chunks within a user's documents share one vector
+    RAG_CHUNK_DEDUP = os.environ.get("RAG_CHUNK_DEDUP", "true").lower() == "true"
+
+    # Documents are split into token windows (with overlap) before embedding;
+    # MiniLM truncates input at 256 word pieces
+    RAG_CHUNK_TOKENS = int(os.environ.get("RAG_CHUNK_TOKENS", 200))
+    RAG_CHUNK_OVERLAP = int(os.environ.get("RAG_CHUNK_OVERLAP", 40))
+    RAG_REMOTE_CHUNK_TOKENS = int(os.environ.get("RAG_REMOTE_CHUNK_TOKENS", 400))
+
+    # Remote (Hugging Face / Pinecone) bulk ingest: batch sizes and how many
+    # upsert batches are in flight per window
+    RAG_UPSERT_BATCH_SIZE = int(os.environ.get("RAG_UPSERT_BATCH_SIZE", 100))
+    RAG_MAX_CONCURRENCY = int(os.environ.get("RAG_MAX_CONCURRENCY", 4))
+
+    # Outbound Gemini / Hugging Face / Pinecone calls: shared worker pool,
+    # per-provider concurrency ("provider=limit,..."), timeouts, retries with
+    # exponential backoff, and a circuit breaker per provider
+    LLM_MAX_WORKERS = int(os.environ.get("LLM_MAX_WORKERS", 16))
+    LLM_PROVIDER_CONCURRENCY = os.environ.get(
+        "LLM_PROVIDER_CONCURRENCY", "gemini=8,huggingface=4,pinecone=8"
+    )
+    LLM_DEFAULT_CONCURRENCY = int(os.environ.get("LLM_DEFAULT_CONCURRENCY", 4))
+    LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", 30))
+    LLM_QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", 2))
+    LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 2))
+    LLM_RETRY_BACKOFF = float(os.environ.get("LLM_RETRY_BACKOFF", 0.5))
+    LLM_BREAKER_THRESHOLD = int(os.environ.get("LLM_BREAKER_THRESHOLD", 5))
+    LLM_BREAKER_RESET = float(os.environ.get("LLM_BREAKER_RESET", 30))
+
+    # Local FAISS vector store: fold the append log into a snapshot every N inserts
+    RAG_LOG_COMPACT_EVERY = int(os.environ.get("RAG_LOG_COMPACT_EVERY", 500))
+    # Number of texts tokenized and embedded per forward pass during batch ingest
+    RAG_EMBED_BATCH_SIZE = int(os.environ.get("RAG_EMBED_BATCH_SIZE", 32))
+    # Index tier: "auto", "flat", "ivf_flat", "ivf_pq" or "hnsw". In auto mode the
+    # index is trained and migrated to IVF-Flat / IVF-PQ as it crosses the thresholds.
+    RAG_INDEX_TYPE = os.environ.get("RAG_INDEX_TYPE", "auto")
+    RAG_IVF_THRESHOLD = int(os.environ.get("RAG_IVF_THRESHOLD", 50000))
+    RAG_PQ_THRESHOLD = int(os.environ.get("RAG_PQ_THRESHOLD", 1000000))
+    RAG_IVF_NLIST = int(os.environ.get("RAG_IVF_NLIST", 0))  # 0 = ~4*sqrt(n)
+    RAG_PQ_M = int(os.environ.get("RAG_PQ_M", 48))  # must divide the dimension
+    RAG_HNSW_M = int(os.environ.get("RAG_HNSW_M", 32))
+    # Default recall/latency knobs, overridable per search() call
+    RAG_IVF_NPROBE = int(os.environ.get("RAG_IVF_NPROBE", 16))
+    RAG_HNSW_EF_SEARCH = int(os.environ.get("RAG_HNSW_EF_SEARCH", 64))
+
+    # Hybrid retrieval: BM25 candidates fused with vector hits by reciprocal rank
+    RAG_HYBRID_CANDIDATES = int(os.environ.get("RAG_HYBRID_CANDIDATES", 50))
+    RAG_RRF_K = int(os.environ.get("RAG_RRF_K", 60))
+    # Per-user BM25 postings, written at ingest time (default data/lexical)
+    RAG_LEXICAL_PATH = os.environ.get("RAG_LEXICAL_PATH")
+    # Threads for overlapping the independent steps of one chat request
+    RAG_PIPELINE_WORKERS = int(os.environ.get("RAG_PIPELINE_WORKERS", 8))
+    # Chat context: up to N ranked chunks packed into a budget of model tokens
+    RAG_CONTEXT_TOKENS = int(os.environ.get("RAG_CONTEXT_TOKENS", 1024))
+    RAG_CONTEXT_CANDIDATES = int(os.environ.get("RAG_CONTEXT_CANDIDATES", 8))
+    # Optional cross-encoder re-ranking: over-fetch candidates, re-score them on
+    # CPU and keep the best; past the latency budget the vector order is kept
+    RAG_RERANK_ENABLED = os.environ.get("RAG_RERANK_ENABLED", "false").lower() == "true"
+    RAG_RERANK_MODEL = os.environ.get(
+        "RAG_RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+    )
+    RAG_RERANK_CANDIDATES = int(os.environ.get("RAG_RERANK_CANDIDATES", 30))
+    RAG_RERANK_BATCH_SIZE = int(os.environ.get("RAG_RERANK_BATCH_SIZE", 16))
+    RAG_RERANK_BUDGET_MS = int(os.environ.get("RAG_RERANK_BUDGET_MS", 300))
+    RAG_RERANK_CACHE_SIZE = int(os.environ.get("RAG_RERANK_CACHE_SIZE", 4096))
+    # Re-ranked chunks are precise enough that fewer of them go into the prompt
+    RAG_RERANK_CONTEXT_CANDIDATES = int(
+        os.environ.get("RAG_RERANK_CONTEXT_CANDIDATES", 3)
+    )
+    # Search result cache (TTL + LRU), invalidated per user when documents change
+    RAG_QUERY_CACHE_ENABLED = (
+        os.environ.get("RAG_QUERY_CACHE_ENABLED", "true").lower() == "true"
+    )
+    RAG_QUERY_CACHE_SIZE = int(os.environ.get("RAG_QUERY_CACHE_SIZE", 1024))
+    RAG_QUERY_CACHE_TTL = int(os.environ.get("RAG_QUERY_CACHE_TTL", 300))
+    # Semantic cache of chat answers: reuse an answer when a new question from the
+    # same user embeds above the threshold against the same retrieved context
+    RESPONSE_CACHE_ENABLED = (
+        os.environ.get("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+    )
+    RESPONSE_CACHE_MAX_ITEMS = int(os.environ.get("RESPONSE_CACHE_MAX_ITEMS", 2000))
+    RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", 3600))
+    RESPONSE_CACHE_THRESHOLD = float(os.environ.get("RESPONSE_CACHE_THRESHOLD", 0.95))
+    # File ingestion runs in worker processes fed by a SQLite job queue; uploads
+    # get 503 once INGEST_MAX_PENDING jobs are waiting. INGEST_WORKERS=0 leaves
+    # the queue to workers started with scripts/run_ingest_workers.py
+    INGEST_QUEUE_PATH = os.environ.get("INGEST_QUEUE_PATH")
+    INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", 2))
+    INGEST_MAX_PENDING = int(os.environ.get("INGEST_MAX_PENDING", 100))
+    INGEST_MAX_ATTEMPTS = int(os.environ.get("INGEST_MAX_ATTEMPTS", 3))
+    INGEST_JOB_TIMEOUT = int(os.environ.get("INGEST_JOB_TIMEOUT", 1800))
+    INGEST_POLL_INTERVAL = float(os.environ.get("INGEST_POLL_INTERVAL", 1.0))
+    # Batch uploads: files (or zip members) per job, unpacked zip size, and the
+    # processes each worker uses to parse files (0: one per CPU)
+    INGEST_BATCH_MAX_FILES = int(os.environ.get("INGEST_BATCH_MAX_FILES", 5000))
+    INGEST_ZIP_MAX_BYTES = int(os.environ.get("INGEST_ZIP_MAX_BYTES", 2147483648))
+    INGEST_EXTRACT_PROCESSES = int(os.environ.get("INGEST_EXTRACT_PROCESSES", 0))
+    # Text extracted from uploads (gzipped sections), kept out of the DB rows
+    EXTRACTED_TEXT_PATH = os.environ.get("EXTRACTED_TEXT_PATH")
+    # Uploads are stored once per sha256 of their bytes
+    BLOB_STORE_PATH = os.environ.get("BLOB_STORE_PATH")
+    # Resumable uploads: size limit, suggested chunk size and how long an idle
+    # upload is kept before its partial file is discarded
+    UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", 10737418240))
+    UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 8388608))
+    UPLOAD_SESSION_TTL = int(os.environ.get("UPLOAD_SESSION_TTL", 86400))
+    # Per user: open resumable uploads and the disk space they preallocate
+    UPLOAD_MAX_SESSIONS = int(os.environ.get("UPLOAD_MAX_SESSIONS", 5))
+    UPLOAD_MAX_RESERVED_BYTES = int(
+        os.environ.get("UPLOAD_MAX_RESERVED_BYTES", 21474836480)
+    )
     # Add other base configurations here
 
 
@@ -57,6 +211,9 @@ class TestingConfig(Config):
     """Testing configuration."""
 
     TESTING = True
+    MODEL_WARMUP = False
+    # Worker processes cannot see an in-memory database
+    INGEST_WORKERS = 0
     SQLALCHEMY_DATABASE_URI = (
         "sqlite:///:memory:"  # Use in-memory SQLite database for tests
     )
@@ -15,6 +15,8 @@ from .services.notification_service import NotificationService
 from .services.scheduler_service import SchedulerService
 from .services.visualization_service import VisualizationService
 from .services.notion_service import NotionService
+from .services.model_registry import warm_up
+from .services.reranker import get_reranker
 
 # Import all blueprints
 from .routes.chat import chat_bp
@@ -34,6 +36,8 @@ def create_app(config_object=DevelopmentConfig):
     """Create and configure an instance of the Flask application."""
     app = Flask(__name__, static_folder="../../frontend/build", static_url_path="/")
     app.config.from_object(config_object)
+    # Ingestion worker processes build their own app from the same config
+    app.config["CONFIG_OBJECT"] = config_object
 
     # Enable CORS
     CORS(app, resources={r"/api/*": {"origins": "*"}})
@@ -59,6 +63,16 @@ def create_app(config_object=DevelopmentConfig):
         app.visualization_service = VisualizationService()
         app.notion_service = NotionService()
 
+    # Load the embedding model (and cross-encoder, if re-ranking is on) in the
+    # background; requests share them once ready
+    if app.config.get("MODEL_WARMUP", True):
+        loaders = [app.ai_service.load_embedding_backend]
+        with app.app_context():
+            reranker = get_reranker()
+        if reranker:
+            loaders.append(reranker.load)
+        warm_up(app, loaders)
+
     # Register blueprints
     app.register_blueprint(chat_bp)
     app.register_blueprint(profile_bp)
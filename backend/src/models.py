@@ -204,6 +204,39 @@ class UploadedFile(db.Model):
         }
 
 
+class UploadSession(db.Model):
+    """A resumable upload in progress; ``received`` bytes have been written"""
+
+    __tablename__ = "upload_sessions"
+
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    original_filename = db.Column(db.String(255), nullable=False)
+    file_type = db.Column(db.String(50))
+    file_size = db.Column(db.BigInteger, nullable=False)
+    received = db.Column(db.BigInteger, nullable=False, default=0)
+    sha256 = db.Column(db.String(64))  # expected hash of the whole file, if given
+    temp_path = db.Column(db.String(255), nullable=False)
+    writer = db.Column(db.String(32))  # claim token of the request writing a chunk
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+    def to_dict(self):
+        return {
+            "upload_id": self.id,
+            "user_id": self.user_id,
+            "filename": self.original_filename,
+            "file_type": self.file_type,
+            "file_size": self.file_size,
+            "offset": self.received,
+            "complete": self.received == self.file_size,
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat(),
+        }
+
+
 class RAGDocument(db.Model):
     __tablename__ = "rag_documents"
 
@@ -238,6 +271,28 @@ class RAGDocument(db.Model):
         }
 
 
+class RAGChunkRef(db.Model):
+    """One chunk of a RAG document and the vector that holds its text
+
+    Identical chunks of one user share a vector; ``is_owner`` marks the
+    reference whose document the vector's metadata points at.
+    """
+
+    __tablename__ = "rag_chunk_refs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    doc_id = db.Column(
+        db.Integer, db.ForeignKey("rag_documents.id"), nullable=False, index=True
+    )
+    chunk_index = db.Column(db.Integer, nullable=False)
+    chunk_hash = db.Column(db.String(64), nullable=False)  # sha256 of the text
+    vector_id = db.Column(db.String(64), nullable=False, index=True)
+    is_owner = db.Column(db.Boolean, default=False)
+
+    __table_args__ = (db.Index("ix_rag_chunk_refs_user_hash", "user_id", "chunk_hash"),)
+
+
 class Notification(db.Model):
     __tablename__ = "notifications"
 
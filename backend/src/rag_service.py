@@ -3,115 +3,450 @@ import numpy as np
 import os
 import json
 import pickle
+import struct
+import threading
+import uuid
+import zlib
 from typing import List, Dict, Any
+from flask import current_app
 from src.services.ai_service import AIService
+from src.services.model_registry import get_app_service, get_tokenizer
+from src.services.chunking import chunk_document, make_token_splitter
+from src.services.document_store import DocumentStore
+from src.services.query_cache import QueryResultCache
+from src.services.reranker import get_reranker
+from src.services.shard_cache import ShardCache, validate_namespace
+from src.services.lexical_index import (
+    RETRIEVAL_MODES,
+    BM25Index,
+    reciprocal_rank_fusion,
+)
+from src.services.vector_index import (
+    INDEX_TIERS,
+    create_index,
+    index_tier,
+    migrate_index,
+    search_params,
+    target_tier,
+)
+
+# Each append-log record is a fixed header (magic, payload length, crc32)
+# followed by a pickled payload of new vectors and the id of the first one.
+# Document texts and metadata live in the DocumentStore, which is durable on
+# its own and is always written before the matching log record.
+LOG_MAGIC = b"RWAL"
+LOG_HEADER = struct.Struct("<4sII")
 
 
 class RAGService:
-    def __init__(self):
-        self.ai_service = AIService()
+    """FAISS index, document store and BM25 index for one tenant
+
+    The default (``namespace`` None) shard lives in data/vector_db; every
+    other namespace gets its own directory under data/vector_db/tenants, so
+    searches and rebuilds only ever touch that tenant's data.
+    """
+
+    def __init__(self, namespace: str = None, ai_service: AIService = None):
+        self.namespace = namespace
+        self.ai_service = ai_service or AIService()
         self.index = None
-        self.documents = []
         self.embeddings_dim = 384  # dimension for all-MiniLM-L6-v2
         self.index_path = os.path.join(
             os.path.dirname(__file__), "..", "..", "data", "vector_db"
         )
+        if namespace is not None:
+            self.index_path = os.path.join(
+                self.index_path, "tenants", validate_namespace(namespace)
+            )
+        self.index_file = os.path.join(self.index_path, "faiss_index.bin")
+        # Legacy pickled document list, migrated into the DocumentStore on load
+        self.docs_file = os.path.join(self.index_path, "documents.pkl")
+        self.log_file = os.path.join(self.index_path, "documents.wal")
+        self.compact_every = int(current_app.config.get("RAG_LOG_COMPACT_EVERY", 500))
+        self._log_entries = 0
+        # Guards the index, document store and append log across request threads
+        self._lock = threading.RLock()
+        self.embed_batch_size = int(current_app.config.get("RAG_EMBED_BATCH_SIZE", 32))
+        self.chunk_tokens = int(current_app.config.get("RAG_CHUNK_TOKENS", 200))
+        self.chunk_overlap = int(current_app.config.get("RAG_CHUNK_OVERLAP", 40))
+        self._split_tokens = None
+        self.index_type = current_app.config.get("RAG_INDEX_TYPE", "auto")
+        self.ivf_threshold = int(current_app.config.get("RAG_IVF_THRESHOLD", 50000))
+        self.pq_threshold = int(current_app.config.get("RAG_PQ_THRESHOLD", 1000000))
+        self.ivf_nlist = int(current_app.config.get("RAG_IVF_NLIST", 0))
+        self.pq_m = int(current_app.config.get("RAG_PQ_M", 48))
+        self.hnsw_m = int(current_app.config.get("RAG_HNSW_M", 32))
+        self.default_nprobe = int(current_app.config.get("RAG_IVF_NPROBE", 16))
+        self.default_ef_search = int(current_app.config.get("RAG_HNSW_EF_SEARCH", 64))
+        self.hybrid_candidates = int(
+            current_app.config.get("RAG_HYBRID_CANDIDATES", 50)
+        )
+        self.rrf_k = int(current_app.config.get("RAG_RRF_K", 60))
+        self.reranker = get_reranker()
+        self.rerank_candidates = int(
+            current_app.config.get("RAG_RERANK_CANDIDATES", 30)
+        )
+        # Shared by all shards, so results outlive a shard's eviction
+        self.cache_scope = "local" if namespace is None else f"local:{namespace}"
+        self.query_cache = None
+        if current_app.config.get("RAG_QUERY_CACHE_ENABLED", True):
+            self.query_cache = get_app_service(
+                "local_query_cache",
+                lambda: QueryResultCache(
+                    int(current_app.config.get("RAG_QUERY_CACHE_SIZE", 1024)),
+                    float(current_app.config.get("RAG_QUERY_CACHE_TTL", 300)),
+                ),
+            )
         self._ensure_data_dir()
+        self.doc_store = DocumentStore(self.index_path)
         self._load_or_create_index()
+        self._build_lexical_index()
 
     def _ensure_data_dir(self):
         """Ensure data directory exists"""
         os.makedirs(self.index_path, exist_ok=True)
 
     def _load_or_create_index(self):
-        """Load existing index or create new one"""
-        index_file = os.path.join(self.index_path, "faiss_index.bin")
-        docs_file = os.path.join(self.index_path, "documents.pkl")
-
-        if os.path.exists(index_file) and os.path.exists(docs_file):
+        """Load the last index snapshot, then replay the append log on top of it"""
+        index_lost = False
+        if os.path.exists(self.index_file):
             try:
-                self.index = faiss.read_index(index_file)
-                with open(docs_file, "rb") as f:
-                    self.documents = pickle.load(f)
-                print(f"Loaded existing index with {len(self.documents)} documents")
+                self.index = faiss.read_index(self.index_file)
+                print(f"Loaded existing index with {self.index.ntotal} vectors")
+                if self.index.metric_type != faiss.METRIC_INNER_PRODUCT:
+                    print(
+                        "Index uses L2 over unnormalized embeddings; "
+                        "call rebuild_index() to migrate to inner product"
+                    )
             except Exception as e:
                 print(f"Error loading index: {e}")
                 self._create_new_index()
+                index_lost = True
         else:
             self._create_new_index()
+            # Without a snapshot or log, stored documents have no vectors yet
+            index_lost = not os.path.exists(self.log_file)
+
+        self._migrate_pickled_documents()
+        self._replay_log()
+
+        if len(self.doc_store) > self.index.ntotal:
+            if index_lost:
+                # The texts survived, so the vectors can be recomputed
+                print("Rebuilding index from the document store")
+                self._rebuild_index(self.embed_batch_size)
+            else:
+                # Documents written just before a crash, never acknowledged
+                print(
+                    f"Dropping {len(self.doc_store) - self.index.ntotal} "
+                    "documents that never reached the index"
+                )
+                self.doc_store.truncate(self.index.ntotal)
+
+    def _migrate_pickled_documents(self):
+        """One-time import of the legacy documents.pkl into the DocumentStore"""
+        if len(self.doc_store) or not os.path.exists(self.docs_file):
+            return
+        try:
+            with open(self.docs_file, "rb") as f:
+                documents = pickle.load(f)
+            self.doc_store.append(
+                [dict(doc, id=doc_id) for doc_id, doc in enumerate(documents)]
+            )
+            os.replace(self.docs_file, self.docs_file + ".migrated")
+            print(f"Migrated {len(documents)} documents from documents.pkl")
+        except Exception as e:
+            print(f"Error migrating documents.pkl: {e}")
+
+    def _build_lexical_index(self):
+        """Index the text of every live chunk for BM25 search"""
+        self.lexical_index = BM25Index()
+        for batch in self.doc_store.iter_documents(include_deleted=False):
+            for doc in batch:
+                self.lexical_index.add(doc["id"], doc["text"])
+        if len(self.lexical_index):
+            print(f"Built lexical index over {len(self.lexical_index)} chunks")
+
+    def _invalidate_results(self):
+        """Forget cached search results after the corpus changes"""
+        if self.query_cache:
+            self.query_cache.invalidate(self.cache_scope)
 
     def _create_new_index(self):
-        """Create new FAISS index"""
-        self.index = faiss.IndexFlatL2(self.embeddings_dim)
-        self.documents = []
+        """Create new FAISS inner-product index over normalized embeddings"""
+        self.index = create_index(
+            self._target_tier(0), self.embeddings_dim, **self._index_kwargs()
+        )
         print("Created new FAISS index")
 
+    def _index_kwargs(self) -> Dict[str, Any]:
+        return {"nlist": self.ivf_nlist, "pq_m": self.pq_m, "hnsw_m": self.hnsw_m}
+
+    def _target_tier(self, ntotal: int) -> str:
+        return target_tier(
+            ntotal, self.index_type, self.ivf_threshold, self.pq_threshold
+        )
+
+    def _maybe_upgrade_index(self):
+        """Train and migrate to a faster index tier once the corpus outgrows the current one"""
+        current = index_tier(self.index)
+        target = self._target_tier(self.index.ntotal)
+        if INDEX_TIERS[target] <= INDEX_TIERS[current]:
+            return
+
+        print(f"Migrating FAISS index from {current} to {target}")
+        self.index = migrate_index(self.index, target, **self._index_kwargs())
+        # Replayed log records assume the snapshot index, so snapshot right away
+        self._save_index()
+
+    @property
+    def normalize_embeddings(self) -> bool:
+        """Legacy L2 indexes keep receiving unnormalized vectors until rebuilt"""
+        return self.index.metric_type == faiss.METRIC_INNER_PRODUCT
+
+    def _to_similarity(self, score: float) -> float:
+        """Map a raw FAISS score to a similarity where higher is better"""
+        if self.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            return float(score)  # cosine similarity on normalized vectors
+        return float(1 / (1 + score))  # Convert distance to similarity
+
+    @property
+    def split_tokens(self):
+        """Token splitter matching the embedding model's tokenizer"""
+        if self._split_tokens is None:
+            self._split_tokens = make_token_splitter(
+                get_tokenizer(self.ai_service.embedding_model_name)
+            )
+        return self._split_tokens
+
+    def chunk_text(self, text: str, doc_format: str = "txt"):
+        """Split text into token-bounded chunks that fit the embedding model"""
+        return chunk_document(
+            text, self.split_tokens, doc_format, self.chunk_tokens, self.chunk_overlap
+        )
+
     def add_document(self, text: str, metadata: Dict[str, Any] = None):
         """Add document to the vector database"""
         if not text.strip():
             return False
 
-        try:
-            # Get embeddings
-            embeddings = self.ai_service.get_embeddings(text)
-            if embeddings is None:
-                return False
+        result = self.add_documents_batch([{"text": text, "metadata": metadata}])
+        if result["failed"]:
+            print(f"Error adding document: {result['failed'][0]['error']}")
+            return False
+        return True
 
-            # Add to index
-            embeddings_flat = embeddings.flatten().astype("float32")
-            self.index.add(np.array([embeddings_flat]))
+    def add_documents_batch(
+        self, documents: List[Dict[str, Any]], batch_size: int = None
+    ) -> Dict[str, Any]:
+        """Chunk and embed documents in padded micro-batches, then persist in one write
+
+        Every chunk becomes its own vector and document record carrying the
+        ``parent_id`` of the source document and its ``chunk_index``.
+        """
+        batch_size = batch_size or self.embed_batch_size
+        errors = {}
+        pending = []
+        for position, doc in enumerate(documents):
+            text = doc.get("text", "") if isinstance(doc, dict) else ""
+            if not isinstance(text, str) or not text.strip():
+                errors[position] = "Text cannot be empty"
+                continue
+            metadata = doc.get("metadata") or {}
+            parent_id = str(doc.get("id") or metadata.get("doc_id") or uuid.uuid4().hex)
+            doc_format = doc.get("format") or metadata.get("file_type") or "txt"
+            for chunk in self.chunk_text(text, doc_format):
+                pending.append((position, parent_id, metadata, chunk))
+
+        vectors = {}
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start : start + batch_size]
+            # One tokenizer call and one forward pass per micro-batch
+            embeddings = self.ai_service.get_embeddings(
+                [chunk["text"] for _, _, _, chunk in batch],
+                normalize=self.normalize_embeddings,
+            )
+            if embeddings is None or len(embeddings) != len(batch):
+                for position, _, _, _ in batch:
+                    errors.setdefault(position, "Failed to create embedding")
+                continue
+            for offset, vector in enumerate(embeddings.astype("float32")):
+                vectors[start + offset] = vector
+
+        # A document is only stored if every one of its chunks was embedded
+        new_docs = []
+        new_vectors = []
+        added_positions = set()
+        for i, (position, parent_id, metadata, chunk) in enumerate(pending):
+            if position in errors:
+                continue
+            added_positions.add(position)
+            new_vectors.append(vectors[i])
+            new_docs.append(
+                {
+                    "text": chunk["text"],
+                    "metadata": metadata,
+                    "parent_id": parent_id,
+                    "chunk_index": chunk["index"],
+                }
+            )
 
-            # Store document
-            doc_data = {
-                "text": text,
-                "metadata": metadata or {},
-                "id": len(self.documents),
-            }
-            self.documents.append(doc_data)
+        if new_docs:
+            try:
+                matrix = np.vstack(new_vectors)
+                with self._lock:
+                    base_id = self.index.ntotal
+                    for offset, doc in enumerate(new_docs):
+                        doc["id"] = base_id + offset
+                    # Store texts, then log vectors, then apply in memory
+                    self.doc_store.append(new_docs)
+                    self._append_to_log(matrix, base_id)
+                    self.index.add(matrix)
+                    for doc in new_docs:
+                        self.lexical_index.add(doc["id"], doc["text"])
+                    self._invalidate_results()
+                    self._maybe_upgrade_index()
+                    self._maybe_compact()
+            except Exception as e:
+                print(f"Error adding document batch: {e}")
+                for position in added_positions:
+                    errors[position] = str(e)
+                added_positions = set()
+
+        failed = [
+            {"index": position, "error": error}
+            for position, error in sorted(errors.items())
+        ]
+        return {"success_count": len(added_positions), "failed": failed}
+
+    def delete_document(self, parent_id: str) -> int:
+        """Remove every chunk of a source document from search results
+
+        Chunks are tombstoned in the document store and dropped from the
+        lexical index; their vectors are skipped until the next rebuild.
+        """
+        with self._lock:
+            ids = self.doc_store.ids_for_parent(parent_id)
+            self.doc_store.mark_deleted(ids)
+            for doc_id in ids:
+                self.lexical_index.remove(doc_id)
+            self._invalidate_results()
+        return len(ids)
+
+    def _vector_search(
+        self, query: str, k: int, nprobe: int = None, ef_search: int = None
+    ) -> List[tuple]:
+        """Nearest chunk ids and raw scores; over-fetches to skip tombstones"""
+        if self.index.ntotal == 0:
+            return []
 
-            # Save index
-            self._save_index()
-            return True
+        # Get query embeddings
+        query_embeddings = self.ai_service.get_embeddings(
+            query, normalize=self.normalize_embeddings
+        )
+        if query_embeddings is None:
+            return []
 
-        except Exception as e:
-            print(f"Error adding document: {e}")
-            return False
+        # Search
+        query_flat = query_embeddings.flatten().astype("float32")
+        fetch_k = k + min(self.doc_store.deleted_count(), 4 * k)
+        with self._lock:
+            params = search_params(
+                self.index,
+                nprobe=nprobe or self.default_nprobe,
+                ef_search=ef_search or self.default_ef_search,
+            )
+            distances, indices = self.index.search(
+                np.array([query_flat]), fetch_k, params=params
+            )
+        return [
+            (int(idx), distance)
+            for distance, idx in zip(distances[0], indices[0])
+            if idx >= 0
+        ]
+
+    def search(
+        self,
+        query: str,
+        k: int = 5,
+        nprobe: int = None,
+        ef_search: int = None,
+        mode: str = "vector",
+        rerank: bool = None,
+    ) -> List[Dict[str, Any]]:
+        """Search for similar documents
+
+        ``mode`` is "vector", "lexical" (BM25) or "hybrid", which fuses both
+        rankings with reciprocal-rank fusion. In hybrid mode the lexical side
+        supplies the extra candidates, so the vector side only fetches ``k``.
+        ``nprobe`` (IVF tiers) and ``ef_search`` (HNSW) trade latency for recall
+        and default to RAG_IVF_NPROBE / RAG_HNSW_EF_SEARCH. With ``rerank``
+        (default: on when RAG_RERANK_ENABLED) RAG_RERANK_CANDIDATES are
+        fetched and a cross-encoder picks the best ``k`` of them.
+        """
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        rerank = self.reranker is not None and rerank is not False
+
+        cache_key = None
+        if self.query_cache:
+            cache_key = self.query_cache.key(
+                self.cache_scope, query, k, mode, nprobe, ef_search, rerank
+            )
+            cached = self.query_cache.get(cache_key)
+            if cached is not None:
+                return [dict(doc) for doc in cached]
 
-    def add_documents_batch(self, documents: List[Dict[str, Any]]):
-        """Add multiple documents at once"""
-        success_count = 0
-        for doc in documents:
-            text = doc.get("text", "")
-            metadata = doc.get("metadata", {})
-            if self.add_document(text, metadata):
-                success_count += 1
-        return success_count
-
-    def search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
-        """Search for similar documents"""
-        if self.index.ntotal == 0:
-            return []
+        top_k = k
+        if rerank:
+            k = max(k, self.rerank_candidates)
 
         try:
-            # Get query embeddings
-            query_embeddings = self.ai_service.get_embeddings(query)
-            if query_embeddings is None:
-                return []
-
-            # Search
-            query_flat = query_embeddings.flatten().astype("float32")
-            distances, indices = self.index.search(np.array([query_flat]), k)
+            vector_hits = {}
+            if mode != "lexical":
+                for idx, distance in self._vector_search(query, k, nprobe, ef_search):
+                    vector_hits.setdefault(idx, self._to_similarity(distance))
+
+            lexical_hits = {}
+            if mode != "vector":
+                depth = self.hybrid_candidates if mode == "hybrid" else k
+                lexical_hits = dict(self.lexical_index.search(query, max(depth, k)))
+
+            if mode == "hybrid":
+                fused = reciprocal_rank_fusion(
+                    [list(vector_hits), list(lexical_hits)], k=self.rrf_k
+                )
+            else:
+                fused = [
+                    (idx, None)
+                    for idx in (vector_hits if mode == "vector" else lexical_hits)
+                ]
+
+            # Only the hits are read back from the document store
+            docs = self.doc_store.get_many([idx for idx, _ in fused])
 
             # Return results
             results = []
-            for i, (distance, idx) in enumerate(zip(distances[0], indices[0])):
-                if idx < len(self.documents):
-                    doc = self.documents[idx].copy()
-                    doc["similarity_score"] = float(
-                        1 / (1 + distance)
-                    )  # Convert distance to similarity
-                    results.append(doc)
-
+            for idx, fusion_score in fused:
+                if idx not in docs:
+                    continue
+                doc = docs[idx]
+                doc["similarity_score"] = vector_hits.get(idx)
+                if mode != "vector":
+                    doc["lexical_score"] = lexical_hits.get(idx)
+                if fusion_score is not None:
+                    doc["fusion_score"] = fusion_score
+                results.append(doc)
+                if len(results) == k:
+                    break
+
+            reranked = True
+            if rerank:
+                results, reranked = self.reranker.rerank(query, results, top_k)
+
+            # A fallback order must not be served as re-ranked for the whole TTL
+            if cache_key and reranked:
+                self.query_cache.put(cache_key, [dict(doc) for doc in results])
             return results
 
         except Exception as e:
@@ -171,29 +506,193 @@ class RAGService:
             "confidence": avg_similarity,
         }
 
+    def _append_to_log(self, vectors: np.ndarray, base_id: int):
+        """Durably append new vectors, starting at id ``base_id``, to the log"""
+        payload = pickle.dumps({"base_id": base_id, "vectors": vectors})
+        header = LOG_HEADER.pack(LOG_MAGIC, len(payload), zlib.crc32(payload))
+        with open(self.log_file, "ab") as f:
+            f.write(header + payload)
+            f.flush()
+            os.fsync(f.fileno())
+        self._log_entries += len(vectors)
+
+    def _read_log(self):
+        """Read intact log records, returning them and the end of the valid prefix"""
+        records = []
+        valid_end = 0
+        with open(self.log_file, "rb") as f:
+            while True:
+                header = f.read(LOG_HEADER.size)
+                if len(header) < LOG_HEADER.size:
+                    break
+                magic, length, checksum = LOG_HEADER.unpack(header)
+                payload = f.read(length)
+                if (
+                    magic != LOG_MAGIC
+                    or len(payload) < length
+                    or zlib.crc32(payload) != checksum
+                ):
+                    break
+                records.append(pickle.loads(payload))
+                valid_end = f.tell()
+        return records, valid_end
+
+    def _replay_log(self):
+        """Apply log records that are newer than the loaded snapshot"""
+        if not os.path.exists(self.log_file):
+            return
+
+        try:
+            records, valid_end = self._read_log()
+        except Exception as e:
+            print(f"Error reading append log: {e}")
+            return
+
+        # Drop a torn tail left by a crash mid-append
+        if valid_end < os.path.getsize(self.log_file):
+            print("Truncating incomplete record at end of append log")
+            with open(self.log_file, "r+b") as f:
+                f.truncate(valid_end)
+
+        replayed = 0
+        for record in records:
+            base_id = record["base_id"]
+            if base_id > self.index.ntotal:
+                print(f"Append log has a gap at id {base_id}, stopping replay")
+                break
+
+            # Records written before the DocumentStore also carried documents
+            legacy_docs = record.get("documents") or []
+            self.doc_store.append(
+                [
+                    dict(doc, id=base_id + offset)
+                    for offset, doc in enumerate(legacy_docs)
+                    if base_id + offset >= len(self.doc_store)
+                ]
+            )
+
+            # Skip vectors that are already part of the snapshot
+            new_vectors = record["vectors"][self.index.ntotal - base_id :]
+            if len(new_vectors):
+                self.index.add(new_vectors)
+                replayed += len(new_vectors)
+
+        self._log_entries = sum(len(r["vectors"]) for r in records)
+        if replayed:
+            print(f"Replayed {replayed} vectors from append log")
+        self._maybe_upgrade_index()
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        """Fold the append log into a fresh snapshot once it grows large enough"""
+        if self._log_entries >= self.compact_every:
+            self._save_index()
+
     def _save_index(self):
-        """Save index and documents to disk"""
+        """Write an index snapshot, then truncate the append log"""
         try:
-            index_file = os.path.join(self.index_path, "faiss_index.bin")
-            docs_file = os.path.join(self.index_path, "documents.pkl")
+            index_tmp = self.index_file + ".tmp"
+            faiss.write_index(self.index, index_tmp)
+            os.replace(index_tmp, self.index_file)
 
-            faiss.write_index(self.index, index_file)
-            with open(docs_file, "wb") as f:
-                pickle.dump(self.documents, f)
+            with open(self.log_file, "wb") as f:
+                os.fsync(f.fileno())
+            self._log_entries = 0
 
         except Exception as e:
             print(f"Error saving index: {e}")
 
+    def compact(self):
+        """Force the append log to be folded into a snapshot"""
+        with self._lock:
+            self._save_index()
+        return True
+
     def get_stats(self) -> Dict[str, Any]:
         """Get RAG system statistics"""
         return {
-            "total_documents": len(self.documents),
+            "namespace": self.namespace,
+            "total_documents": len(self.doc_store),
+            "deleted_documents": self.doc_store.deleted_count(),
+            "lexical_documents": len(self.lexical_index),
             "index_size": self.index.ntotal if self.index else 0,
             "embeddings_dimension": self.embeddings_dim,
+            "index_type": index_tier(self.index) if self.index else None,
+            "pending_log_entries": self._log_entries,
+            "query_cache": (
+                {"enabled": True, **self.query_cache.get_stats()}
+                if self.query_cache
+                else {"enabled": False}
+            ),
+            "embedding_cache": (
+                self.ai_service.embedding_cache.get_stats()
+                if self.ai_service.embedding_cache
+                else {"enabled": False}
+            ),
+            "rerank": (
+                {"enabled": True, **self.reranker.get_stats()}
+                if self.reranker
+                else {"enabled": False}
+            ),
         }
 
+    def rebuild_index(self, batch_size: int = None):
+        """Re-embed every stored document into a fresh normalized inner-product index"""
+        with self._lock:
+            return self._rebuild_index(batch_size or self.embed_batch_size)
+
+    def _rebuild_index(self, batch_size: int):
+        vectors = []
+        for batch in self.doc_store.iter_documents(batch_size):
+            embeddings = self.ai_service.get_embeddings(
+                [doc["text"] for doc in batch], normalize=True
+            )
+            if embeddings is None:
+                print("Error rebuilding index: failed to create embeddings")
+                return False
+            vectors.append(embeddings.astype("float32"))
+
+        flat = faiss.IndexFlatIP(self.embeddings_dim)
+        if vectors:
+            flat.add(np.vstack(vectors))
+        tier = self._target_tier(flat.ntotal)
+        if tier == "flat":
+            self.index = flat
+        else:
+            self.index = migrate_index(flat, tier, **self._index_kwargs())
+        self._invalidate_results()
+        self._save_index()
+        return True
+
     def clear_index(self):
         """Clear all documents from index"""
-        self._create_new_index()
-        self._save_index()
+        with self._lock:
+            self._create_new_index()
+            self.doc_store.clear()
+            self.lexical_index = BM25Index()
+            self._invalidate_results()
+            self._save_index()
         return True
+
+
+def get_local_rag_service(namespace: str = None) -> RAGService:
+    """Get the RAGService shard for a tenant namespace (None: the shared index)
+
+    Shards are loaded on first use and kept in an app-wide LRU; cold ones are
+    dropped from memory once more than RAG_TENANT_MAX_PARTITIONS are loaded
+    or they hold over RAG_TENANT_MAX_VECTORS vectors.
+    """
+    config = current_app.config
+    ai_service = get_app_service("local_rag_ai_service", AIService)
+    shards = get_app_service(
+        "local_rag_shards",
+        lambda: ShardCache(
+            lambda key: RAGService(key, ai_service),
+            max_shards=int(config.get("RAG_TENANT_MAX_PARTITIONS", 32)),
+            max_size=int(config.get("RAG_TENANT_MAX_VECTORS", 2000000)),
+            size=lambda shard: shard.index.ntotal if shard.index else 0,
+        ),
+    )
+    if namespace is not None:
+        validate_namespace(namespace)
+    return shards.get(namespace)
@@ -1,5 +1,17 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import (
+    Blueprint,
+    Response,
+    request,
+    jsonify,
+    current_app,
+    stream_with_context,
+)
 from ..models import db, ChatSession, ChatMessage
+from ..services.lexical_index import RETRIEVAL_MODES
+from ..services.llm_client import UpstreamUnavailableError
+from ..services.pipeline import StageTimer, get_pipeline_executor, stage
+from ..services.shard_cache import InvalidNamespaceError
+from datetime import datetime
 import json
 
 chat_bp = Blueprint("chat", __name__, url_prefix="/api/chat")
@@ -54,65 +66,249 @@ def delete_chat_session(session_id):
     return "", 204
 
 
+def _rag_prompt(user_message, user_id, mode="vector", timer=None):
+    """Retrieve packed context for a question and wrap both into the Gemini prompt
+
+    Returns the prompt, the context text and the JSON-encoded packed sources.
+    """
+    packed = current_app.rag_service.build_rag_context(
+        user_message, user_id, mode=mode, timer=timer
+    )
+    context = packed["context"]
+    prompt = f"ใช้บริบทนี้เพื่อตอบคำถาม:\n---\n{context}\n---\nคำถาม: {user_message}"
+    return prompt, context, json.dumps(packed["sources"], ensure_ascii=False)
+
+
+def _save_user_message(app, session_id, content, timer=None):
+    """Store the user's message and touch its session (runs off the request thread)
+
+    Returns the message id, so a request that ends without an answer can
+    remove the message again with _discard_user_message.
+    """
+    with app.app_context():
+        with stage(timer, "save_user_message"):
+            message = ChatMessage(session_id=session_id, content=content, role="user")
+            db.session.add(message)
+            chat_session = db.session.get(ChatSession, session_id)
+            if chat_session:
+                chat_session.updated_at = datetime.utcnow()
+            db.session.commit()
+            return message.id
+
+
+def _discard_user_message(saved):
+    """Delete a user message saved by _save_user_message if no answer followed
+
+    Otherwise every retry of a failed request would add another copy.
+    """
+    db.session.rollback()
+    if saved is None:
+        return
+    try:
+        message_id = saved.result()
+    except Exception:
+        return  # never stored
+    ChatMessage.query.filter_by(id=message_id).delete()
+    db.session.commit()
+
+
+def _sse(event, payload):
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
 @chat_bp.route("/sessions/<int:session_id>/messages", methods=["POST"])
 def send_message(session_id):
-    """Send a message and get AI response"""
+    """Send a message and get AI response
+
+    Saving the user message overlaps retrieval and generation; per-stage
+    timings are returned in ``timings`` and the ``Server-Timing`` header.
+    """
     data = request.get_json()
     user_message = data.get("message")
     use_rag = data.get("use_rag", False)
     user_id = data.get("user_id", 1)  # Default to user_id=1 if not provided
+    use_cache = data.get("use_cache", True)
+    rag_mode = data.get("rag_mode", "vector")
 
     # Validate input
     if not user_message:
         return jsonify({"error": "Message is required"}), 400
+    if rag_mode not in RETRIEVAL_MODES:
+        return (
+            jsonify({"error": f"rag_mode must be one of {', '.join(RETRIEVAL_MODES)}"}),
+            400,
+        )
 
+    timer = StageTimer()
+    user_msg_saved = None
     try:
-        # Save user message
-        user_msg = ChatMessage(session_id=session_id, content=user_message, role="user")
-        db.session.add(user_msg)
+        # Save user message on a pipeline thread while retrieval runs
+        user_msg_saved = get_pipeline_executor().submit(
+            _save_user_message,
+            current_app._get_current_object(),
+            session_id,
+            user_message,
+            timer,
+        )
 
         # Generate AI response
         if use_rag:
-            context = current_app.rag_service.get_rag_context(
-                user_message, user_id=user_id
-            )
-            prompt = f"ใช้บริบทนี้เพื่อตอบคำถาม:\n---\n{context}\n---\nคำถาม: {user_message}"
-            result = current_app.ai_service.generate_with_gemini(prompt)
+            with timer.stage("retrieval"):
+                prompt, context, sources = _rag_prompt(
+                    user_message, user_id, rag_mode, timer
+                )
+            with timer.stage("generation"):
+                result = current_app.ai_service.generate_with_cache(
+                    prompt,
+                    user_id,
+                    question=user_message,
+                    context=context,
+                    use_cache=use_cache,
+                )
             ai_response = result.get(
                 "response", result.get("error", "เกิดข้อผิดพลาดในการสร้างคำตอบ")
             )
-            # For simplicity, we'll just pass the context as sources for now
-            sources = json.dumps([{"context": context}])
             confidence = None  # Confidence score might not be directly available
         else:
-            result = current_app.ai_service.generate_with_gemini(user_message)
+            with timer.stage("generation"):
+                result = current_app.ai_service.generate_with_cache(
+                    user_message, user_id, use_cache=use_cache
+                )
             ai_response = result.get(
                 "response",
                 result.get("error", "An error occurred while generating the response"),
             )
             sources = None
+            confidence = None
+
+        # The user message has to be stored before the answer that follows it
+        user_msg_saved.result()
+
+        if result.get("status") == 503:
+            # Upstream overloaded or circuit open: tell the client to retry
+            _discard_user_message(user_msg_saved)
+            return jsonify({"error": result["error"]}), 503
 
         # Save AI response
-        ai_msg = ChatMessage(
-            session_id=session_id,
-            content=ai_response,
-            role="assistant",
-            sources=sources,
-            confidence=confidence,
+        with timer.stage("save_answer"):
+            ai_msg = ChatMessage(
+                session_id=session_id,
+                content=ai_response,
+                role="assistant",
+                sources=sources,
+                confidence_score=confidence,
+            )
+            db.session.add(ai_msg)
+            db.session.commit()
+
+        timings = timer.summary()
+        current_app.logger.info(f"send_message timings (ms): {timings}")
+        response = jsonify(
+            {
+                "message": ai_response,
+                "sources": sources,
+                "confidence": confidence,
+                "cached": result.get("cached", False),
+                "timings": timings,
+            }
         )
-        db.session.add(ai_msg)
-        db.session.commit()
+        response.headers["Server-Timing"] = timer.server_timing()
+        return response, 200
+
+    except InvalidNamespaceError:
+        _discard_user_message(user_msg_saved)
+        return jsonify({"error": "Invalid user_id"}), 400
+    except UpstreamUnavailableError as e:
+        _discard_user_message(user_msg_saved)
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        _discard_user_message(user_msg_saved)
+        return jsonify({"error": str(e)}), 500
 
+
+@chat_bp.route("/sessions/<int:session_id>/messages/stream", methods=["POST"])
+def stream_message(session_id):
+    """Send a message and stream the AI response as Server-Sent Events
+
+    Emits ``token`` events with text fragments as Gemini produces them, then a
+    ``done`` event once the assistant message has been saved (or ``error``).
+    """
+    data = request.get_json()
+    user_message = data.get("message")
+    use_rag = data.get("use_rag", False)
+    user_id = data.get("user_id", 1)
+    use_cache = data.get("use_cache", True)
+    rag_mode = data.get("rag_mode", "vector")
+
+    if not user_message:
+        return jsonify({"error": "Message is required"}), 400
+    if rag_mode not in RETRIEVAL_MODES:
         return (
-            jsonify(
-                {"message": ai_response, "sources": sources, "confidence": confidence}
-            ),
-            200,
+            jsonify({"error": f"rag_mode must be one of {', '.join(RETRIEVAL_MODES)}"}),
+            400,
         )
 
+    try:
+        # Save the user message before streaming starts
+        db.session.add(
+            ChatMessage(session_id=session_id, content=user_message, role="user")
+        )
+        db.session.commit()
+
+        if use_rag:
+            prompt, context, sources = _rag_prompt(user_message, user_id, rag_mode)
+        else:
+            prompt, context, sources = user_message, None, None
+    except InvalidNamespaceError:
+        db.session.rollback()
+        return jsonify({"error": "Invalid user_id"}), 400
+    except UpstreamUnavailableError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
+        db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
+    fragments = current_app.ai_service.stream_with_cache(
+        prompt,
+        user_id,
+        question=user_message,
+        context=context,
+        use_cache=use_cache,
+    )
+
+    @stream_with_context
+    def generate():
+        parts = []
+        try:
+            for text in fragments:
+                parts.append(text)
+                yield _sse("token", {"text": text})
+
+            ai_msg = ChatMessage(
+                session_id=session_id,
+                content="".join(parts),
+                role="assistant",
+                sources=sources,
+            )
+            db.session.add(ai_msg)
+            db.session.commit()
+            yield _sse("done", {"message_id": ai_msg.id, "sources": sources})
+        except UpstreamUnavailableError as e:
+            db.session.rollback()
+            yield _sse("error", {"error": str(e), "status": 503})
+        except Exception as e:
+            db.session.rollback()
+            yield _sse("error", {"error": str(e)})
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        # Disable proxy buffering so fragments reach the client immediately
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 
 # The RAG-specific routes might be better in their own blueprint/service file
 # For now, we remove them from chat and assume they are handled in file_upload
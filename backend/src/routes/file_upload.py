@@ -1,26 +1,32 @@
 import os
-import uuid
+import re
+import zipfile
 from datetime import datetime
 from flask import Blueprint, request, jsonify, current_app
 from werkzeug.utils import secure_filename
-from ..models import db, UploadedFile, RAGDocument
+from ..models import db, UploadedFile, UploadSession, RAGDocument
+from ..services.lexical_index import RETRIEVAL_MODES
+from ..services.shard_cache import InvalidNamespaceError
+from ..services.llm_client import UpstreamUnavailableError
+from ..services.job_queue import QueueFullError, ensure_workers, get_job_queue
+from ..services.blob_store import get_blob_store
+from ..services.file_extraction import supported_file_types
+from ..services.chunked_upload import (
+    ChecksumMismatch,
+    UploadConflict,
+    UploadLimitExceeded,
+    get_chunked_uploads,
+)
 
 file_upload_bp = Blueprint("file_upload", __name__, url_prefix="/api/files")
 
-# Allowed file extensions
-ALLOWED_EXTENSIONS = {
-    "pdf",
-    "html",
-    "csv",
-    "docx",
-    "doc",
-    "md",
-    "txt",
-    "xlsx",
-    "xls",
-    "pptx",
-    "ppt",
-}
+# Allowed file extensions: only what the ingestion workers can extract, so an
+# upload is not accepted just to fail every retry (legacy .doc/.ppt are not)
+ALLOWED_EXTENSIONS = supported_file_types()
+
+
+# Seconds a client should wait before retrying when the ingestion queue is full
+QUEUE_RETRY_AFTER = 30
 
 
 def allowed_file(filename):
@@ -33,16 +39,163 @@ def get_file_type(filename):
     return "unknown"
 
 
+def _queue_full_response(queue):
+    response = jsonify(
+        {
+            "error": "Too many files are waiting to be processed; try again later",
+            "pending": queue.pending(),
+        }
+    )
+    response.headers["Retry-After"] = str(QUEUE_RETRY_AFTER)
+    return response, 503
+
+
+def _save_upload(stream, original_filename):
+    """Store an upload (or archive member) in the blob store; returns its record"""
+    blob = get_blob_store().save(stream)
+    return {
+        "original_filename": original_filename,
+        "file_path": blob["path"],
+        "file_type": get_file_type(original_filename),
+        "file_size": blob["size"],
+        "sha256": blob["sha256"],
+    }
+
+
+def _existing_upload(user_id, record):
+    """The user's earlier upload of the same bytes as the same type, if any"""
+    return (
+        UploadedFile.query.filter_by(
+            user_id=user_id,
+            file_path=record["file_path"],
+            file_type=record["file_type"],
+        )
+        .order_by(UploadedFile.id)
+        .first()
+    )
+
+
+def _release_file(file_path):
+    """Delete a stored file once no UploadedFile row references it any more"""
+    get_blob_store().remove(
+        file_path,
+        lambda: UploadedFile.query.filter_by(file_path=file_path).count() > 0,
+    )
+
+
+def _drop_orphaned(uploaded_files):
+    """Delete new rows whose blob a concurrent file delete removed; returns them
+
+    Run after the rows are committed, so a delete that checked for
+    references before the commit cannot have been missed.
+    """
+    orphaned = [
+        uploaded_file
+        for uploaded_file in uploaded_files
+        if not get_blob_store().exists(uploaded_file.file_path)
+    ]
+    for uploaded_file in orphaned:
+        db.session.delete(uploaded_file)
+    if orphaned:
+        db.session.commit()
+    return orphaned
+
+
+def _register_upload(record, user_id, queue):
+    """Create the UploadedFile for a stored upload and queue it for ingestion
+
+    Bytes the user already uploaded (as the same type) return the existing
+    file instead of being indexed again.
+    """
+    existing = _existing_upload(user_id, record)
+    if existing is not None:
+        job_id = None
+        if not existing.is_processed:
+            # Unless a queued or running job already covers the file
+            try:
+                job_id, active = queue.enqueue_files(user_id, [existing.id])
+            except QueueFullError:
+                return _queue_full_response(queue)
+            job_id = job_id or active[existing.id]
+            ensure_workers()
+        return (
+            jsonify(
+                {
+                    "message": "File was already uploaded",
+                    "file_id": existing.id,
+                    "job_id": job_id,
+                    "status": "processed" if existing.is_processed else "queued",
+                    "duplicate": True,
+                    "filename": existing.original_filename,
+                    "file_type": existing.file_type,
+                    "file_size": existing.file_size,
+                    "sha256": record["sha256"],
+                    "processed": bool(existing.is_processed),
+                }
+            ),
+            200,
+        )
+
+    # Create database record for the uploaded file
+    uploaded_file = UploadedFile(
+        user_id=user_id,
+        original_filename=record["original_filename"],
+        file_path=record["file_path"],
+        file_type=record["file_type"],
+        file_size=record["file_size"],
+        is_processed=False,
+    )
+
+    db.session.add(uploaded_file)
+    db.session.commit()
+    if _drop_orphaned([uploaded_file]):
+        return (
+            jsonify({"error": "The file was deleted during the upload; try again"}),
+            409,
+        )
+
+    # Extraction, chunking and embedding run in the ingestion workers
+    try:
+        job_id = queue.enqueue(
+            "ingest_file", {"file_id": uploaded_file.id, "user_id": user_id}
+        )
+    except QueueFullError:
+        db.session.delete(uploaded_file)
+        db.session.commit()
+        _release_file(record["file_path"])
+        return _queue_full_response(queue)
+    ensure_workers()
+
+    return (
+        jsonify(
+            {
+                "message": "File uploaded and queued for processing",
+                "file_id": uploaded_file.id,
+                "job_id": job_id,
+                "status": "queued",
+                "duplicate": False,
+                "filename": uploaded_file.original_filename,
+                "file_type": uploaded_file.file_type,
+                "file_size": uploaded_file.file_size,
+                "sha256": record["sha256"],
+                "processed": False,
+            }
+        ),
+        202,
+    )
+
+
 @file_upload_bp.route("/upload", methods=["POST"])
 def upload_file():
-    """Upload and process files for RAG system"""
+    """Upload a file and queue it for RAG ingestion"""
+    record = None
     try:
         # Check if file is present
         if "file" not in request.files:
             return jsonify({"error": "No file provided"}), 400
 
         file = request.files["file"]
-        user_id = request.form.get("user_id", 1)  # Default user_id for demo
+        user_id = request.form.get("user_id", 1, type=int)  # Default user_id for demo
 
         if file.filename == "":
             return jsonify({"error": "No file selected"}), 400
@@ -50,74 +203,383 @@ def upload_file():
         if not allowed_file(file.filename):
             return jsonify({"error": "File type not allowed"}), 400
 
-        # Create upload directory if it doesn't exist
-        upload_dir = os.path.join(current_app.root_path, "uploads")
-        os.makedirs(upload_dir, exist_ok=True)
+        # Refuse before writing anything when the workers are saturated
+        queue = get_job_queue()
+        if not queue.has_capacity():
+            return _queue_full_response(queue)
+
+        # Hash while storing; identical bytes share one blob
+        record = _save_upload(file.stream, secure_filename(file.filename))
+        return _register_upload(record, user_id, queue)
 
-        # Generate unique filename
-        original_filename = secure_filename(file.filename)
-        file_extension = get_file_type(original_filename)
-        unique_filename = f"{uuid.uuid4().hex}.{file_extension}"
-        file_path = os.path.join(upload_dir, unique_filename)
+    except Exception as e:
+        db.session.rollback()
+        if record is not None:
+            _release_file(record["file_path"])
+        return jsonify({"error": f"Upload failed: {str(e)}"}), 500
 
-        # Save file
-        file.save(file_path)
-        file_size = os.path.getsize(file_path)
 
-        # Create database record for the uploaded file
-        # Maintain backward compatibility: set both file_path and stored_filename if model supports it
-        uploaded_file = UploadedFile(
-            user_id=user_id,
-            original_filename=original_filename,
-            file_path=file_path,
-            stored_filename=unique_filename,
-            file_type=file_extension,
-            file_size=file_size,
-            is_processed=False,
-        )
+def _save_archive(file, saved, skipped, max_files, max_bytes):
+    """Unpack the supported files of a zip upload, up to the batch limits"""
+    unpacked = 0
+    with zipfile.ZipFile(file.stream) as archive:
+        for info in archive.infolist():
+            name = secure_filename(os.path.basename(info.filename))
+            if info.is_dir() or not name or info.filename.startswith("__MACOSX/"):
+                continue
+            if not allowed_file(name):
+                skipped.append(
+                    {"filename": info.filename, "reason": "File type not allowed"}
+                )
+                continue
+            if len(saved) >= max_files:
+                raise ValueError(f"A batch can hold at most {max_files} files")
+            # The declared size bounds what ZipFile.open will return
+            unpacked += info.file_size
+            if unpacked > max_bytes:
+                raise ValueError(f"Archive unpacks to more than {max_bytes} bytes")
+            with archive.open(info) as member:
+                saved.append(_save_upload(member, name))
+
+
+@file_upload_bp.route("/upload/batch", methods=["POST"])
+def upload_files():
+    """Upload many files, or zip archives of them, as one ingestion job
+
+    Files the user already uploaded, or that repeat within the batch, are
+    reported under ``duplicates`` and not indexed again.
+    """
+    saved = []
+    try:
+        files = [file for file in request.files.getlist("files") if file.filename]
+        user_id = request.form.get("user_id", 1, type=int)  # Default user_id for demo
+
+        if not files:
+            return jsonify({"error": "No files provided"}), 400
+
+        queue = get_job_queue()
+        if not queue.has_capacity():
+            return _queue_full_response(queue)
+
+        max_files = int(current_app.config.get("INGEST_BATCH_MAX_FILES", 5000))
+        max_bytes = int(current_app.config.get("INGEST_ZIP_MAX_BYTES", 2 << 30))
+
+        skipped = []
+        try:
+            for file in files:
+                original_filename = secure_filename(file.filename)
+                if get_file_type(original_filename) == "zip":
+                    _save_archive(file, saved, skipped, max_files, max_bytes)
+                elif not allowed_file(original_filename):
+                    skipped.append(
+                        {"filename": file.filename, "reason": "File type not allowed"}
+                    )
+                elif len(saved) >= max_files:
+                    raise ValueError(f"A batch can hold at most {max_files} files")
+                else:
+                    saved.append(_save_upload(file.stream, original_filename))
+        except (ValueError, zipfile.BadZipFile) as e:
+            for record in saved:
+                _release_file(record["file_path"])
+            return jsonify({"error": str(e)}), 400
+
+        if not saved:
+            return (
+                jsonify({"error": "No supported files provided", "skipped": skipped}),
+                400,
+            )
 
-        db.session.add(uploaded_file)
+        # One bulk insert for the new files of the batch
+        uploaded_files = []
+        duplicates = []
+        seen = {}
+        for record in saved:
+            key = (record["file_path"], record["file_type"])
+            existing = seen.get(key) or _existing_upload(user_id, record)
+            if existing is not None:
+                duplicates.append((record, existing))
+                continue
+            seen[key] = UploadedFile(
+                user_id=user_id,
+                original_filename=record["original_filename"],
+                file_path=record["file_path"],
+                file_type=record["file_type"],
+                file_size=record["file_size"],
+                is_processed=False,
+            )
+            uploaded_files.append(seen[key])
+        db.session.add_all(uploaded_files)
         db.session.commit()
+        for uploaded_file in _drop_orphaned(uploaded_files):
+            uploaded_files.remove(uploaded_file)
+            skipped.append(
+                {
+                    "filename": uploaded_file.original_filename,
+                    "reason": "File was deleted during the upload; try again",
+                }
+            )
+
+        # Earlier uploads that never got indexed are retried with the batch
+        file_ids = [uploaded_file.id for uploaded_file in uploaded_files]
+        for _, existing in duplicates:
+            if not existing.is_processed and existing.id not in file_ids:
+                file_ids.append(existing.id)
+
+        # Files a queued or running job already covers are left to that job
+        job_id, active = None, {}
+        if file_ids:
+            try:
+                job_id, active = queue.enqueue_files(user_id, file_ids)
+            except QueueFullError:
+                for uploaded_file in uploaded_files:
+                    db.session.delete(uploaded_file)
+                db.session.commit()
+                for record in saved:
+                    _release_file(record["file_path"])
+                return _queue_full_response(queue)
+            ensure_workers()
+
+        return (
+            jsonify(
+                {
+                    "message": f"{len(uploaded_files)} files uploaded and queued for processing",
+                    "job_id": job_id,
+                    "status": "queued" if job_id or active else "processed",
+                    "files": [
+                        {
+                            "file_id": uploaded_file.id,
+                            "filename": uploaded_file.original_filename,
+                            "file_type": uploaded_file.file_type,
+                            "file_size": uploaded_file.file_size,
+                        }
+                        for uploaded_file in uploaded_files
+                    ],
+                    "duplicates": [
+                        {
+                            "filename": record["original_filename"],
+                            "file_id": existing.id,
+                            "job_id": active.get(existing.id),
+                            "sha256": record["sha256"],
+                        }
+                        for record, existing in duplicates
+                    ],
+                    "skipped": skipped,
+                }
+            ),
+            202 if job_id or active else 200,
+        )
 
-        # Process file asynchronously (in a real app, this would be a background task)
-        success = current_app.rag_service.process_uploaded_file(
-            uploaded_file.id, user_id
+    except Exception as e:
+        db.session.rollback()
+        for record in saved:
+            _release_file(record["file_path"])
+        return jsonify({"error": f"Upload failed: {str(e)}"}), 500
+
+
+def _upload_session(upload_id):
+    user_id = request.args.get("user_id", 1, type=int)
+    return UploadSession.query.filter_by(id=upload_id, user_id=user_id).first()
+
+
+@file_upload_bp.route("/uploads", methods=["POST"])
+def create_upload():
+    """Start a resumable upload; the bytes follow with PUT /uploads/<id>"""
+    try:
+        data = request.get_json() or {}
+        user_id = data.get("user_id", 1)
+        original_filename = secure_filename(data.get("filename") or "")
+        size = data.get("size")
+        sha256 = data.get("sha256")
+
+        if not original_filename or not allowed_file(original_filename):
+            return jsonify({"error": "File type not allowed"}), 400
+        if not isinstance(size, int):
+            return jsonify({"error": "size is required"}), 400
+        if sha256 is not None and not re.fullmatch(r"[0-9a-fA-F]{64}", str(sha256)):
+            return jsonify({"error": "sha256 must be 64 hex digits"}), 400
+
+        queue = get_job_queue()
+        if not queue.has_capacity():
+            return _queue_full_response(queue)
+
+        uploads = get_chunked_uploads()
+        file_type = get_file_type(original_filename)
+        if sha256:
+            # A file the user already has needs no upload at all
+            record = {
+                "file_path": uploads.blob_store.path_for(sha256.lower()),
+                "file_type": file_type,
+                "sha256": sha256.lower(),
+            }
+            if _existing_upload(user_id, record) is not None:
+                return _register_upload(record, user_id, queue)
+
+        session = uploads.create(user_id, original_filename, file_type, size, sha256)
+        return (
+            jsonify(
+                {
+                    **session.to_dict(),
+                    "chunk_size": int(
+                        current_app.config.get("UPLOAD_CHUNK_SIZE", 8 << 20)
+                    ),
+                }
+            ),
+            201,
         )
 
-        if success:
-            return (
-                jsonify(
-                    {
-                        "message": "File uploaded and processed successfully",
-                        "file_id": uploaded_file.id,
-                        "filename": original_filename,
-                        "file_type": file_extension,
-                        "file_size": file_size,
-                        "processed": True,
-                    }
-                ),
-                200,
-            )
-        else:
-            return (
-                jsonify(
-                    {
-                        "message": "File uploaded but processing failed",
-                        "file_id": uploaded_file.id,
-                        "filename": original_filename,
-                        "file_type": file_extension,
-                        "file_size": file_size,
-                        "processed": False,
-                    }
-                ),
-                200,
+    except UploadLimitExceeded as e:
+        return jsonify({"error": str(e)}), 429
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": f"Failed to start upload: {str(e)}"}), 500
+
+
+@file_upload_bp.route("/uploads/<upload_id>", methods=["GET"])
+def get_upload(upload_id):
+    """Get a resumable upload's progress; ``offset`` is where to resume"""
+    session = _upload_session(upload_id)
+    if not session:
+        return jsonify({"error": "Upload not found"}), 404
+    return jsonify(session.to_dict()), 200
+
+
+@file_upload_bp.route("/uploads/<upload_id>", methods=["PUT"])
+def put_upload_chunk(upload_id):
+    """Write one chunk of a resumable upload at ``?offset=``
+
+    The body is the raw chunk (not multipart) and is streamed from the
+    request straight into the upload's file. An optional X-Chunk-SHA256
+    header is checked before the chunk counts.
+    """
+    try:
+        session = _upload_session(upload_id)
+        if not session:
+            return jsonify({"error": "Upload not found"}), 404
+
+        offset = request.args.get("offset", type=int)
+        if offset is None:
+            return jsonify({"error": "offset is required"}), 400
+
+        try:
+            received = get_chunked_uploads().write(
+                session,
+                offset,
+                request.stream,
+                request.content_length,
+                request.headers.get("X-Chunk-SHA256"),
             )
+        except UploadConflict as e:
+            return jsonify({"error": str(e), "offset": e.offset}), 409
+        except ValueError as e:
+            return jsonify({"error": str(e), "offset": offset}), 400
+
+        return (
+            jsonify(
+                {
+                    "upload_id": upload_id,
+                    "offset": received,
+                    "complete": received == session.file_size,
+                }
+            ),
+            200,
+        )
 
     except Exception as e:
         db.session.rollback()
+        return jsonify({"error": f"Failed to store chunk: {str(e)}"}), 500
+
+
+@file_upload_bp.route("/uploads/<upload_id>/complete", methods=["POST"])
+def complete_upload(upload_id):
+    """Finish a resumable upload and queue the file for RAG ingestion"""
+    record = None
+    try:
+        session = _upload_session(upload_id)
+        if not session:
+            return jsonify({"error": "Upload not found"}), 404
+        user_id = session.user_id
+
+        # Check first, so a full queue leaves the upload resumable
+        queue = get_job_queue()
+        if not queue.has_capacity():
+            return _queue_full_response(queue)
+
+        try:
+            record = get_chunked_uploads().finish(session)
+        except UploadConflict as e:
+            return jsonify({"error": str(e), "offset": e.offset}), 409
+        except ChecksumMismatch as e:
+            return jsonify({"error": f"{str(e)}; the upload was discarded"}), 400
+
+        return _register_upload(record, user_id, queue)
+
+    except Exception as e:
+        db.session.rollback()
+        if record is not None:
+            _release_file(record["file_path"])
         return jsonify({"error": f"Upload failed: {str(e)}"}), 500
 
 
+@file_upload_bp.route("/uploads/<upload_id>", methods=["DELETE"])
+def abort_upload(upload_id):
+    """Cancel a resumable upload and discard its bytes"""
+    try:
+        session = _upload_session(upload_id)
+        if not session:
+            return jsonify({"error": "Upload not found"}), 404
+        get_chunked_uploads().abort(session)
+        return jsonify({"message": "Upload cancelled"}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": f"Failed to cancel upload: {str(e)}"}), 500
+
+
+@file_upload_bp.route("/jobs/<int:job_id>", methods=["GET"])
+def get_job_status(job_id):
+    """Get the status of an ingestion job"""
+    try:
+        user_id = request.args.get("user_id", 1, type=int)
+
+        job = get_job_queue().get(job_id)
+        if not job or job["payload"].get("user_id") != user_id:
+            return jsonify({"error": "Job not found"}), 404
+
+        status = {
+            "job_id": job["id"],
+            "kind": job["kind"],
+            "status": job["status"],
+            "attempts": job["attempts"],
+            "error": job["error"],
+            "created_at": job["created_at"],
+            "started_at": job["started_at"],
+            "finished_at": job["finished_at"],
+        }
+        if "file_ids" in job["payload"]:
+            file_ids = job["payload"]["file_ids"]
+            status["file_count"] = len(file_ids)
+            status["processed_count"] = UploadedFile.query.filter(
+                UploadedFile.id.in_(file_ids),
+                UploadedFile.user_id == user_id,
+                UploadedFile.is_processed.is_(True),
+            ).count()
+            status["failed"] = (job["result"] or {}).get("failed", [])
+        else:
+            file_id = job["payload"].get("file_id")
+            uploaded_file = UploadedFile.query.filter_by(
+                id=file_id, user_id=user_id
+            ).first()
+            status["file_id"] = file_id
+            status["processed"] = bool(uploaded_file and uploaded_file.is_processed)
+
+        return jsonify(status), 200
+
+    except Exception as e:
+        return jsonify({"error": f"Failed to get job status: {str(e)}"}), 500
+
+
 @file_upload_bp.route("/files", methods=["GET"])
 def get_uploaded_files():
     """Get list of uploaded files for a user"""
@@ -161,20 +623,18 @@ def delete_file(file_id):
         if not uploaded_file:
             return jsonify({"error": "File not found"}), 404
 
-        # Delete physical file
-        if os.path.exists(uploaded_file.file_path):
-            os.remove(uploaded_file.file_path)
-
         # Delete RAG document if exists
         rag_doc = RAGDocument.query.filter_by(
             user_id=user_id, source_type="file", source_id=str(file_id)
         ).first()
         if rag_doc:
-            db.session.delete(rag_doc)
+            current_app.rag_service.delete_document(rag_doc.id, user_id)
 
-        # Delete database record
+        # Delete database record, then the stored file if no other row shares it
+        file_path = uploaded_file.file_path
         db.session.delete(uploaded_file)
         db.session.commit()
+        _release_file(file_path)
 
         return jsonify({"message": "File deleted successfully"}), 200
 
@@ -195,13 +655,25 @@ def reprocess_file(file_id):
         if not uploaded_file:
             return jsonify({"error": "File not found"}), 404
 
-        # Reprocess file
-        success = current_app.rag_service.process_uploaded_file(file_id, user_id)
+        queue = get_job_queue()
+        try:
+            job_id, active = queue.enqueue_files(user_id, [file_id])
+        except QueueFullError:
+            return _queue_full_response(queue)
+        job_id = job_id or active[file_id]
+        ensure_workers()
 
-        if success:
-            return jsonify({"message": "File reprocessed successfully"}), 200
-        else:
-            return jsonify({"error": "Failed to reprocess file"}), 500
+        return (
+            jsonify(
+                {
+                    "message": "File queued for reprocessing",
+                    "file_id": file_id,
+                    "job_id": job_id,
+                    "status": "queued",
+                }
+            ),
+            202,
+        )
 
     except Exception as e:
         return jsonify({"error": f"Reprocessing failed: {str(e)}"}), 500
@@ -215,12 +687,21 @@ def search_documents():
         query = data.get("query", "")
         user_id = data.get("user_id", 1)
         top_k = data.get("top_k", 5)
+        mode = data.get("mode", "vector")
+        rerank = data.get("rerank")  # defaults to RAG_RERANK_ENABLED
 
         if not query:
             return jsonify({"error": "Query is required"}), 400
+        if mode not in RETRIEVAL_MODES:
+            return (
+                jsonify({"error": f"mode must be one of {', '.join(RETRIEVAL_MODES)}"}),
+                400,
+            )
 
-        # Perform semantic search
-        results = current_app.rag_service.semantic_search(query, user_id, top_k)
+        # Perform semantic, lexical or hybrid search, optionally re-ranked
+        results = current_app.rag_service.semantic_search(
+            query, user_id, top_k, mode=mode, rerank=rerank
+        )
 
         return (
             jsonify(
@@ -229,6 +710,10 @@ def search_documents():
             200,
         )
 
+    except InvalidNamespaceError:
+        return jsonify({"error": "Invalid user_id"}), 400
+    except UpstreamUnavailableError as e:
+        return jsonify({"error": f"Search unavailable: {str(e)}"}), 503
     except Exception as e:
         return jsonify({"error": f"Search failed: {str(e)}"}), 500
 
@@ -240,20 +725,130 @@ def get_rag_context():
         data = request.get_json()
         query = data.get("query", "")
         user_id = data.get("user_id", 1)
-        max_length = data.get("max_length", 2000)
+        max_tokens = data.get("max_tokens")  # defaults to RAG_CONTEXT_TOKENS
+        mode = data.get("mode", "vector")
+        rerank = data.get("rerank")
 
         if not query:
             return jsonify({"error": "Query is required"}), 400
+        if mode not in RETRIEVAL_MODES:
+            return (
+                jsonify({"error": f"mode must be one of {', '.join(RETRIEVAL_MODES)}"}),
+                400,
+            )
 
-        # Get RAG context
-        context = current_app.rag_service.get_rag_context(query, user_id, max_length)
+        # Get RAG context packed into the token budget
+        packed = current_app.rag_service.build_rag_context(
+            query, user_id, max_tokens, mode=mode, rerank=rerank
+        )
 
         return (
             jsonify(
-                {"query": query, "context": context, "context_length": len(context)}
+                {
+                    "query": query,
+                    "context": packed["context"],
+                    "context_length": len(packed["context"]),
+                    "token_count": packed["token_count"],
+                    "sources": packed["sources"],
+                }
             ),
             200,
         )
 
+    except InvalidNamespaceError:
+        return jsonify({"error": "Invalid user_id"}), 400
     except Exception as e:
         return jsonify({"error": f"Failed to get RAG context: {str(e)}"}), 500
+
+
+@file_upload_bp.route("/rag/documents/batch", methods=["POST"])
+def add_rag_documents_batch():
+    """Bulk-import documents (e.g. a Notion workspace) into the RAG system"""
+    try:
+        data = request.get_json()
+        user_id = data.get("user_id", 1)
+        documents = data.get("documents", [])
+
+        if not documents or not isinstance(documents, list):
+            return jsonify({"error": "No documents provided"}), 400
+        invalid = [
+            index for index, doc in enumerate(documents) if not isinstance(doc, dict)
+        ]
+        if invalid:
+            return (
+                jsonify({"error": "Documents must be objects", "invalid": invalid}),
+                400,
+            )
+
+        result = current_app.rag_service.add_documents(
+            [
+                {
+                    "content": doc.get("content", ""),
+                    "user_id": user_id,
+                    "source_type": doc.get("source_type", "import"),
+                    "source_id": doc.get("source_id"),
+                    "title": doc.get("title", "Untitled"),
+                }
+                for doc in documents
+            ]
+        )
+
+        return (
+            jsonify(
+                {
+                    "message": f"Added {len(result['documents'])} out of {len(documents)} documents",
+                    "document_ids": [doc.id for doc in result["documents"]],
+                    "success_count": len(result["documents"]),
+                    "total_count": len(documents),
+                    "failed": result["failed"],
+                }
+            ),
+            200,
+        )
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": f"Batch import failed: {str(e)}"}), 500
+
+
+@file_upload_bp.route("/rag/documents/<int:doc_id>", methods=["DELETE"])
+def delete_rag_document(doc_id):
+    """Delete a RAG document with its vectors and lexical index entries"""
+    try:
+        user_id = request.args.get("user_id", 1, type=int)
+
+        if not current_app.rag_service.delete_document(doc_id, user_id):
+            return jsonify({"error": "Document not found"}), 404
+
+        return jsonify({"message": "Document deleted successfully"}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": f"Failed to delete document: {str(e)}"}), 500
+
+
+@file_upload_bp.route("/rag/stats", methods=["GET"])
+def get_rag_stats():
+    """Get RAG cache statistics"""
+    try:
+        return (
+            jsonify(
+                {
+                    "embedding_cache": current_app.rag_service.get_cache_stats(),
+                    "query_cache": current_app.rag_service.get_query_cache_stats(),
+                    "rerank": current_app.rag_service.get_rerank_stats(),
+                    "vector_store": current_app.rag_service.get_vector_store_stats(),
+                    "ingest_queue": get_job_queue().get_stats(),
+                    "upstream": current_app.ai_service.llm_client.get_stats(),
+                    "response_cache": (
+                        current_app.ai_service.response_cache.get_stats()
+                        if current_app.ai_service.response_cache
+                        else {"enabled": False}
+                    ),
+                }
+            ),
+            200,
+        )
+
+    except Exception as e:
+        return jsonify({"error": f"Failed to get RAG stats: {str(e)}"}), 500
@@ -105,7 +105,8 @@ def generate_prompt():
     result = current_app.ai_service.generate_prompt(task_description, examples)
 
     if "error" in result:
-        return jsonify(result), 500
+        status = result.pop("status", 500)
+        return jsonify(result), status
 
     return jsonify(
         {
@@ -236,7 +237,8 @@ def generate_tool():
     result = current_app.ai_service.generate_tool_code(tool_description, language)
 
     if "error" in result:
-        return jsonify(result), 500
+        status = result.pop("status", 500)
+        return jsonify(result), status
 
     return jsonify(
         {
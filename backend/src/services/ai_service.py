@@ -1,20 +1,55 @@
 import google.generativeai as genai
-from transformers import AutoTokenizer, AutoModel
-import torch
+import numpy as np
 import os
 from flask import current_app
+from .model_registry import get_embedding_model
+from .embedding_backends import get_embedding_backend
+from .embedding_cache import get_embedding_cache
+from .response_cache import SemanticResponseCache, context_fingerprint
+from .llm_client import UpstreamUnavailableError, get_llm_client
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
 
 
 class AIService:
     def __init__(self):
         # Initialize Google Gemini
         self.gemini_model = None
+        self.llm_client = get_llm_client()
         self._configure_gemini()
 
-        # Initialize Hugging Face models
-        self.hf_tokenizer = None
-        self.hf_model = None
-        self._load_huggingface_model()
+        # Hugging Face models are loaded lazily from the shared model registry
+        self.embedding_model_name = EMBEDDING_MODEL_NAME
+        self.embedding_backend_name = current_app.config.get(
+            "EMBEDDING_BACKEND", "torch"
+        )
+        self.embedding_quantize = current_app.config.get("EMBEDDING_QUANTIZE", False)
+        self.embedding_parity_min_cosine = float(
+            current_app.config.get("EMBEDDING_PARITY_MIN_COSINE", 0.99)
+        )
+        self.onnx_model_dir = current_app.config.get("ONNX_MODEL_DIR")
+        self.onnx_num_threads = int(current_app.config.get("ONNX_NUM_THREADS", 0))
+        self.embedding_cache = None
+        if current_app.config.get("EMBEDDING_CACHE_ENABLED", True):
+            self.embedding_cache = get_embedding_cache(
+                current_app.config.get("EMBEDDING_CACHE_PATH"),
+                int(current_app.config.get("EMBEDDING_CACHE_MEMORY_ITEMS", 10000)),
+            )
+        self.response_cache = None
+        if current_app.config.get("RESPONSE_CACHE_ENABLED", True):
+            self.response_cache = SemanticResponseCache(
+                int(current_app.config.get("RESPONSE_CACHE_MAX_ITEMS", 2000)),
+                float(current_app.config.get("RESPONSE_CACHE_TTL", 3600)),
+                float(current_app.config.get("RESPONSE_CACHE_THRESHOLD", 0.95)),
+            )
+
+    @property
+    def hf_tokenizer(self):
+        return self._load_huggingface_model()[0]
+
+    @property
+    def hf_model(self):
+        return self._load_huggingface_model()[1]
 
     def _configure_gemini(self):
         """Configure Gemini model if API key is available"""
@@ -24,13 +59,19 @@ class AIService:
             self.gemini_model = genai.GenerativeModel("gemini-2.5-flash")
 
     def _load_huggingface_model(self):
-        """Load Hugging Face model for embeddings"""
-        try:
-            model_name = "sentence-transformers/all-MiniLM-L6-v2"
-            self.hf_tokenizer = AutoTokenizer.from_pretrained(model_name)
-            self.hf_model = AutoModel.from_pretrained(model_name)
-        except Exception as e:
-            print(f"Error loading Hugging Face model: {e}")
+        """Return the process-wide tokenizer and model, loading them on first use"""
+        return get_embedding_model(self.embedding_model_name)
+
+    def load_embedding_backend(self):
+        """Return the shared embedding backend (PyTorch or ONNX Runtime)"""
+        return get_embedding_backend(
+            self.embedding_model_name,
+            backend=self.embedding_backend_name,
+            quantize=self.embedding_quantize,
+            min_cosine=self.embedding_parity_min_cosine,
+            model_dir=self.onnx_model_dir,
+            num_threads=self.onnx_num_threads,
+        )
 
     def generate_with_gemini(self, prompt, context=None):
         """Generate response using Google Gemini"""
@@ -46,27 +87,129 @@ class AIService:
             else:
                 full_prompt = prompt
 
-            response = self.gemini_model.generate_content(full_prompt)
+            response = self.llm_client.call(
+                "gemini", self.gemini_model.generate_content, full_prompt
+            )
             return {"response": response.text}
+        except UpstreamUnavailableError as e:
+            return {"error": f"Gemini unavailable: {str(e)}", "status": 503}
         except Exception as e:
             return {"error": f"Gemini generation error: {str(e)}"}
 
-    def get_embeddings(self, text):
-        """Get embeddings using Hugging Face model"""
-        if not self.hf_model or not self.hf_tokenizer:
-            return None
+    def _lookup_response(self, user_id, question, context):
+        """Embed a question and look for a cached answer to a near-duplicate
 
-        try:
-            inputs = self.hf_tokenizer(
-                text, return_tensors="pt", truncation=True, padding=True
-            )
-            with torch.no_grad():
-                outputs = self.hf_model(**inputs)
-                embeddings = outputs.last_hidden_state.mean(dim=1)
-            return embeddings.numpy()
-        except Exception as e:
-            print(f"Error getting embeddings: {e}")
-            return None
+        Returns ``(hit, store)`` where ``store(response)`` records a freshly
+        generated answer for this question, or is None if nothing can be cached.
+        """
+        fingerprint = context_fingerprint(context)
+        embeddings = self.get_embeddings(question, normalize=True)
+        if embeddings is None:
+            return None, None
+        vector = embeddings[0]
+
+        def store(response):
+            self.response_cache.store(user_id, fingerprint, vector, response)
+
+        return self.response_cache.lookup(user_id, fingerprint, vector), store
+
+    def generate_with_cache(
+        self, prompt, user_id, question=None, context=None, use_cache=True
+    ):
+        """Generate with Gemini, reusing the answer to a near-duplicate question
+
+        ``question`` (default: the prompt) is what gets embedded and compared;
+        ``context`` is the retrieved context already baked into ``prompt``,
+        and a cached answer is only reused when it was built from the same one.
+        """
+        if not use_cache or not self.response_cache:
+            return self.generate_with_gemini(prompt)
+
+        hit, store = self._lookup_response(user_id, question or prompt, context)
+        if hit:
+            return {**hit, "cached": True}
+
+        result = self.generate_with_gemini(prompt)
+        if store and "response" in result:
+            store(result["response"])
+        return result
+
+    def stream_with_gemini(self, prompt):
+        """Yield the Gemini answer as text fragments while it is generated"""
+        if not self.gemini_model:
+            self._configure_gemini()
+            if not self.gemini_model:
+                raise RuntimeError("Gemini API key not configured")
+
+        with self.llm_client.slot("gemini"):
+            for chunk in self.gemini_model.generate_content(prompt, stream=True):
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks without text parts (e.g. safety metadata only)
+                    continue
+                if text:
+                    yield text
+
+    def stream_with_cache(
+        self, prompt, user_id, question=None, context=None, use_cache=True
+    ):
+        """Streaming counterpart of generate_with_cache
+
+        A cached answer is yielded as a single fragment; a fresh one is stored
+        once the stream has completed.
+        """
+        store = None
+        if use_cache and self.response_cache:
+            hit, store = self._lookup_response(user_id, question or prompt, context)
+            if hit:
+                yield hit["response"]
+                return
+
+        parts = []
+        for text in self.stream_with_gemini(prompt):
+            parts.append(text)
+            yield text
+        if store:
+            store("".join(parts))
+
+    @property
+    def embedding_cache_model_key(self):
+        """Cache namespace; quantized graphs produce slightly different vectors"""
+        suffix = "-int8" if self.embedding_quantize else ""
+        return f"{self.embedding_model_name}@{self.embedding_backend_name}{suffix}"
+
+    def get_embeddings(self, text, normalize=True):
+        """Get mean-pooled (optionally L2-normalized) embeddings from the configured backend"""
+        texts = [text] if isinstance(text, str) else list(text)
+        mode = "normalized" if normalize else "raw"
+        model_key = self.embedding_cache_model_key
+
+        if self.embedding_cache:
+            vectors = self.embedding_cache.get_many(model_key, mode, texts)
+        else:
+            vectors = [None] * len(texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+
+        if missing:
+            backend = self.load_embedding_backend()
+            if backend is None:
+                return None
+            try:
+                computed = backend.encode(
+                    [texts[i] for i in missing], normalize=normalize
+                ).astype("float32")
+            except Exception as e:
+                print(f"Error getting embeddings: {e}")
+                return None
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+            if self.embedding_cache:
+                self.embedding_cache.put_many(
+                    model_key, mode, [texts[i] for i in missing], computed
+                )
+
+        return np.vstack(vectors).astype("float32")
 
     def generate_prompt(self, task_description, examples=None):
         """Generate optimized prompt using AI"""
@@ -0,0 +1,122 @@
+import os
+import uuid
+import hashlib
+import logging
+from typing import BinaryIO, Callable, Dict, Any
+
+from flask import current_app
+
+from .model_registry import get_app_service
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BLOB_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "..", "..", "data", "blobs"
+)
+
+COPY_BUFFER = 1024 * 1024
+
+
+class BlobStore:
+    """Content-addressed file storage: one file per distinct sha256
+
+    Uploads are hashed while they are written to a temporary file, which is
+    then moved to ``<root>/<hash[:2]>/<hash>``; a second copy of the same
+    bytes is discarded. Blobs do not count their users themselves: callers
+    ``remove`` a blob once no row references its path any more, and check
+    that the blob still ``exists`` after committing a row that adopted it.
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        os.makedirs(os.path.join(self.root, "tmp"), exist_ok=True)
+
+    def path_for(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def reserve(self, size: int) -> str:
+        """Create a temporary file of ``size`` bytes to be filled in place"""
+        tmp_path = os.path.join(self.root, "tmp", uuid.uuid4().hex)
+        with open(tmp_path, "wb") as f:
+            # Claim the space now so a full disk fails the upload up front
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(f.fileno(), 0, size)
+            else:
+                f.truncate(size)
+        return tmp_path
+
+    @staticmethod
+    def hash_file(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(COPY_BUFFER)
+                if not block:
+                    break
+                digest.update(block)
+        return digest.hexdigest()
+
+    def save(self, stream: BinaryIO) -> Dict[str, Any]:
+        """Store a stream; returns its ``sha256``, blob ``path`` and ``size``"""
+        digest = hashlib.sha256()
+        size = 0
+        tmp_path = os.path.join(self.root, "tmp", uuid.uuid4().hex)
+        try:
+            with open(tmp_path, "wb") as f:
+                while True:
+                    block = stream.read(COPY_BUFFER)
+                    if not block:
+                        break
+                    digest.update(block)
+                    f.write(block)
+                    size += len(block)
+            return self.adopt(tmp_path, digest.hexdigest(), size)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def adopt(self, tmp_path: str, sha256: str, size: int) -> Dict[str, Any]:
+        """Move an already hashed file into the store (or drop it as a duplicate)"""
+        path = self.path_for(sha256)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        return {"sha256": sha256, "path": path, "size": size}
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(path)
+
+    def remove(self, path: str, in_use: Callable[[], bool]) -> bool:
+        """Delete a blob unless ``in_use()`` says a row still references it
+
+        An upload of the same bytes may adopt the blob meanwhile. The blob
+        is moved aside before ``in_use`` is asked again and put back if a
+        row appeared; an upload that committed its row after the move finds
+        the blob gone when it checks ``exists`` and fails instead. Returns
+        whether the blob was deleted.
+        """
+        if in_use():
+            return False
+        doomed = os.path.join(self.root, "tmp", uuid.uuid4().hex)
+        try:
+            os.replace(path, doomed)
+        except FileNotFoundError:
+            return False
+        if in_use() and not os.path.exists(path):
+            os.replace(doomed, path)
+            return False
+        os.remove(doomed)
+        return True
+
+
+def get_blob_store() -> BlobStore:
+    """Get the app-wide blob store (BLOB_STORE_PATH)"""
+    return get_app_service(
+        "blob_store",
+        lambda: BlobStore(
+            current_app.config.get("BLOB_STORE_PATH") or DEFAULT_BLOB_PATH
+        ),
+    )
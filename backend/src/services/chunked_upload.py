@@ -0,0 +1,315 @@
+import os
+import uuid
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, BinaryIO, Dict, Optional, Tuple
+
+from flask import current_app
+
+from ..models import db, UploadSession
+from .blob_store import COPY_BUFFER, BlobStore, get_blob_store
+from .model_registry import get_app_service
+
+logger = logging.getLogger(__name__)
+
+# Seconds after which a claim (chunk write or completion) left by a crashed
+# request can be taken over
+CHUNK_CLAIM_TIMEOUT = 600
+
+
+class UploadConflict(ValueError):
+    """The chunk does not start at the session's offset; resume from ``offset``"""
+
+    def __init__(self, message: str, offset: int):
+        super().__init__(message)
+        self.offset = offset
+
+
+class ChecksumMismatch(ValueError):
+    pass
+
+
+class UploadLimitExceeded(ValueError):
+    """The user has too many uploads open, or too many bytes reserved by them"""
+
+
+class ChunkedUploads:
+    """Resumable uploads written chunk by chunk into a preallocated file
+
+    A client creates a session with the file's size, then sends the bytes
+    in order, each chunk at the session's current offset. A chunk is only
+    counted once all its bytes arrived (and match ``X-Chunk-SHA256`` if it
+    was sent); a failed chunk is simply sent again from the same offset.
+    A request claims the session with a compare-and-set before it writes,
+    so two copies of one chunk never write the file at the same time, and
+    releases the claim as it advances the offset. Completing the upload
+    takes the same claim, so only one request moves the file. The sha256 of the whole file is kept up to date as
+    chunks arrive in this process and recomputed from disk otherwise.
+
+    Each open session preallocates its whole file, so a user may hold at
+    most ``max_sessions`` of them and ``max_reserved_bytes`` between them.
+    """
+
+    def __init__(
+        self,
+        blob_store: BlobStore,
+        max_bytes: int,
+        session_ttl: float,
+        max_sessions: int = 5,
+        max_reserved_bytes: int = 20 << 30,
+    ):
+        self.blob_store = blob_store
+        self.max_bytes = max_bytes
+        self.session_ttl = session_ttl
+        self.max_sessions = max_sessions
+        self.max_reserved_bytes = max_reserved_bytes
+        # session id -> (bytes hashed, running sha256 of those bytes)
+        self._hashers: Dict[str, Tuple[int, Any]] = {}
+        self._lock = threading.Lock()
+
+    def create(
+        self,
+        user_id: int,
+        original_filename: str,
+        file_type: str,
+        size: int,
+        sha256: str = None,
+    ) -> UploadSession:
+        if size <= 0:
+            raise ValueError("size must be a positive number of bytes")
+        if size > self.max_bytes:
+            raise ValueError(f"Uploads are limited to {self.max_bytes} bytes")
+        self.purge_expired()
+
+        sessions, reserved = (
+            db.session.query(
+                db.func.count(UploadSession.id),
+                db.func.coalesce(db.func.sum(UploadSession.file_size), 0),
+            )
+            .filter(UploadSession.user_id == user_id)
+            .one()
+        )
+        if sessions >= self.max_sessions:
+            raise UploadLimitExceeded(
+                f"At most {self.max_sessions} uploads can be open at once; "
+                "finish or cancel one first"
+            )
+        if reserved + size > self.max_reserved_bytes:
+            raise UploadLimitExceeded(
+                f"Open uploads are limited to {self.max_reserved_bytes} bytes "
+                "in total; finish or cancel one first"
+            )
+
+        session = UploadSession(
+            id=uuid.uuid4().hex,
+            user_id=user_id,
+            original_filename=original_filename,
+            file_type=file_type,
+            file_size=size,
+            received=0,
+            sha256=sha256.lower() if sha256 else None,
+            temp_path=self.blob_store.reserve(size),
+        )
+        db.session.add(session)
+        db.session.commit()
+        return session
+
+    def write(
+        self,
+        session: UploadSession,
+        offset: int,
+        stream: BinaryIO,
+        length: Optional[int],
+        chunk_sha256: str = None,
+    ) -> int:
+        """Write one chunk at ``offset`` and return the new offset"""
+        if offset != session.received:
+            raise UploadConflict(
+                f"Expected a chunk at offset {session.received}", session.received
+            )
+        if not length or offset + length > session.file_size:
+            raise ValueError("Chunk length is missing or runs past the end of the file")
+
+        # Claim the offset, so a duplicated retry cannot write alongside
+        token = self._claim(
+            session, offset, f"The chunk at offset {offset} is already being written"
+        )
+        try:
+            hasher = self._write_chunk(session, offset, stream, length, chunk_sha256)
+        except BaseException:
+            self._release(session, token)
+            raise
+
+        # Still ours unless the write outlasted CHUNK_CLAIM_TIMEOUT
+        updated = UploadSession.query.filter_by(id=session.id, writer=token).update(
+            {
+                "received": offset + length,
+                "writer": None,
+                "updated_at": datetime.utcnow(),
+            },
+            synchronize_session=False,
+        )
+        db.session.commit()
+        db.session.refresh(session)
+        if not updated:
+            raise UploadConflict(
+                f"Expected a chunk at offset {session.received}", session.received
+            )
+        if hasher is not None:
+            with self._lock:
+                self._hashers[session.id] = (offset + length, hasher)
+        return offset + length
+
+    def _claim(self, session: UploadSession, offset: int, busy: str) -> str:
+        """Claim a session at ``offset`` for one request; returns the claim token
+
+        Compare-and-set on the row, so of two requests for the same step
+        only one proceeds. A claim left by a crashed request is taken over
+        after CHUNK_CLAIM_TIMEOUT.
+        """
+        token = uuid.uuid4().hex
+        now = datetime.utcnow()
+        claimed = UploadSession.query.filter(
+            UploadSession.id == session.id,
+            UploadSession.received == offset,
+            db.or_(
+                UploadSession.writer.is_(None),
+                UploadSession.updated_at < now - timedelta(seconds=CHUNK_CLAIM_TIMEOUT),
+            ),
+        ).update({"writer": token, "updated_at": now}, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return token
+        received = (
+            db.session.query(UploadSession.received).filter_by(id=session.id).scalar()
+        )
+        if received is None:
+            raise UploadConflict(
+                "The upload has already been completed or cancelled", offset
+            )
+        if received == offset:
+            raise UploadConflict(busy, offset)
+        raise UploadConflict(f"Expected a chunk at offset {received}", received)
+
+    def _release(self, session: UploadSession, token: str):
+        """Drop a claim after a failed step, so the client can retry it"""
+        db.session.rollback()
+        UploadSession.query.filter_by(id=session.id, writer=token).update(
+            {"writer": None}, synchronize_session=False
+        )
+        db.session.commit()
+
+    def _write_chunk(
+        self,
+        session: UploadSession,
+        offset: int,
+        stream: BinaryIO,
+        length: int,
+        chunk_sha256: Optional[str],
+    ):
+        """Write and verify a claimed chunk; returns the file's running sha256"""
+        with self._lock:
+            hashed = self._hashers.get(session.id)
+        if hashed is not None and hashed[0] == offset:
+            hasher = hashed[1].copy()
+        else:
+            hasher = hashlib.sha256() if offset == 0 else None
+        chunk_hasher = hashlib.sha256()
+
+        written = 0
+        with open(session.temp_path, "r+b") as f:
+            f.seek(offset)
+            while written < length:
+                block = stream.read(min(COPY_BUFFER, length - written))
+                if not block:
+                    break
+                f.write(block)
+                chunk_hasher.update(block)
+                if hasher is not None:
+                    hasher.update(block)
+                written += len(block)
+        if written != length:
+            raise ValueError(
+                f"Chunk ended after {written} of {length} bytes; send it again"
+            )
+        if chunk_sha256 and chunk_hasher.hexdigest() != chunk_sha256.lower():
+            raise ChecksumMismatch("Chunk does not match its X-Chunk-SHA256")
+        return hasher
+
+    def finish(self, session: UploadSession) -> Dict[str, Any]:
+        """Verify a fully received upload and move it into the blob store"""
+        if session.received != session.file_size:
+            raise UploadConflict(
+                f"Only {session.received} of {session.file_size} bytes received",
+                session.received,
+            )
+        # Only one of two concurrent completions moves the file
+        token = self._claim(
+            session, session.file_size, "The upload is already being completed"
+        )
+        try:
+            with self._lock:
+                hashed = self._hashers.pop(session.id, None)
+            if hashed is not None and hashed[0] == session.file_size:
+                sha256 = hashed[1].hexdigest()
+            else:
+                sha256 = self.blob_store.hash_file(session.temp_path)
+
+            if session.sha256 and sha256 != session.sha256:
+                self.abort(session)
+                raise ChecksumMismatch(
+                    "Uploaded file does not match the declared sha256"
+                )
+
+            blob = self.blob_store.adopt(session.temp_path, sha256, session.file_size)
+        except BaseException:
+            self._release(session, token)
+            raise
+        record = {
+            "original_filename": session.original_filename,
+            "file_path": blob["path"],
+            "file_type": session.file_type,
+            "file_size": blob["size"],
+            "sha256": sha256,
+        }
+        db.session.delete(session)
+        db.session.commit()
+        return record
+
+    def abort(self, session: UploadSession):
+        with self._lock:
+            self._hashers.pop(session.id, None)
+        if os.path.exists(session.temp_path):
+            os.remove(session.temp_path)
+        db.session.delete(session)
+        db.session.commit()
+
+    def purge_expired(self):
+        """Drop sessions idle for longer than the session TTL, with their files"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.session_ttl)
+        for session in UploadSession.query.filter(UploadSession.updated_at < cutoff):
+            logger.info(f"Discarding abandoned upload {session.id}")
+            self.abort(session)
+        live = {session_id for (session_id,) in db.session.query(UploadSession.id)}
+        with self._lock:
+            # Sessions finished by other processes leave hashers behind here
+            for session_id in list(self._hashers):
+                if session_id not in live:
+                    del self._hashers[session_id]
+
+
+def get_chunked_uploads() -> ChunkedUploads:
+    """Get the app-wide resumable upload service"""
+    config = current_app.config
+    return get_app_service(
+        "chunked_uploads",
+        lambda: ChunkedUploads(
+            get_blob_store(),
+            max_bytes=int(config.get("UPLOAD_MAX_BYTES", 10 << 30)),
+            session_ttl=float(config.get("UPLOAD_SESSION_TTL", 86400)),
+            max_sessions=int(config.get("UPLOAD_MAX_SESSIONS", 5)),
+            max_reserved_bytes=int(config.get("UPLOAD_MAX_RESERVED_BYTES", 20 << 30)),
+        ),
+    )
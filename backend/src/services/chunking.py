@@ -0,0 +1,164 @@
+import re
+import logging
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .embedding_backends import tokenize_locked
+
+logger = logging.getLogger(__name__)
+
+# Approximate sub-word tokens when no model tokenizer is available. Thai is
+# written without spaces, so it is cut into short character runs instead of
+# being treated as a single enormous "word".
+_FALLBACK_TOKEN_RE = re.compile(r"[\u0e00-\u0e7f]{1,4}|\w+|[^\w\s]")
+_MD_HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$", re.MULTILINE)
+_HTML_HEADING_RE = re.compile(r"<h([1-6])[^>]*>(.*?)</h\1>", re.IGNORECASE | re.DOTALL)
+_HTML_DROP_RE = re.compile(
+    r"<(script|style|head)[^>]*>.*?</\1>", re.IGNORECASE | re.DOTALL
+)
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+
+# Offsets of each token as (start, end) character positions
+TokenSpans = List[Tuple[int, int]]
+
+
+def make_token_splitter(tokenizer=None) -> Callable[[str], TokenSpans]:
+    """Return a function mapping text to token character spans
+
+    Uses the embedding model's (fast) tokenizer when given so chunk sizes match
+    what the model will actually see, and a regex approximation otherwise.
+    The tokenizer is shared with embedding, so calls take its lock.
+    """
+    if tokenizer is not None:
+
+        def split(text: str) -> TokenSpans:
+            encoded = tokenize_locked(
+                tokenizer,
+                text,
+                add_special_tokens=False,
+                return_offsets_mapping=True,
+                verbose=False,
+            )
+            return [tuple(span) for span in encoded["offset_mapping"]]
+
+        try:
+            split("probe")
+            return split
+        except Exception as e:
+            logger.warning(f"Tokenizer lacks offset mapping, using fallback: {e}")
+
+    def fallback(text: str) -> TokenSpans:
+        return [match.span() for match in _FALLBACK_TOKEN_RE.finditer(text)]
+
+    return fallback
+
+
+def _html_to_text(html: str) -> str:
+    html = _HTML_DROP_RE.sub(" ", html)
+    # Keep headings on their own markdown-style line so they still split sections
+    html = _HTML_HEADING_RE.sub(
+        lambda m: "\n" + "#" * int(m.group(1)) + " " + m.group(2) + "\n", html
+    )
+    html = re.sub(r"<(br|/p|/div|/li|/tr)[^>]*>", "\n", html, flags=re.IGNORECASE)
+    text = _HTML_TAG_RE.sub(" ", html)
+    return re.sub(r"[ \t]+", " ", text)
+
+
+def split_sections(text: str, doc_format: str = "txt") -> Iterator[Tuple[str, str]]:
+    """Yield (heading, body) sections, splitting markdown/html on headings"""
+    if doc_format in ("html", "htm"):
+        text = _html_to_text(text)
+        doc_format = "md"
+
+    if doc_format != "md":
+        yield "", text
+        return
+
+    heading = ""
+    position = 0
+    for match in _MD_HEADING_RE.finditer(text):
+        body = text[position : match.start()]
+        if body.strip():
+            yield heading, body
+        heading = match.group(2).strip()
+        position = match.start()
+    body = text[position:]
+    if body.strip():
+        yield heading, body
+
+
+def chunk_sections(
+    sections: Iterable[Tuple[str, str]],
+    split_tokens: Callable[[str], TokenSpans],
+    max_tokens: int = 200,
+    overlap: int = 40,
+) -> Iterator[Dict[str, Any]]:
+    """Turn a stream of sections into token-bounded, overlapping chunks
+
+    Small consecutive sections are packed together; a section longer than
+    ``max_tokens`` is cut into windows that overlap by ``overlap`` tokens and
+    carry their heading so every chunk keeps its context.
+    """
+    overlap = max(0, min(overlap, max_tokens // 2))
+    step = max_tokens - overlap
+    index = 0
+    buffer: List[str] = []
+    buffer_tokens = 0
+    buffer_heading: Optional[str] = None
+
+    def emit(text: str, heading: str, token_count: int):
+        nonlocal index
+        chunk = {
+            "index": index,
+            "text": text.strip(),
+            "heading": heading,
+            "token_count": token_count,
+        }
+        index += 1
+        return chunk
+
+    for heading, body in sections:
+        spans = split_tokens(body)
+        if not spans:
+            continue
+
+        if len(spans) <= max_tokens:
+            if buffer and buffer_tokens + len(spans) > max_tokens:
+                yield emit("\n\n".join(buffer), buffer_heading, buffer_tokens)
+                buffer, buffer_tokens, buffer_heading = [], 0, None
+            if buffer_heading is None:
+                buffer_heading = heading
+            buffer.append(body.strip())
+            buffer_tokens += len(spans)
+            continue
+
+        if buffer:
+            yield emit("\n\n".join(buffer), buffer_heading, buffer_tokens)
+            buffer, buffer_tokens, buffer_heading = [], 0, None
+
+        for start in range(0, len(spans), step):
+            window = spans[start : start + max_tokens]
+            text = body[window[0][0] : window[-1][1]]
+            if start and heading:
+                text = f"{heading}\n{text}"
+            yield emit(text, heading, len(window))
+            if start + max_tokens >= len(spans):
+                break
+
+    if buffer:
+        yield emit("\n\n".join(buffer), buffer_heading, buffer_tokens)
+
+
+def chunk_document(
+    text: str,
+    split_tokens: Callable[[str], TokenSpans],
+    doc_format: str = "txt",
+    max_tokens: int = 200,
+    overlap: int = 40,
+) -> Iterator[Dict[str, Any]]:
+    """Chunk a whole document; ``doc_format`` enables heading-aware md/html splitting"""
+    return chunk_sections(
+        split_sections(text, (doc_format or "txt").lower()),
+        split_tokens,
+        max_tokens,
+        overlap,
+    )
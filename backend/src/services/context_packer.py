@@ -0,0 +1,78 @@
+from typing import Any, Callable, Dict, List, Set
+
+from .chunking import TokenSpans
+
+# Chunks sharing this fraction of their token shingles with an already packed
+# chunk (overlap windows, re-uploaded documents) are dropped as duplicates
+DUPLICATE_CONTAINMENT = 0.8
+SHINGLE_SIZE = 5
+
+
+def _shingles(text: str, spans: TokenSpans) -> Set[tuple]:
+    tokens = [text[start:end].lower() for start, end in spans]
+    if len(tokens) <= SHINGLE_SIZE:
+        return {tuple(tokens)} if tokens else set()
+    return {
+        tuple(tokens[i : i + SHINGLE_SIZE])
+        for i in range(len(tokens) - SHINGLE_SIZE + 1)
+    }
+
+
+def format_chunk(title: str, text: str) -> str:
+    return f"Document: {title or 'Unknown'}\nContent: {text}\n\n"
+
+
+def pack_context(
+    chunks: List[Dict[str, Any]],
+    split_tokens: Callable[[str], TokenSpans],
+    max_tokens: int = 1024,
+    max_chunk_tokens: int = 400,
+    min_chunk_tokens: int = 32,
+) -> Dict[str, Any]:
+    """Greedily pack ranked chunks into a token budget
+
+    ``chunks`` are dicts with ``text``, ``title`` and ``score`` (plus any ids
+    to carry through), best first. Each chunk is cut to ``max_chunk_tokens``;
+    one that does not fit is truncated to the remaining budget if at least
+    ``min_chunk_tokens`` would survive, otherwise skipped so later, shorter
+    chunks can still use the space. Near-duplicates of packed chunks are
+    dropped. Returns the context string, its token count and the sources.
+    """
+    parts = []
+    sources = []
+    seen: List[Set[tuple]] = []
+    used = 0
+
+    for chunk in chunks:
+        text = (chunk.get("text") or "").strip()
+        if not text:
+            continue
+        spans = split_tokens(text)
+        if not spans:
+            continue
+
+        shingles = _shingles(text, spans)
+        if any(
+            len(shingles & packed) >= DUPLICATE_CONTAINMENT * len(shingles)
+            for packed in seen
+        ):
+            continue
+
+        overhead = len(split_tokens(format_chunk(chunk.get("title"), "")))
+        room = min(max_chunk_tokens, max_tokens - used - overhead)
+        if room < min(min_chunk_tokens, len(spans)):
+            continue
+
+        truncated = len(spans) > room
+        if truncated:
+            spans = spans[:room]
+            text = text[: spans[-1][1]]
+
+        parts.append(format_chunk(chunk.get("title"), text))
+        used += overhead + len(spans)
+        seen.append(shingles)
+        source = {k: v for k, v in chunk.items() if k != "text"}
+        source.update({"tokens": len(spans), "truncated": truncated})
+        sources.append(source)
+
+    return {"context": "".join(parts), "token_count": used, "sources": sources}
@@ -0,0 +1,213 @@
+import os
+import json
+import mmap
+import sqlite3
+import threading
+from typing import Any, Dict, Iterator, List
+
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH = 500
+
+
+class DocumentStore:
+    """Disk-backed store for RAG document texts and metadata
+
+    Texts are appended to a flat UTF-8 file that is read through ``mmap``;
+    a SQLite table maps each document id to its (offset, length) in that file
+    plus its metadata. Only the rows that are asked for are ever decoded, so
+    startup cost and memory no longer grow with the size of the corpus.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        self.text_file = os.path.join(path, "texts.bin")
+        self.db_file = os.path.join(path, "documents.sqlite3")
+        self._lock = threading.RLock()
+
+        self._conn = sqlite3.connect(
+            self.db_file, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "id INTEGER PRIMARY KEY, "
+            "offset INTEGER NOT NULL, "
+            "length INTEGER NOT NULL, "
+            "metadata TEXT, "
+            "parent_id TEXT, "
+            "chunk_index INTEGER, "
+            "deleted INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_documents_parent ON documents (parent_id)"
+        )
+
+        self._writer = open(self.text_file, "ab")
+        self._reader = open(self.text_file, "rb")
+        self._mmap = None
+        self._mmap_size = 0
+        (count,) = self._conn.execute(
+            "SELECT COALESCE(MAX(id) + 1, 0) FROM documents"
+        ).fetchone()
+        self._count = count
+        self._deleted = self._count_deleted()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, docs: List[Dict[str, Any]]):
+        """Durably store documents; each needs ``id`` and ``text``"""
+        if not docs:
+            return
+        with self._lock:
+            offset = self._writer.seek(0, os.SEEK_END)
+            rows = []
+            for doc in docs:
+                data = doc["text"].encode("utf-8")
+                self._writer.write(data)
+                rows.append(
+                    (
+                        doc["id"],
+                        offset,
+                        len(data),
+                        json.dumps(doc.get("metadata") or {}, ensure_ascii=False),
+                        doc.get("parent_id"),
+                        doc.get("chunk_index"),
+                    )
+                )
+                offset += len(data)
+            # Texts must be on disk before the rows that point at them
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO documents "
+                    "(id, offset, length, metadata, parent_id, chunk_index) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._count = max(self._count, max(row[0] for row in rows) + 1)
+
+    def _view(self, end: int):
+        """Return a read-only mapping of the text file covering ``end`` bytes"""
+        if self._mmap is None or end > self._mmap_size:
+            if self._mmap is not None:
+                self._mmap.close()
+            size = os.fstat(self._reader.fileno()).st_size
+            self._mmap = (
+                mmap.mmap(self._reader.fileno(), 0, access=mmap.ACCESS_READ)
+                if size
+                else None
+            )
+            self._mmap_size = size
+        return self._mmap
+
+    def _row_to_doc(self, row) -> Dict[str, Any]:
+        doc_id, offset, length, metadata, parent_id, chunk_index = row
+        view = self._view(offset + length)
+        return {
+            "id": doc_id,
+            "text": view[offset : offset + length].decode("utf-8") if length else "",
+            "metadata": json.loads(metadata) if metadata else {},
+            "parent_id": parent_id,
+            "chunk_index": chunk_index,
+        }
+
+    def get_many(self, ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Fetch live documents by id; missing or deleted ids are omitted"""
+        ids = [int(doc_id) for doc_id in ids]
+        results = {}
+        with self._lock:
+            for start in range(0, len(ids), _SQL_BATCH):
+                batch = ids[start : start + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    "SELECT id, offset, length, metadata, parent_id, chunk_index "
+                    f"FROM documents WHERE deleted = 0 AND id IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for row in rows:
+                    results[row[0]] = self._row_to_doc(row)
+        return results
+
+    def iter_documents(
+        self, batch_size: int = 256, include_deleted: bool = True
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """Yield documents in id order, in batches
+
+        Deleted documents are included by default because index rebuilds need
+        one vector per id to keep positions aligned.
+        """
+        last_id = -1
+        live_filter = "" if include_deleted else "AND deleted = 0 "
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, offset, length, metadata, parent_id, chunk_index "
+                    f"FROM documents WHERE id > ? {live_filter}ORDER BY id LIMIT ?",
+                    (last_id, batch_size),
+                ).fetchall()
+                batch = [self._row_to_doc(row) for row in rows]
+            if not batch:
+                return
+            last_id = batch[-1]["id"]
+            yield batch
+
+    def ids_for_parent(self, parent_id: str) -> List[int]:
+        """Ids of the live chunks stored for a source document"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM documents WHERE parent_id = ? AND deleted = 0",
+                (str(parent_id),),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def mark_deleted(self, ids: List[int]) -> int:
+        """Tombstone documents; their vectors stay in the index but are skipped"""
+        ids = [int(doc_id) for doc_id in ids]
+        deleted = 0
+        with self._lock:
+            for start in range(0, len(ids), _SQL_BATCH):
+                batch = ids[start : start + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                deleted += self._conn.execute(
+                    "UPDATE documents SET deleted = 1 "
+                    f"WHERE deleted = 0 AND id IN ({placeholders})",
+                    batch,
+                ).rowcount
+            self._deleted += deleted
+        return deleted
+
+    def _count_deleted(self) -> int:
+        (count,) = self._conn.execute(
+            "SELECT COUNT(*) FROM documents WHERE deleted = 1"
+        ).fetchone()
+        return count
+
+    def deleted_count(self) -> int:
+        return self._deleted
+
+    def truncate(self, count: int):
+        """Drop documents with id >= count (inserts that never reached the index)"""
+        with self._lock:
+            self._conn.execute("DELETE FROM documents WHERE id >= ?", (count,))
+            self._count = min(self._count, count)
+            self._deleted = self._count_deleted()
+
+    def clear(self):
+        """Remove every document and reclaim the text file"""
+        with self._lock:
+            self._conn.execute("DELETE FROM documents")
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+                self._mmap_size = 0
+            self._writer.truncate(0)
+            self._count = 0
+            self._deleted = 0
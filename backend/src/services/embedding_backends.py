@@ -0,0 +1,252 @@
+import os
+import gc
+import logging
+import threading
+import numpy as np
+from typing import Dict, List, Union
+
+from .model_registry import get_embedding_model, get_tokenizer, get_or_create
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ONNX_DIR = os.path.join(
+    os.path.dirname(__file__), "..", "..", "..", "data", "onnx"
+)
+
+# Mixed Thai/English samples used to compare a backend against PyTorch
+PARITY_SAMPLES = [
+    "สรุปยอดขายประจำไตรมาสที่สาม",
+    "How do I reset my password?",
+    "รหัสสินค้า SKU-12345 หมดสต็อกเมื่อไร",
+    "Quarterly revenue grew 12% compared to last year.",
+    "ประชุมทีมการตลาดวันจันทร์ 10 โมง",
+]
+
+# Fast tokenizers are not safe to call from several threads at once
+_tokenizer_lock = threading.Lock()
+
+
+def tokenize_locked(tokenizer, *args, **kwargs):
+    """Call a shared Hugging Face tokenizer under the process-wide tokenizer lock
+
+    Every caller of a tokenizer from the model registry goes through here:
+    embedding, chunk splitting and context packing share the same objects.
+    """
+    with _tokenizer_lock:
+        return tokenizer(*args, **kwargs)
+
+
+def _mean_pool(token_embeddings: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+    """Average token vectors over real (non-padding) tokens"""
+    mask = attention_mask[..., None].astype(token_embeddings.dtype)
+    summed = (token_embeddings * mask).sum(axis=1)
+    return summed / np.clip(mask.sum(axis=1), 1e-9, None)
+
+
+def _l2_normalize(embeddings: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.clip(norms, 1e-12, None)
+
+
+def _load_private_model(model_name: str):
+    """Load the PyTorch model outside the registry, so it is freed when dropped"""
+    from transformers import AutoModel
+
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+    return model
+
+
+class TorchEmbeddingBackend:
+    """Eager PyTorch inference on the shared Hugging Face model
+
+    With ``shared=False`` the model is loaded just for this instance, for
+    one-off uses such as the ONNX parity check.
+    """
+
+    name = "torch"
+
+    def __init__(self, model_name: str, shared: bool = True):
+        self.model_name = model_name
+        if shared:
+            self.tokenizer, self.model = get_embedding_model(model_name)
+        else:
+            self.tokenizer = get_tokenizer(model_name)
+            self.model = _load_private_model(model_name)
+        if self.model is None or self.tokenizer is None:
+            raise RuntimeError(f"Embedding model {model_name} is not available")
+
+    def encode(self, texts: Union[str, List[str]], normalize: bool = True):
+        import torch
+
+        inputs = tokenize_locked(
+            self.tokenizer, texts, return_tensors="pt", truncation=True, padding=True
+        )
+        with torch.no_grad():
+            outputs = self.model(**inputs)
+        embeddings = _mean_pool(
+            outputs.last_hidden_state.numpy(), inputs["attention_mask"].numpy()
+        )
+        return _l2_normalize(embeddings) if normalize else embeddings
+
+
+class OnnxEmbeddingBackend:
+    """ONNX Runtime inference, optionally on a dynamically int8-quantized graph"""
+
+    name = "onnx"
+
+    def __init__(
+        self,
+        model_name: str,
+        quantize: bool = False,
+        model_dir: str = None,
+        num_threads: int = 0,
+    ):
+        import onnxruntime as ort
+
+        self.model_name = model_name
+        self.quantize = quantize
+        self.tokenizer = get_tokenizer(model_name)
+        if self.tokenizer is None:
+            raise RuntimeError(f"Tokenizer for {model_name} is not available")
+
+        model_dir = os.path.join(
+            model_dir or DEFAULT_ONNX_DIR, model_name.replace("/", "__")
+        )
+        model_path = self._ensure_exported(model_dir)
+        if quantize:
+            model_path = self._ensure_quantized(model_path)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            model_path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        logger.info(f"Loaded ONNX embedding model from {model_path}")
+
+    def _ensure_exported(self, model_dir: str) -> str:
+        """Export the PyTorch model to ONNX once; later starts reuse the file"""
+        model_path = os.path.join(model_dir, "model.onnx")
+        if os.path.exists(model_path):
+            return model_path
+
+        import torch
+
+        # Only needed for the export, so keep it out of the shared registry
+        model = _load_private_model(self.model_name)
+
+        class LastHiddenState(torch.nn.Module):
+            def __init__(self, wrapped):
+                super().__init__()
+                self.wrapped = wrapped
+
+            def forward(self, input_ids, attention_mask, token_type_ids=None):
+                return self.wrapped(
+                    input_ids=input_ids,
+                    attention_mask=attention_mask,
+                    token_type_ids=token_type_ids,
+                ).last_hidden_state
+
+        sample = tokenize_locked(
+            self.tokenizer, ["warm up"], return_tensors="pt", padding=True
+        )
+        input_names = [
+            name
+            for name in ("input_ids", "attention_mask", "token_type_ids")
+            if name in sample
+        ]
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+        dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+        os.makedirs(model_dir, exist_ok=True)
+        tmp_path = model_path + ".tmp"
+        torch.onnx.export(
+            LastHiddenState(model),
+            tuple(sample[name] for name in input_names),
+            tmp_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+        os.replace(tmp_path, model_path)
+        logger.info(f"Exported {self.model_name} to {model_path}")
+        del model
+        gc.collect()
+        return model_path
+
+    def _ensure_quantized(self, model_path: str) -> str:
+        """Apply dynamic int8 weight quantization to the exported graph"""
+        quantized_path = model_path.replace(".onnx", ".int8.onnx")
+        if not os.path.exists(quantized_path):
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+
+            tmp_path = quantized_path + ".tmp"
+            quantize_dynamic(model_path, tmp_path, weight_type=QuantType.QInt8)
+            os.replace(tmp_path, quantized_path)
+            logger.info(f"Quantized ONNX model written to {quantized_path}")
+        return quantized_path
+
+    def encode(self, texts: Union[str, List[str]], normalize: bool = True):
+        inputs = tokenize_locked(
+            self.tokenizer, texts, return_tensors="np", truncation=True, padding=True
+        )
+        feed = {name: inputs[name].astype(np.int64) for name in self.input_names}
+        (token_embeddings,) = self.session.run(["last_hidden_state"], feed)
+        embeddings = _mean_pool(token_embeddings, inputs["attention_mask"])
+        return _l2_normalize(embeddings) if normalize else embeddings
+
+
+def verify_parity(reference, candidate, texts: List[str] = None) -> Dict[str, float]:
+    """Compare two backends by cosine similarity of their normalized embeddings"""
+    texts = texts or PARITY_SAMPLES
+    expected = reference.encode(texts, normalize=True)
+    actual = candidate.encode(texts, normalize=True)
+    cosines = (expected * actual).sum(axis=1)
+    return {"min_cosine": float(cosines.min()), "mean_cosine": float(cosines.mean())}
+
+
+def get_embedding_backend(
+    model_name: str,
+    backend: str = "torch",
+    quantize: bool = False,
+    min_cosine: float = 0.99,
+    model_dir: str = None,
+    num_threads: int = 0,
+):
+    """Return the shared embedding backend, falling back to PyTorch if ONNX is unusable"""
+
+    def load():
+        if backend == "onnx":
+            try:
+                onnx_backend = OnnxEmbeddingBackend(
+                    model_name, quantize, model_dir, num_threads
+                )
+                if min_cosine:
+                    # A private PyTorch copy, released right after the check so
+                    # the process only keeps the (smaller) ONNX model
+                    reference = TorchEmbeddingBackend(model_name, shared=False)
+                    parity = verify_parity(reference, onnx_backend)
+                    del reference
+                    gc.collect()
+                    logger.info(f"ONNX embedding parity vs PyTorch: {parity}")
+                    if parity["min_cosine"] < min_cosine:
+                        raise RuntimeError(
+                            f"cosine {parity['min_cosine']:.4f} below {min_cosine}"
+                        )
+                return onnx_backend
+            except Exception as e:
+                logger.error(f"ONNX embedding backend unavailable, using PyTorch: {e}")
+        elif backend != "torch":
+            logger.error(f"Unknown embedding backend {backend}, using PyTorch")
+
+        try:
+            return TorchEmbeddingBackend(model_name)
+        except Exception as e:
+            logger.error(f"Error loading embedding backend: {e}")
+            return None
+
+    return get_or_create(("embedding_backend", model_name, backend, quantize), load)
@@ -0,0 +1,139 @@
+import os
+import sqlite3
+import hashlib
+import threading
+import logging
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from .model_registry import get_or_create
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "..", "..", "data", "embedding_cache.sqlite3"
+)
+
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH = 500
+
+
+def embedding_key(model: str, mode: str, text: str) -> str:
+    """Cache key for one text: model, mode prefix and a hash of the content"""
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return f"{model}|{mode}|{digest}"
+
+
+class EmbeddingCache:
+    """Embedding cache with an in-memory LRU in front of a persistent SQLite store"""
+
+    def __init__(self, db_path: str = None, max_memory_items: int = 10000):
+        self.db_path = db_path or DEFAULT_CACHE_PATH
+        self.max_memory_items = max_memory_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0}
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(
+            self.db_path, check_same_thread=False, isolation_level=None
+        )
+        # WAL lets several worker processes read while one writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(
+        self, model: str, mode: str, texts: List[str]
+    ) -> List[Optional[np.ndarray]]:
+        """Look up embeddings for texts; missing entries are returned as None"""
+        keys = [embedding_key(model, mode, text) for text in texts]
+        results = [None] * len(keys)
+        disk_lookups = {}
+
+        with self._lock:
+            for position, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    results[position] = vector
+                    self._stats["memory_hits"] += 1
+                else:
+                    disk_lookups.setdefault(key, []).append(position)
+
+            pending = list(disk_lookups)
+            for start in range(0, len(pending), _SQL_BATCH):
+                batch = pending[start : start + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                try:
+                    rows = self._conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                        batch,
+                    ).fetchall()
+                except sqlite3.Error as e:
+                    logger.error(f"Embedding cache read failed: {e}")
+                    rows = []
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    self._remember(key, vector)
+                    for position in disk_lookups[key]:
+                        results[position] = vector
+                        self._stats["disk_hits"] += 1
+
+            self._stats["misses"] += sum(1 for vector in results if vector is None)
+
+        return results
+
+    def put_many(self, model: str, mode: str, texts: List[str], vectors) -> None:
+        """Store embeddings for texts in memory and on disk"""
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = embedding_key(model, mode, text)
+                vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes()))
+
+            try:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                    rows,
+                )
+                self._conn.execute("COMMIT")
+                self._stats["writes"] += len(rows)
+            except sqlite3.Error as e:
+                logger.error(f"Embedding cache write failed: {e}")
+                try:
+                    self._conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+
+    def get_stats(self) -> Dict[str, float]:
+        """Hit/miss counters and hit rate since process start"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_items"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        return stats
+
+
+def get_embedding_cache(db_path: str = None, max_memory_items: int = 10000):
+    """Return the process-wide embedding cache for a given store path"""
+    db_path = os.path.abspath(db_path or DEFAULT_CACHE_PATH)
+    return get_or_create(
+        ("embedding_cache", db_path),
+        lambda: EmbeddingCache(db_path, max_memory_items),
+    )
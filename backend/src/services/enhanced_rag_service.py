@@ -1,74 +1,465 @@
 import os
 import json
+import logging
+import uuid
+import hashlib
+import threading
 import numpy as np
-from typing import List, Dict, Any
-from pinecone import Pinecone, ServerlessSpec
-from huggingface_hub import InferenceClient
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import List, Dict, Any, Iterable, Tuple
 
-from ..models import db, RAGDocument, UploadedFile
+from ..models import db, RAGChunkRef, RAGDocument, UploadedFile
 from ..config import Config
+from .model_registry import get_app_service, get_tokenizer
+from .chunking import chunk_document, chunk_sections, make_token_splitter
+from .embedding_backends import get_embedding_backend
+from .embedding_cache import get_embedding_cache
+from .lexical_index import (
+    DEFAULT_LEXICAL_PATH,
+    RETRIEVAL_MODES,
+    DiskBM25Index,
+    reciprocal_rank_fusion,
+)
+from .query_cache import QueryResultCache
+from .llm_client import get_llm_client
+from .pipeline import StageTimer, get_pipeline_executor, stage
+from .context_packer import pack_context
+from .file_extraction import (
+    DEFAULT_EXTRACTED_PATH,
+    extract_to_file,
+    get_extraction_pool,
+    iter_sections,
+    read_spilled,
+    spill_sections,
+)
+from .reranker import get_reranker
+from .vector_store import get_vector_store
+from .index_generations import get_index_generations
+from .job_queue import LeaseLostError, heartbeat, heartbeat_interval
+from .shard_cache import user_namespace
 from flask import current_app
 
+logger = logging.getLogger(__name__)
+
+# Streamed documents keep only this much of their text in the DB row
+DOCUMENT_PREVIEW_CHARS = 2000
+
+# Users whose index generation each service instance remembers
+SEEN_GENERATIONS = 10000
+
 
 class EnhancedRAGService:
     def __init__(self):
-        # Initialize Pinecone
-        self.pinecone_api_key = current_app.config.get("PINECONE_API_KEY")
-        self.pinecone_env = current_app.config.get("PINECONE_ENV")
-        missing_vars = []
-        if not self.pinecone_api_key:
-            missing_vars.append("PINECONE_API_KEY")
-        if not self.pinecone_env:
-            missing_vars.append("PINECONE_ENV")
-        if missing_vars:
-            raise ValueError(
-                f"Pinecone configuration incomplete. Please set the following environment variables: {', '.join(missing_vars)}"
-            )
-
-        self.pc = Pinecone(api_key=self.pinecone_api_key)
-
-        # Initialize Hugging Face Inference Client
+        # Initialize Hugging Face Inference Client; without HF_TOKEN the same
+        # model runs locally through the embedding backend
         self.hf_token = current_app.config.get("HF_TOKEN")
-        if not self.hf_token:
-            raise ValueError(
-                "Hugging Face Token must be configured. Please set the HF_TOKEN environment variable."
-            )
-        self.hf_client = InferenceClient(token=self.hf_token)
+        self.hf_client = None
+        if self.hf_token:
+            from huggingface_hub import InferenceClient
+
+            self.hf_client = InferenceClient(token=self.hf_token)
         self.embedding_model = current_app.config.get(
             "EMBEDDING_MODEL", "intfloat/multilingual-e5-large"
         )
+        self.embedding_backend_name = current_app.config.get(
+            "EMBEDDING_BACKEND", "torch"
+        )
+        self.embedding_quantize = current_app.config.get("EMBEDDING_QUANTIZE", False)
+        self.embedding_provider = (
+            "huggingface" if self.hf_client else "local_embeddings"
+        )
+        # Local and remote pooling differ slightly, so they are cached apart
+        self.embedding_cache_model = (
+            self.embedding_model if self.hf_client else f"{self.embedding_model}@local"
+        )
         # Get dimension from config or fallback to default (1024 for multilingual-e5-large)
         self.dimension = int(current_app.config.get("EMBEDDING_DIMENSION", 1024))
-        # Get index name from config or fallback to default
-        self.index_name = current_app.config.get("PINECONE_INDEX_NAME", "rag-index")
-
-        # Set index name from config or use default
-        self.index_name = current_app.config.get("PINECONE_INDEX_NAME", "rag-index")
-        self._init_pinecone_index()
-
-    def _init_pinecone_index(self):
-        """Check if Pinecone index exists, and create it if it doesn't."""
-        if self.index_name not in self.pc.list_indexes().names():
-            self.pc.create_index(
-                name=self.index_name,
-                dimension=self.dimension,
-                metric="cosine",
-                spec=ServerlessSpec(
-                    cloud=current_app.config.get("PINECONE_CLOUD", "gcp"),
-                    region=current_app.config.get("PINECONE_REGION", "asia-southeast1"),
-                ),
+        # Pinecone, or the on-disk local store when Pinecone is not configured
+        self.vector_store = get_vector_store(self.dimension)
+        # One namespace per user, so a query only scans that user's vectors
+        self.tenant_namespaces = current_app.config.get("RAG_TENANT_NAMESPACES", False)
+        self.embedding_cache = None
+        if current_app.config.get("EMBEDDING_CACHE_ENABLED", True):
+            self.embedding_cache = get_embedding_cache(
+                current_app.config.get("EMBEDDING_CACHE_PATH"),
+                int(current_app.config.get("EMBEDDING_CACHE_MEMORY_ITEMS", 10000)),
+            )
+
+        # Bulk ingest tuning
+        self.embed_batch_size = int(current_app.config.get("RAG_EMBED_BATCH_SIZE", 32))
+        self.upsert_batch_size = int(
+            current_app.config.get("RAG_UPSERT_BATCH_SIZE", 100)
+        )
+        self.max_concurrency = int(current_app.config.get("RAG_MAX_CONCURRENCY", 4))
+        # Embedding and vector-store calls share the app-wide pool, limits,
+        # retries and circuit breakers
+        self.llm_client = get_llm_client()
+        # e5 models accept 512 tokens, so remote chunks can be larger
+        self.chunk_tokens = int(current_app.config.get("RAG_REMOTE_CHUNK_TOKENS", 400))
+        self.chunk_overlap = int(current_app.config.get("RAG_CHUNK_OVERLAP", 40))
+        self._split_tokens = None
+        # Identical chunks of one user share a single vector
+        self.chunk_dedup = current_app.config.get("RAG_CHUNK_DEDUP", True)
+        # Text extracted from uploads is spilled here instead of into the DB
+        self.extracted_path = (
+            current_app.config.get("EXTRACTED_TEXT_PATH") or DEFAULT_EXTRACTED_PATH
+        )
+        # Hybrid retrieval: per-user BM25 indexes over the same chunks, kept
+        # on disk and updated at ingest time
+        self.hybrid_candidates = int(
+            current_app.config.get("RAG_HYBRID_CANDIDATES", 50)
+        )
+        self.rrf_k = int(current_app.config.get("RAG_RRF_K", 60))
+        self.lexical_path = (
+            current_app.config.get("RAG_LEXICAL_PATH") or DEFAULT_LEXICAL_PATH
+        )
+        self._lexical_indexes: Dict[int, DiskBM25Index] = {}
+        self._lexical_backfills = set()
+        self._lexical_lock = threading.Lock()
+        # Prompt context: candidates ranked by search, packed by model tokens
+        self.context_tokens = int(current_app.config.get("RAG_CONTEXT_TOKENS", 1024))
+        self.context_candidates = int(
+            current_app.config.get("RAG_CONTEXT_CANDIDATES", 8)
+        )
+        # Optional cross-encoder pass over an over-fetched candidate list
+        self.reranker = get_reranker()
+        self.rerank_candidates = int(
+            current_app.config.get("RAG_RERANK_CANDIDATES", 30)
+        )
+        self.rerank_context_candidates = int(
+            current_app.config.get("RAG_RERANK_CONTEXT_CANDIDATES", 3)
+        )
+        # Repeated questions skip re-embedding and the vector-store round trip
+        self.query_cache = None
+        if current_app.config.get("RAG_QUERY_CACHE_ENABLED", True):
+            self.query_cache = QueryResultCache(
+                int(current_app.config.get("RAG_QUERY_CACHE_SIZE", 1024)),
+                float(current_app.config.get("RAG_QUERY_CACHE_TTL", 300)),
             )
-        self.index = self.pc.Index(self.index_name)
+        # Ingestion runs in other processes: per-user generations tell this
+        # one when its loaded partitions and cached results went stale
+        self.generations = get_index_generations()
+        self._seen_generations: "OrderedDict[int, int]" = OrderedDict()
+        self._generation_lock = threading.Lock()
+
+    def _feature_extraction(self, texts: List[str], mode: str) -> List[List[float]]:
+        """One Inference API request (or local forward pass) for a batch of texts"""
+        inputs = [f"{mode}: {text}" for text in texts]
+        if self.hf_client is None:
+            backend = get_embedding_backend(
+                self.embedding_model,
+                backend=self.embedding_backend_name,
+                quantize=self.embedding_quantize,
+            )
+            if backend is None:
+                raise RuntimeError(
+                    f"Embedding model {self.embedding_model} is not available"
+                )
+            return backend.encode(inputs, normalize=False).tolist()
+
+        response = self.hf_client.feature_extraction(
+            model=self.embedding_model, inputs=inputs
+        )
+        vectors = []
+        for item in response:
+            item = np.asarray(item, dtype=np.float32)
+            # Token-level output is mean-pooled; pooled output is used as is
+            vectors.append((item.mean(axis=0) if item.ndim == 2 else item).tolist())
+        return vectors
+
+    def _embed_batch(
+        self, texts: List[str], mode: str = "passage", block: bool = False
+    ) -> List[List[float]]:
+        """Embed many texts with batched, concurrent Inference API requests.
+
+        ``block`` waits for a free embedding slot instead of failing fast,
+        for bulk ingest.
+        """
+        if self.embedding_cache:
+            cached = self.embedding_cache.get_many(
+                self.embedding_cache_model, mode, texts
+            )
+            vectors = [None if v is None else v.tolist() for v in cached]
+        else:
+            vectors = [None] * len(texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+
+        batches = [
+            missing[start : start + self.embed_batch_size]
+            for start in range(0, len(missing), self.embed_batch_size)
+        ]
+        futures = [
+            self.llm_client.submit(
+                self.embedding_provider,
+                self._feature_extraction,
+                [texts[i] for i in batch],
+                mode,
+                block=block,
+            )
+            for batch in batches
+        ]
+        for batch, future in zip(batches, futures):
+            computed = self.llm_client.result(self.embedding_provider, future)
+            for i, vector in zip(batch, computed):
+                vectors[i] = vector
+            if self.embedding_cache:
+                self.embedding_cache.put_many(
+                    self.embedding_cache_model,
+                    mode,
+                    [texts[i] for i in batch],
+                    computed,
+                )
+
+        return vectors
 
     def _embed(self, text: str, mode: str = "passage") -> List[float]:
         """Generate embedding for a text using Hugging Face Inference API."""
-        formatted_text = f"{mode}: {text}"
-        response = self.hf_client.feature_extraction(
-            model=self.embedding_model, inputs=[formatted_text]
+        return self._embed_batch([text], mode=mode)[0]
+
+    def _namespace(self, user_id: int):
+        """Vector-store namespace of a user's vectors (None: the shared default)"""
+        return user_namespace(user_id) if self.tenant_namespaces else None
+
+    def _upsert_batch(self, vectors: List[Dict[str, Any]]):
+        """Upsert vectors to the vector store in sized batches with bounded concurrency
+
+        Each vector goes to its owner's namespace (``metadata["user_id"]``).
+        """
+        groups: Dict[Any, List[Dict[str, Any]]] = {}
+        for vector in vectors:
+            namespace = self._namespace(vector["metadata"]["user_id"])
+            groups.setdefault(namespace, []).append(vector)
+        futures = [
+            self.llm_client.submit(
+                self.vector_store.provider,
+                self.vector_store.upsert,
+                group[start : start + self.upsert_batch_size],
+                namespace,
+                block=True,
+            )
+            for namespace, group in groups.items()
+            for start in range(0, len(group), self.upsert_batch_size)
+        ]
+        for future in futures:
+            self.llm_client.result(self.vector_store.provider, future)
+
+    @property
+    def split_tokens(self):
+        """Token splitter using the remote embedding model's tokenizer"""
+        if self._split_tokens is None:
+            self._split_tokens = make_token_splitter(
+                get_tokenizer(self.embedding_model)
+            )
+        return self._split_tokens
+
+    def chunk_text(self, text: str, doc_format: str = "txt") -> List[Dict[str, Any]]:
+        """Split a document into token-bounded chunks for embedding"""
+        return list(
+            chunk_document(
+                text,
+                self.split_tokens,
+                doc_format,
+                self.chunk_tokens,
+                self.chunk_overlap,
+            )
         )
-        # The response is a nested list, we take the first element's mean
-        vector = np.mean(response[0], axis=0).tolist()
-        return vector
+
+    @staticmethod
+    def _match_doc_id(match) -> int:
+        """Parent document id of a vector; legacy vectors use the bare row id"""
+        metadata = getattr(match, "metadata", None) or {}
+        if "doc_id" in metadata:
+            return int(metadata["doc_id"])
+        return int(str(match.id).split("-")[0])
+
+    def _document_chunks(self, doc: RAGDocument) -> Iterable[Dict[str, Any]]:
+        """Re-derive the chunks stored for a row; legacy rows are one vector
+
+        Streamed documents are re-chunked lazily from their spilled sections.
+        """
+        metadata = json.loads(doc.doc_metadata) if doc.doc_metadata else {}
+        if "chunk_count" not in metadata:
+            return [{"index": None, "text": doc.content or ""}]
+        content_path = metadata.get("content_path")
+        if content_path and os.path.exists(content_path):
+            return chunk_sections(
+                read_spilled(content_path),
+                self.split_tokens,
+                self.chunk_tokens,
+                self.chunk_overlap,
+            )
+        return self.chunk_text(doc.content or "", metadata.get("format") or "txt")
+
+    @staticmethod
+    def _chunk_indexes(doc: RAGDocument) -> List[Any]:
+        """Chunk indexes of a row; legacy rows have a single ``None`` chunk"""
+        metadata = json.loads(doc.doc_metadata) if doc.doc_metadata else {}
+        if "chunk_count" not in metadata:
+            return [None]
+        return list(range(metadata["chunk_count"]))
+
+    @classmethod
+    def _vector_ids(cls, doc: RAGDocument) -> List[str]:
+        """Vector-store ids of every chunk vector of a row"""
+        return [
+            str(doc.id) if index is None else f"{doc.id}-{index}"
+            for index in cls._chunk_indexes(doc)
+        ]
+
+    def _lexical_index(self, user_id: int) -> DiskBM25Index:
+        """The user's on-disk BM25 index over their chunks, opened once per process"""
+        with self._lexical_lock:
+            index = self._lexical_indexes.get(user_id)
+        if index is None:
+            # Opened outside the lock: creating the schema may wait on the file
+            index = DiskBM25Index(
+                os.path.join(self.lexical_path, f"{user_namespace(user_id)}.sqlite3")
+            )
+            with self._lexical_lock:
+                index = self._lexical_indexes.setdefault(user_id, index)
+        return index
+
+    def _searchable_lexical_index(self, user_id: int) -> DiskBM25Index:
+        """The user's BM25 index, backfilling older documents in the background
+
+        Documents ingested before the index existed are added by a
+        background thread; until it finishes, searches see the chunks
+        indexed so far instead of waiting for a rebuild.
+        """
+        index = self._lexical_index(user_id)
+        if not index.ready:
+            with self._lexical_lock:
+                if user_id in self._lexical_backfills:
+                    return index
+                self._lexical_backfills.add(user_id)
+            threading.Thread(
+                target=self._backfill_lexical,
+                args=(current_app._get_current_object(), user_id),
+                name=f"lexical-backfill-{user_id}",
+                daemon=True,
+            ).start()
+        return index
+
+    def _backfill_lexical(self, app, user_id: int):
+        """Add the user's documents that are not in their lexical index yet"""
+        try:
+            with app.app_context():
+                index = self._lexical_index(user_id)
+                indexed = set(index.document_ids())
+                doc_ids = [
+                    doc_id
+                    for (doc_id,) in db.session.query(RAGDocument.id).filter_by(
+                        user_id=user_id
+                    )
+                    if doc_id not in indexed
+                ]
+                # One document at a time, so memory stays at one document's chunks
+                for doc_id in doc_ids:
+                    doc = db.session.get(RAGDocument, doc_id)
+                    if doc is None:
+                        continue
+                    index.add_chunks(
+                        doc.id,
+                        (
+                            (chunk["index"], chunk["text"])
+                            for chunk in self._document_chunks(doc)
+                        ),
+                    )
+                    db.session.expunge(doc)
+                index.mark_ready()
+                self._invalidate_user(user_id)
+                logger.info(
+                    f"Backfilled lexical index of user {user_id}: {len(doc_ids)} documents"
+                )
+        except Exception as e:
+            logger.error(f"Lexical index backfill for user {user_id} failed: {e}")
+        finally:
+            with self._lexical_lock:
+                self._lexical_backfills.discard(user_id)
+
+    def _index_lexical(self, row: RAGDocument, chunks: List[Dict[str, Any]]):
+        """Add newly stored chunks to the owner's lexical index"""
+        self._lexical_index(row.user_id).add_chunks(
+            row.id, ((chunk["index"], chunk["text"]) for chunk in chunks)
+        )
+
+    def _unindex_lexical(self, rows: List[RAGDocument]):
+        """Remove rows from their owners' lexical indexes"""
+        by_user: Dict[int, List[int]] = {}
+        for row in rows:
+            by_user.setdefault(row.user_id, []).append(row.id)
+        for user_id, doc_ids in by_user.items():
+            self._lexical_index(user_id).remove_documents(doc_ids)
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Hit-rate statistics for the embedding cache"""
+        if not self.embedding_cache:
+            return {"enabled": False}
+        return {"enabled": True, **self.embedding_cache.get_stats()}
+
+    def get_vector_store_stats(self) -> Dict[str, Any]:
+        """Which vector store backs the service and how many vectors it holds"""
+        return {
+            "type": self.vector_store.name,
+            "tenant_namespaces": bool(self.tenant_namespaces),
+            **self.llm_client.call(
+                self.vector_store.provider, self.vector_store.get_stats
+            ),
+        }
+
+    def get_rerank_stats(self) -> Dict[str, Any]:
+        """Scoring, cache and fallback counters for the cross-encoder stage"""
+        if not self.reranker:
+            return {"enabled": False}
+        return {"enabled": True, **self.reranker.get_stats()}
+
+    def get_query_cache_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for the search result cache"""
+        if not self.query_cache:
+            return {"enabled": False}
+        return {"enabled": True, **self.query_cache.get_stats()}
+
+    def _invalidate_user(self, user_id: int):
+        """Called after a user's documents changed and the change is committed"""
+        if self.query_cache:
+            self.query_cache.invalidate(user_id)
+        try:
+            generation = self.generations.bump(user_id)
+        except Exception as e:
+            logger.error(f"Failed to publish index change of user {user_id}: {e}")
+            return
+        with self._generation_lock:
+            # Nobody else changed the user in between: this process is current
+            if self._seen_generations.get(user_id) == generation - 1:
+                self._remember_generation(user_id, generation)
+
+    def _remember_generation(self, user_id: int, generation: int):
+        """Record the generation this process is in sync with; caller holds the lock"""
+        self._seen_generations[user_id] = generation
+        self._seen_generations.move_to_end(user_id)
+        while len(self._seen_generations) > SEEN_GENERATIONS:
+            self._seen_generations.popitem(last=False)
+
+    def _sync_user(self, user_id: int):
+        """Reload what other processes changed for a user since this one last looked
+
+        A user this process has not seen (or has forgotten) counts as changed.
+        """
+        try:
+            generation = self.generations.get(user_id)
+        except Exception as e:
+            logger.error(f"Failed to read index generation of user {user_id}: {e}")
+            return
+        with self._generation_lock:
+            if self._seen_generations.get(user_id) == generation:
+                self._seen_generations.move_to_end(user_id)
+                return
+        self.vector_store.refresh(self._namespace(user_id))
+        if self.query_cache:
+            self.query_cache.invalidate(user_id)
+        with self._generation_lock:
+            self._remember_generation(user_id, generation)
 
     def add_document(
         self, content: str, user_id: int, source_type: str, source_id: str, title: str
@@ -77,97 +468,889 @@ class EnhancedRAGService:
         Adds a document to the RAG system:
         1. Creates an embedding.
         2. Saves the document content to the main DB.
-        3. Upserts the vector to Pinecone.
+        3. Upserts the vector to the vector store.
+        """
+        result = self.add_documents(
+            [
+                {
+                    "content": content,
+                    "user_id": user_id,
+                    "source_type": source_type,
+                    "source_id": source_id,
+                    "title": title,
+                }
+            ]
+        )
+        if result["failed"]:
+            raise RuntimeError(result["failed"][0]["error"])
+        return result["documents"][0]
+
+    @staticmethod
+    def _chunk_vector(
+        row: RAGDocument, chunk: Dict[str, Any], vector, vector_id: str = None
+    ) -> Dict[str, Any]:
+        return {
+            "id": vector_id or f"{row.id}-{chunk['index']}",
+            "values": vector,
+            "metadata": {
+                "user_id": row.user_id,
+                "source_type": row.source_type,
+                "title": row.title,
+                "doc_id": row.id,
+                "chunk_index": chunk["index"],
+                "text": chunk["text"],
+            },
+        }
+
+    def _dedup_chunks(
+        self, pairs: List[Tuple[RAGDocument, Dict[str, Any]]]
+    ) -> Tuple[List[Tuple[RAGDocument, Dict[str, Any]]], List[RAGChunkRef]]:
+        """Split pairs into chunks needing a new vector and references for all
+
+        A chunk whose text the user already has indexed (or that repeats
+        earlier in ``pairs``) points at the existing vector instead.
+        """
+        hashes = [
+            hashlib.sha256(chunk["text"].encode("utf-8")).hexdigest()
+            for _, chunk in pairs
+        ]
+        by_user: Dict[int, set] = {}
+        for (row, _), chunk_hash in zip(pairs, hashes):
+            by_user.setdefault(row.user_id, set()).add(chunk_hash)
+        existing = {}
+        for user_id, user_hashes in by_user.items():
+            query = RAGChunkRef.query.filter(
+                RAGChunkRef.user_id == user_id,
+                RAGChunkRef.chunk_hash.in_(user_hashes),
+            ).with_entities(RAGChunkRef.chunk_hash, RAGChunkRef.vector_id)
+            for chunk_hash, vector_id in query:
+                existing[(user_id, chunk_hash)] = vector_id
+
+        new_pairs = []
+        refs = []
+        for (row, chunk), chunk_hash in zip(pairs, hashes):
+            vector_id = existing.get((row.user_id, chunk_hash))
+            is_owner = vector_id is None
+            if is_owner:
+                vector_id = f"{row.id}-{chunk['index']}"
+                existing[(row.user_id, chunk_hash)] = vector_id
+                new_pairs.append((row, chunk))
+            refs.append(
+                RAGChunkRef(
+                    user_id=row.user_id,
+                    doc_id=row.id,
+                    chunk_index=chunk["index"],
+                    chunk_hash=chunk_hash,
+                    vector_id=vector_id,
+                    is_owner=is_owner,
+                )
+            )
+        return new_pairs, refs
+
+    def _index_chunks(self, pairs: List[Tuple[RAGDocument, Dict[str, Any]]]):
+        """Embed (row, chunk) pairs and upsert one vector per distinct chunk
+
+        With RAG_CHUNK_DEDUP a chunk the user already has indexed only gets a
+        reference to the existing vector; it is not embedded or stored again.
         """
-        # 1. Save document to main DB to get a unique ID
-        rag_doc = RAGDocument(
+        refs = []
+        if self.chunk_dedup:
+            pairs, refs = self._dedup_chunks(pairs)
+        if pairs:
+            vectors = self._embed_batch(
+                [chunk["text"] for _, chunk in pairs], block=True
+            )
+            self._upsert_batch(
+                [
+                    self._chunk_vector(row, chunk, vector)
+                    for (row, chunk), vector in zip(pairs, vectors)
+                ]
+            )
+        if refs:
+            db.session.add_all(refs)
+            db.session.commit()
+
+    def _release_vectors(
+        self, docs: List[RAGDocument], chunk_counts: Dict[int, int] = None
+    ):
+        """Delete the vectors of ``docs`` that no other document shares
+
+        ``chunk_counts`` gives the chunks sent so far for rows that never
+        finished indexing. A shared vector whose metadata points at one of
+        ``docs`` is handed to a remaining reference: it is re-upserted under
+        the same id with that document's metadata.
+        """
+        chunk_counts = chunk_counts or {}
+        doc_ids = [doc.id for doc in docs]
+        candidates: Dict[str, int] = {}  # vector id -> user id
+        for doc in docs:
+            if doc.id in chunk_counts:
+                ids = [f"{doc.id}-{index}" for index in range(chunk_counts[doc.id])]
+            else:
+                ids = self._vector_ids(doc)
+            candidates.update((vector_id, doc.user_id) for vector_id in ids)
+        refs = RAGChunkRef.query.filter(RAGChunkRef.doc_id.in_(doc_ids)).all()
+        candidates.update((ref.vector_id, ref.user_id) for ref in refs)
+
+        survivors: Dict[str, List[RAGChunkRef]] = {}
+        if refs:
+            remaining = RAGChunkRef.query.filter(
+                RAGChunkRef.vector_id.in_(list(candidates)),
+                ~RAGChunkRef.doc_id.in_(doc_ids),
+            ).order_by(RAGChunkRef.id)
+            for ref in remaining:
+                survivors.setdefault(ref.vector_id, []).append(ref)
+
+        # Re-point shared vectors whose owner is going away
+        handovers: Dict[int, Dict[int, str]] = {}  # doc id -> chunk index -> vector id
+        for vector_id, remaining_refs in survivors.items():
+            if not any(ref.is_owner for ref in remaining_refs):
+                heir = remaining_refs[0]
+                heir.is_owner = True
+                handovers.setdefault(heir.doc_id, {})[heir.chunk_index] = vector_id
+        for heir_id, indexes in handovers.items():
+            heir_doc = db.session.get(RAGDocument, heir_id)
+            pairs = [
+                (heir_doc, chunk)
+                for chunk in self._document_chunks(heir_doc)
+                if chunk["index"] in indexes
+            ]
+            vectors = self._embed_batch(
+                [chunk["text"] for _, chunk in pairs], block=True
+            )
+            self._upsert_batch(
+                [
+                    self._chunk_vector(row, chunk, vector, indexes[chunk["index"]])
+                    for (row, chunk), vector in zip(pairs, vectors)
+                ]
+            )
+
+        stale: Dict[Any, List[str]] = {}
+        for vector_id, user_id in candidates.items():
+            if vector_id not in survivors:
+                stale.setdefault(self._namespace(user_id), []).append(vector_id)
+        for namespace, ids in stale.items():
+            self.llm_client.call(
+                self.vector_store.provider, self.vector_store.delete, ids, namespace
+            )
+        RAGChunkRef.query.filter(RAGChunkRef.doc_id.in_(doc_ids)).delete(
+            synchronize_session=False
+        )
+
+    def add_documents(self, documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Bulk version of add_document for large imports:
+        1. Inserts all RAGDocument rows in one transaction.
+        2. Splits each content into token-bounded chunks and embeds them in
+           batched, concurrent Inference API requests.
+        3. Upserts one vector per chunk (id ``"<doc id>-<chunk index>"``) to
+           the vector store in sized batches.
+
+        Each item needs content, user_id, source_type, source_id and title;
+        an optional ``format`` (md/html/...) enables heading-aware chunking.
+        Rows whose embedding or upsert fails are removed again and reported
+        in ``failed`` by their input position.
+        """
+        failed = []
+        rows = []
+        positions = []
+        chunks = []
+        for position, doc in enumerate(documents):
+            content = doc.get("content") or ""
+            if not content.strip():
+                failed.append({"index": position, "error": "Content cannot be empty"})
+                continue
+            doc_chunks = self.chunk_text(content, doc.get("format") or "txt")
+            rows.append(
+                RAGDocument(
+                    user_id=doc["user_id"],
+                    source_type=doc.get("source_type"),
+                    source_id=doc.get("source_id"),
+                    title=doc.get("title"),
+                    content=content,
+                    doc_metadata=json.dumps(
+                        {
+                            "chunk_count": len(doc_chunks),
+                            "format": doc.get("format") or "txt",
+                        }
+                    ),
+                )
+            )
+            positions.append(position)
+            chunks.append(doc_chunks)
+
+        if not rows:
+            return {"documents": [], "failed": failed}
+
+        # 1. Save all documents to the main DB to get unique IDs
+        db.session.add_all(rows)
+        db.session.commit()
+
+        # 2 + 3. Embed and upsert in windows; a failed window only drops its rows
+        window = self.upsert_batch_size * self.max_concurrency
+        stored = []
+        for start in range(0, len(rows), window):
+            batch = rows[start : start + window]
+            batch_positions = positions[start : start + window]
+            batch_chunks = [
+                (row, chunk)
+                for row, doc_chunks in zip(batch, chunks[start : start + window])
+                for chunk in doc_chunks
+            ]
+            try:
+                self._index_chunks(batch_chunks)
+                stored.extend(batch)
+                for row, doc_chunks in zip(batch, chunks[start : start + window]):
+                    self._index_lexical(row, doc_chunks)
+            except Exception as e:
+                logger.error(f"Failed to index document batch: {e}")
+                failed.extend(
+                    {"index": position, "error": str(e)} for position in batch_positions
+                )
+                # Earlier sub-batches of the window may already be upserted
+                try:
+                    self._release_vectors(
+                        batch,
+                        {
+                            row.id: len(doc_chunks)
+                            for row, doc_chunks in zip(
+                                batch, chunks[start : start + window]
+                            )
+                        },
+                    )
+                except Exception as release_error:
+                    logger.error(f"Failed to remove partial vectors: {release_error}")
+                self._unindex_lexical(batch)
+                for row in batch:
+                    db.session.delete(row)
+                db.session.commit()
+
+        for user_id in {row.user_id for row in stored}:
+            self._invalidate_user(user_id)
+
+        failed.sort(key=lambda item: item["index"])
+        return {"documents": stored, "failed": failed}
+
+    def _index_chunk_stream(
+        self,
+        pairs: Iterable[Tuple[RAGDocument, Dict[str, Any]]],
+        state: Dict[int, Dict[str, Any]],
+    ):
+        """Embed and upsert a stream of (row, chunk) pairs one window at a time
+
+        ``state`` maps each row id to its ``chunks`` sent so far, text
+        ``preview`` and ``error``. A failed window marks all its rows failed;
+        their later chunks are skipped. Chunks of different rows share
+        windows, so many small documents still make full embedding batches.
+        """
+        window = self.upsert_batch_size * self.max_concurrency
+        pending: List[Tuple[RAGDocument, Dict[str, Any]]] = []
+
+        def flush():
+            try:
+                self._index_chunks(pending)
+                by_row: Dict[RAGDocument, List[Dict[str, Any]]] = {}
+                for row, chunk in pending:
+                    by_row.setdefault(row, []).append(chunk)
+                for row, chunks in by_row.items():
+                    self._index_lexical(row, chunks)
+            except Exception as e:
+                logger.error(f"Failed to index document chunks: {e}")
+                for row, _ in pending:
+                    state[row.id]["error"] = str(e)
+            pending.clear()
+
+        for row, chunk in pairs:
+            entry = state[row.id]
+            if entry["error"]:
+                continue
+            entry["chunks"] += 1
+            if len(entry["preview"]) < DOCUMENT_PREVIEW_CHARS:
+                entry["preview"] += chunk["text"] + "\n\n"
+            pending.append((row, chunk))
+            if len(pending) >= window:
+                flush()
+                # Long ingestion jobs keep their worker lease alive
+                heartbeat()
+        if pending:
+            flush()
+
+    def _finish_rows(self, rows: List[RAGDocument], state: Dict[int, Dict[str, Any]]):
+        """Commit streamed rows: keep the indexed ones, roll back the failed ones
+
+        Failed rows lose the vectors written before the failure and are
+        deleted; the others get their preview and chunk count.
+        """
+        failed = []
+        for row in rows:
+            entry = state[row.id]
+            if not entry["error"] and not entry["chunks"]:
+                entry["error"] = "Content cannot be empty"
+            if entry["error"]:
+                failed.append(row)
+                continue
+            metadata = json.loads(row.doc_metadata) if row.doc_metadata else {}
+            row.content = entry["preview"][:DOCUMENT_PREVIEW_CHARS].rstrip()
+            row.doc_metadata = json.dumps({**metadata, "chunk_count": entry["chunks"]})
+
+        if failed:
+            self._release_vectors(
+                failed, {row.id: state[row.id]["chunks"] for row in failed}
+            )
+        self._unindex_lexical(failed)
+        user_ids = {row.user_id for row in rows}
+        for row in failed:
+            db.session.delete(row)
+        db.session.commit()
+        for user_id in user_ids:
+            self._invalidate_user(user_id)
+
+    @staticmethod
+    def _stream_state() -> Dict[str, Any]:
+        return {"chunks": 0, "preview": "", "error": None}
+
+    def add_document_stream(
+        self,
+        sections: Iterable[Tuple[str, str]],
+        user_id: int,
+        source_type: str,
+        source_id: str,
+        title: str,
+        doc_format: str = "txt",
+        content_path: str = None,
+    ) -> RAGDocument:
+        """Index a document given as a stream of (heading, body) sections
+
+        Chunks are embedded and upserted one window at a time, so memory use
+        does not grow with the document. The row keeps only a preview of the
+        text; ``content_path`` names the spilled sections its chunks are
+        re-derived from. On failure the vectors written so far and the row
+        are removed again and a RuntimeError is raised.
+        """
+        row = RAGDocument(
             user_id=user_id,
             source_type=source_type,
             source_id=source_id,
             title=title,
-            content=content,
+            content="",
+            doc_metadata=json.dumps(
+                {"format": doc_format, "content_path": content_path}
+            ),
         )
-        db.session.add(rag_doc)
+        db.session.add(row)
         db.session.commit()
 
-        # 2. Create embedding
-        vector = self._embed(content, mode="passage")
+        row_id = row.id
+        state = {row_id: self._stream_state()}
+        try:
+            self._index_chunk_stream(
+                (
+                    (row, chunk)
+                    for chunk in chunk_sections(
+                        sections,
+                        self.split_tokens,
+                        self.chunk_tokens,
+                        self.chunk_overlap,
+                    )
+                ),
+                state,
+            )
+        except Exception as e:
+            state[row_id]["error"] = str(e)
+        self._finish_rows([row], state)
+        if state[row_id]["error"]:
+            raise RuntimeError(state[row_id]["error"])
+        return row
+
+    def migrate_to_namespaces(self, batch_size: int = None) -> Dict[str, int]:
+        """Move vectors written before per-user namespaces into them
 
-        # 3. Upsert to Pinecone
-        self.index.upsert(
-            vectors=[
-                {
-                    "id": str(rag_doc.id),
-                    "values": vector,
-                    "metadata": {
-                        "user_id": user_id,
-                        "source_type": source_type,
-                        "title": title,
-                    },
-                }
-            ]
+        Chunks are re-embedded (mostly from the embedding cache) into each
+        owner's namespace and the old copies are removed from the default
+        namespace. Only vectors that exist are moved: a deduplicated chunk
+        that references another chunk's vector has none of its own. Safe
+        to run again; already migrated ids are just rewritten.
+        """
+        if not self.tenant_namespaces:
+            raise ValueError("RAG_TENANT_NAMESPACES is disabled")
+
+        batch_size = batch_size or self.upsert_batch_size
+        migrated = {"documents": 0, "vectors": 0}
+        last_id = 0
+        while True:
+            rows = (
+                RAGDocument.query.filter(RAGDocument.id > last_id)
+                .order_by(RAGDocument.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            last_id = rows[-1].id
+            owned = self._owned_vectors(rows)
+            if owned:
+                vectors = self._embed_batch(
+                    [chunk["text"] for _, chunk, _ in owned], block=True
+                )
+                self._upsert_batch(
+                    [
+                        self._chunk_vector(row, chunk, vector, vector_id)
+                        for (row, chunk, vector_id), vector in zip(owned, vectors)
+                    ]
+                )
+                self.llm_client.call(
+                    self.vector_store.provider,
+                    self.vector_store.delete,
+                    [vector_id for _, _, vector_id in owned],
+                    None,
+                )
+            migrated["documents"] += len(rows)
+            migrated["vectors"] += len(owned)
+            for user_id in {row.user_id for row in rows}:
+                self._invalidate_user(user_id)
+        return migrated
+
+    def _owned_vectors(
+        self, rows: List[RAGDocument]
+    ) -> List[Tuple[RAGDocument, Dict[str, Any], str]]:
+        """(row, chunk, vector id) for each vector whose metadata points at ``rows``
+
+        Rows indexed with chunk dedup own the vectors of their owner
+        references; rows without references own one vector per chunk.
+        """
+        refs = RAGChunkRef.query.filter(
+            RAGChunkRef.doc_id.in_([row.id for row in rows])
+        ).all()
+        referenced = {ref.doc_id for ref in refs}
+        owners: Dict[int, Dict[int, str]] = {}  # doc id -> chunk index -> vector id
+        for ref in refs:
+            if ref.is_owner:
+                owners.setdefault(ref.doc_id, {})[ref.chunk_index] = ref.vector_id
+
+        owned = []
+        for row in rows:
+            if row.id not in referenced:
+                owned.extend(
+                    (
+                        row,
+                        chunk,
+                        (
+                            str(row.id)
+                            if chunk["index"] is None
+                            else f"{row.id}-{chunk['index']}"
+                        ),
+                    )
+                    for chunk in self._document_chunks(row)
+                )
+            elif row.id in owners:
+                indexes = owners[row.id]
+                owned.extend(
+                    (row, chunk, indexes[chunk["index"]])
+                    for chunk in self._document_chunks(row)
+                    if chunk["index"] in indexes
+                )
+        return owned
+
+    def delete_document(self, doc_id: int, user_id: int) -> bool:
+        """Delete a document's row, its chunk vectors and its lexical entries"""
+        doc = RAGDocument.query.filter_by(id=doc_id, user_id=user_id).first()
+        if not doc:
+            return False
+
+        self._release_vectors([doc])
+        self._unindex_lexical([doc])
+
+        metadata = json.loads(doc.doc_metadata) if doc.doc_metadata else {}
+        db.session.delete(doc)
+        db.session.commit()
+        content_path = metadata.get("content_path")
+        if content_path and os.path.exists(content_path):
+            os.remove(content_path)
+        self._invalidate_user(user_id)
+        return True
+
+    def process_uploaded_file(self, file_id: int, user_id: int) -> bool:
+        """Stream an uploaded file through extraction, chunking and indexing
+
+        Sections are spilled to EXTRACTED_TEXT_PATH as they are read, so
+        large files never sit in memory or in the DB whole. Replaces the
+        file's previous RAG document, if any, and marks the upload
+        processed. Run by ingestion workers, not in web requests.
+        """
+        uploaded_file = UploadedFile.query.filter_by(
+            id=file_id, user_id=user_id
+        ).first()
+        if not uploaded_file:
+            logger.error(f"Uploaded file {file_id} not found")
+            return False
+
+        previous = RAGDocument.query.filter_by(
+            user_id=user_id, source_type="file", source_id=str(file_id)
+        ).all()
+        content_path = self._content_path(file_id)
+        spilled = None
+        try:
+            sections, doc_format = iter_sections(
+                uploaded_file.file_path, uploaded_file.file_type
+            )
+            spilled = spill_sections(sections, content_path)
+            row = self.add_document_stream(
+                spilled,
+                user_id,
+                "file",
+                str(file_id),
+                uploaded_file.original_filename,
+                doc_format,
+                content_path,
+            )
+        except Exception as e:
+            logger.error(f"Failed to process file {file_id}: {e}")
+            if spilled is not None:
+                spilled.close()
+            if os.path.exists(content_path):
+                os.remove(content_path)
+            return False
+
+        for doc in previous:
+            self.delete_document(doc.id, user_id)
+        # Only a preview; the full text lives in the document's content_path
+        uploaded_file.extracted_content = row.content
+        uploaded_file.is_processed = True
+        db.session.commit()
+        return True
+
+    def _content_path(self, file_id: int) -> str:
+        # Each extraction gets its own file, so a previous document's text
+        # stays valid until that document is deleted
+        return os.path.abspath(
+            os.path.join(self.extracted_path, f"{file_id}-{uuid.uuid4().hex}.jsonl.gz")
         )
 
-        return rag_doc
+    def process_uploaded_files(
+        self, file_ids: List[int], user_id: int
+    ) -> Dict[str, Any]:
+        """Index a batch of uploaded files (a multi-file or zip upload)
+
+        Extraction fans out over the extraction process pool, since PDF and
+        docx parsing is CPU-bound; each file is spilled to disk there. As
+        files finish, their chunks feed one shared stream of embedding and
+        upsert windows, and the rows are written in bulk. Returns the
+        ``processed`` file ids and the ``failed`` ones with their errors.
+        """
+        files = UploadedFile.query.filter(
+            UploadedFile.id.in_(file_ids), UploadedFile.user_id == user_id
+        ).all()
+        found = {uploaded_file.id for uploaded_file in files}
+        failed = [
+            {"file_id": file_id, "error": "File not found"}
+            for file_id in file_ids
+            if file_id not in found
+        ]
+        if not files:
+            return {"processed": [], "failed": failed}
+
+        previous = RAGDocument.query.filter(
+            RAGDocument.user_id == user_id,
+            RAGDocument.source_type == "file",
+            RAGDocument.source_id.in_([str(file_id) for file_id in found]),
+        ).all()
+        rows = {}
+        content_paths = {}
+        for uploaded_file in files:
+            content_paths[uploaded_file.id] = self._content_path(uploaded_file.id)
+            rows[uploaded_file.id] = RAGDocument(
+                user_id=user_id,
+                source_type="file",
+                source_id=str(uploaded_file.id),
+                title=uploaded_file.original_filename,
+                content="",
+                doc_metadata=json.dumps(
+                    {"content_path": content_paths[uploaded_file.id]}
+                ),
+            )
+        db.session.add_all(rows.values())
+        db.session.commit()
+        row_ids = {file_id: row.id for file_id, row in rows.items()}
+
+        state = {row_id: self._stream_state() for row_id in row_ids.values()}
+        pool = get_extraction_pool()
+        futures = {}
+        for uploaded_file in files:
+            row = rows[uploaded_file.id]
+            content_path = content_paths[uploaded_file.id]
+            future = pool.submit(
+                extract_to_file,
+                uploaded_file.file_path,
+                uploaded_file.file_type,
+                content_path,
+            )
+            futures[future] = (row, content_path)
+
+        def finished_extractions():
+            # Wake up to renew the job lease while a slow file is extracted
+            pending = set(futures)
+            while pending:
+                done, pending = wait(
+                    pending, timeout=heartbeat_interval(), return_when=FIRST_COMPLETED
+                )
+                heartbeat()
+                yield from done
+
+        def extracted_chunks():
+            for future in finished_extractions():
+                row, content_path = futures[future]
+                try:
+                    doc_format = future.result()
+                    metadata = json.loads(row.doc_metadata)
+                    row.doc_metadata = json.dumps({**metadata, "format": doc_format})
+                    for chunk in chunk_sections(
+                        read_spilled(content_path),
+                        self.split_tokens,
+                        self.chunk_tokens,
+                        self.chunk_overlap,
+                    ):
+                        yield row, chunk
+                except Exception as e:
+                    logger.error(f"Failed to extract file {row.source_id}: {e}")
+                    state[row.id]["error"] = str(e)
+
+        try:
+            self._index_chunk_stream(extracted_chunks(), state)
+        except LeaseLostError as e:
+            # Another worker has the job now; drop what this one indexed
+            for entry in state.values():
+                entry["error"] = str(e)
+            self._finish_rows(list(rows.values()), state)
+            raise
+        self._finish_rows(list(rows.values()), state)
+
+        processed = []
+        for uploaded_file in files:
+            entry = state[row_ids[uploaded_file.id]]
+            if entry["error"]:
+                failed.append({"file_id": uploaded_file.id, "error": entry["error"]})
+                if os.path.exists(content_paths[uploaded_file.id]):
+                    os.remove(content_paths[uploaded_file.id])
+                continue
+            uploaded_file.extracted_content = rows[uploaded_file.id].content
+            uploaded_file.is_processed = True
+            processed.append(uploaded_file.id)
+        db.session.commit()
+
+        for doc in previous:
+            if int(doc.source_id) in processed:
+                self.delete_document(doc.id, user_id)
+        return {"processed": processed, "failed": failed}
 
     def semantic_search(
-        self, query: str, user_id: int, top_k: int = 5
+        self,
+        query: str,
+        user_id: int,
+        top_k: int = 5,
+        mode: str = "vector",
+        timer: StageTimer = None,
+        rerank: bool = None,
     ) -> List[Dict[str, Any]]:
         """
         Performs semantic search:
         1. Creates a query embedding.
-        2. Queries Pinecone for similar vectors.
+        2. Queries the vector store for similar vectors.
         3. Fetches full document content from the main DB.
+
+        ``mode`` "lexical" uses BM25 only; "hybrid" fuses the vector and
+        BM25 rankings with reciprocal-rank fusion. The lexical side supplies
+        the extra hybrid candidates, so the vector store is still queried for top_k.
+        With ``rerank`` (default: on when RAG_RERANK_ENABLED) RAG_RERANK_CANDIDATES
+        are fetched and a cross-encoder picks the top_k of them.
+        Results are cached per user until the TTL expires or that user's
+        documents change.
         """
-        # 1. Create query embedding
-        query_vector = self._embed(query, mode="query")
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        rerank = self.reranker is not None and rerank is not False
+        self._sync_user(user_id)
 
-        # 2. Query Pinecone
-        query_results = self.index.query(
-            vector=query_vector,
-            top_k=top_k,
-            filter={"user_id": user_id},
-            include_metadata=True,
-        )
+        cache_key = None
+        if self.query_cache:
+            cache_key = self.query_cache.key(user_id, query, top_k, mode, rerank)
+            cached = self.query_cache.get(cache_key)
+            if cached is not None:
+                return [dict(result) for result in cached]
+
+        reranked = True
+        if rerank:
+            fetch_k = max(top_k, self.rerank_candidates)
+            results = self._search(query, user_id, fetch_k, mode, timer)
+            with stage(timer, "rerank"):
+                results, reranked = self.reranker.rerank(
+                    query, results, top_k, text_key="content"
+                )
+        else:
+            results = self._search(query, user_id, top_k, mode, timer)
+        # A fallback order must not be served as re-ranked for the whole TTL
+        if cache_key and reranked:
+            self.query_cache.put(cache_key, [dict(result) for result in results])
+        return results
+
+    def _vector_hits(
+        self, query: str, user_id: int, top_k: int, timer: StageTimer = None
+    ) -> Dict[tuple, tuple]:
+        """Vector-store matches keyed by (doc id, chunk index); each match is one chunk"""
+        with stage(timer, "embed_query"):
+            query_vector = self._embed(query, mode="query")
+        with stage(timer, "vector_search"):
+            namespace = self._namespace(user_id)
+            matches = self.llm_client.call(
+                self.vector_store.provider,
+                self.vector_store.query,
+                query_vector,
+                top_k,
+                # A user's namespace holds only their vectors
+                filter=None if namespace else {"user_id": user_id},
+                namespace=namespace,
+            )
+        vector_hits = {}
+        for match in matches:
+            metadata = match.metadata or {}
+            key = (self._match_doc_id(match), metadata.get("chunk_index"))
+            vector_hits.setdefault(key, (match.score, metadata.get("text")))
+        return vector_hits
+
+    def _search(
+        self, query: str, user_id: int, top_k: int, mode: str, timer=None
+    ) -> List[Dict[str, Any]]:
+        """Uncached body of semantic_search"""
+        # 1 + 2. Query the vector store; in hybrid mode this overlaps the BM25 lookup
+        vector_future = None
+        vector_hits = {}
+        if mode == "hybrid":
+            vector_future = get_pipeline_executor().submit(
+                self._vector_hits, query, user_id, top_k, timer
+            )
+        elif mode == "vector":
+            vector_hits = self._vector_hits(query, user_id, top_k, timer)
+
+        lexical_hits = {}
+        lexical_index = None
+        if mode != "vector":
+            depth = self.hybrid_candidates if mode == "hybrid" else top_k
+            with stage(timer, "lexical_search"):
+                lexical_index = self._searchable_lexical_index(user_id)
+                lexical_hits = dict(lexical_index.search(query, max(depth, top_k)))
 
-        # 3. Fetch full documents from DB
+        if vector_future is not None:
+            vector_hits = vector_future.result()
+
+        if mode == "hybrid":
+            ranked = reciprocal_rank_fusion(
+                [list(vector_hits), list(lexical_hits)], k=self.rrf_k
+            )[:top_k]
+        else:
+            hits = vector_hits if mode == "vector" else lexical_hits
+            ranked = [(key, None) for key in hits]
+
+        # 3. Fetch parent documents from DB
         results = []
-        if query_results.matches:
-            doc_ids = [int(match.id) for match in query_results.matches]
-            db_docs = RAGDocument.query.filter(RAGDocument.id.in_(doc_ids)).all()
+        if ranked:
+            doc_ids = {doc_id for (doc_id, _), _ in ranked}
+            with stage(timer, "fetch_documents"):
+                db_docs = RAGDocument.query.filter(RAGDocument.id.in_(doc_ids)).all()
 
             # Create a map for quick lookup
             doc_map = {doc.id: doc for doc in db_docs}
 
-            for match in query_results.matches:
-                doc_id = int(match.id)
-                if doc_id in doc_map:
-                    doc = doc_map[doc_id]
-                    result = doc.to_dict()
-                    result["similarity_score"] = match.score
-                    results.append(result)
+            # Chunk text of lexical-only hits comes from the lexical index
+            payloads = {}
+            if lexical_index is not None:
+                payloads = lexical_index.payloads(
+                    key for key, _ in ranked if key not in vector_hits
+                )
+            for key, fusion_score in ranked:
+                doc_id, chunk_index = key
+                if doc_id not in doc_map:
+                    continue
+                result = doc_map[doc_id].to_dict()
+                score, text = vector_hits.get(key, (None, None))
+                if text is None:
+                    text = payloads.get(key)
+                if text is not None and chunk_index is not None:
+                    result["content"] = text
+                    result["chunk_index"] = chunk_index
+                result["similarity_score"] = score
+                if mode != "vector":
+                    result["lexical_score"] = lexical_hits.get(key)
+                if fusion_score is not None:
+                    result["fusion_score"] = fusion_score
+                results.append(result)
 
         return results
 
+    def build_rag_context(
+        self,
+        query: str,
+        user_id: int,
+        max_tokens: int = None,
+        mode: str = "vector",
+        timer: StageTimer = None,
+        rerank: bool = None,
+    ) -> Dict[str, Any]:
+        """Pack the best-ranked chunks into a model-token budget
+
+        Returns ``{"context", "token_count", "sources"}``; each source carries
+        its document id, title, chunk index, ranking score and token count.
+        Re-ranked searches contribute fewer, more precise candidates.
+        """
+        rerank = self.reranker is not None and rerank is not False
+        results = self.semantic_search(
+            query,
+            user_id,
+            top_k=(
+                self.rerank_context_candidates if rerank else self.context_candidates
+            ),
+            mode=mode,
+            timer=timer,
+            rerank=rerank,
+        )
+        chunks = []
+        for result in results:
+            score = result.get("rerank_score")
+            if score is None:
+                score = result.get("fusion_score")
+            if score is None:
+                score = result.get("similarity_score")
+            if score is None:
+                score = result.get("lexical_score")
+            chunks.append(
+                {
+                    "doc_id": result.get("id"),
+                    "title": result.get("title", "Unknown"),
+                    "chunk_index": result.get("chunk_index"),
+                    "score": score,
+                    "text": result.get("content", ""),
+                }
+            )
+        with stage(timer, "pack_context"):
+            return pack_context(
+                chunks,
+                self.split_tokens,
+                max_tokens or self.context_tokens,
+                self.chunk_tokens,
+            )
+
     def get_rag_context(
-        self, query: str, user_id: int, max_context_length: int = 4000
+        self,
+        query: str,
+        user_id: int,
+        max_tokens: int = None,
+        mode: str = "vector",
+        timer: StageTimer = None,
     ) -> str:
         """Get relevant context for RAG-enhanced chat."""
-        search_results = self.semantic_search(query, user_id, top_k=3)
-
-        context = ""
-        for result in search_results:
-            content_to_add = f"Document: {result.get('title', 'Unknown')}\nContent: {result.get('content', '')}\n\n"
-            if len(context) + len(content_to_add) <= max_context_length:
-                context += content_to_add
-            else:
-                break
-
-        return context
+        return self.build_rag_context(query, user_id, max_tokens, mode, timer)[
+            "context"
+        ]
 
 
 def get_rag_service():
     """Get or create EnhancedRAGService instance using Flask's app context."""
-    if "enhanced_rag_service" not in current_app.extensions:
-        current_app.extensions["enhanced_rag_service"] = EnhancedRAGService()
-    return current_app.extensions["enhanced_rag_service"]
+    return get_app_service("enhanced_rag_service", EnhancedRAGService)
@@ -0,0 +1,349 @@
+import os
+import io
+import re
+import csv
+import gzip
+import json
+import logging
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
+from typing import Callable, Dict, Iterable, Iterator, List, Set, Tuple
+
+from flask import current_app
+
+from .model_registry import get_app_service
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXTRACTED_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "..", "..", "data", "extracted"
+)
+
+# Extractors yield (heading, body) sections of at most about this many
+# characters, so no step ever holds more than one section of a document
+SECTION_CHARS = 64 * 1024
+# Spreadsheet rows per section; each section repeats the header row
+SECTION_ROWS = 200
+
+_MD_HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+
+Section = Tuple[str, str]
+
+
+class UnsupportedFileType(ValueError):
+    pass
+
+
+def _detect_encoding(path: str) -> str:
+    with open(path, "rb") as f:
+        sample = f.read(SECTION_CHARS)
+    if sample.startswith(b"\xef\xbb\xbf"):
+        return "utf-8-sig"
+    try:
+        sample.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError as e:
+        # A multi-byte character cut off at the end of the sample is fine
+        if e.start >= len(sample) - 3:
+            return "utf-8"
+    import chardet
+
+    return chardet.detect(sample).get("encoding") or "utf-8"
+
+
+def _open_text(path: str):
+    return open(path, encoding=_detect_encoding(path), errors="replace", newline="")
+
+
+def _text(path: str, markdown: bool = False) -> Iterator[Section]:
+    """Plain text in line-aligned blocks; markdown is also split on headings
+
+    Reads are capped at SECTION_CHARS, so a file with one enormous line is
+    still read a section at a time.
+    """
+    heading = ""
+    lines: List[str] = []
+    size = 0
+    line_start = True
+    with _open_text(path) as f:
+        while True:
+            line = f.readline(SECTION_CHARS)
+            if not line:
+                break
+            # Only a whole line (not the tail of a cut one) can be a heading
+            match = _MD_HEADING_RE.match(line) if markdown and line_start else None
+            line_start = line.endswith(("\n", "\r"))
+            if match or size + len(line) > SECTION_CHARS:
+                body = "".join(lines)
+                if body.strip():
+                    yield heading, body
+                lines, size = [], 0
+                if match:
+                    heading = match.group(2).strip()
+            lines.append(line)
+            size += len(line)
+    body = "".join(lines)
+    if body.strip():
+        yield heading, body
+
+
+class _HTMLSections(HTMLParser):
+    """Incremental HTML to text that starts a new section at each h1-h6"""
+
+    SKIP = {"script", "style", "head"}
+    BREAKS = {"br", "p", "div", "li", "tr"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.sections: List[Section] = []
+        self.heading = ""
+        self.parts: List[str] = []
+        self.size = 0
+        self.skipping = 0
+        self.heading_parts = None
+
+    def _flush(self):
+        body = "".join(self.parts)
+        if body.strip():
+            self.sections.append((self.heading, re.sub(r"[ \t]+", " ", body)))
+        self.parts, self.size = [], 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self.skipping += 1
+        elif re.fullmatch(r"h[1-6]", tag):
+            self._flush()
+            self.heading_parts = []
+        elif tag in self.BREAKS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self.skipping = max(0, self.skipping - 1)
+        elif re.fullmatch(r"h[1-6]", tag) and self.heading_parts is not None:
+            self.heading = " ".join("".join(self.heading_parts).split())
+            self.parts.append(self.heading + "\n")
+            self.heading_parts = None
+        elif tag in self.BREAKS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if self.skipping:
+            return
+        if self.heading_parts is not None:
+            self.heading_parts.append(data)
+            return
+        self.parts.append(data)
+        self.size += len(data)
+        if self.size > SECTION_CHARS:
+            self._flush()
+
+
+def _html(path: str) -> Iterator[Section]:
+    parser = _HTMLSections()
+    with _open_text(path) as f:
+        while True:
+            block = f.read(SECTION_CHARS)
+            if not block:
+                break
+            parser.feed(block)
+            yield from parser.sections
+            parser.sections.clear()
+    parser.close()
+    parser._flush()
+    yield from parser.sections
+
+
+def _pdf(path: str) -> Iterator[Section]:
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(path)
+    for number, page in enumerate(reader.pages, start=1):
+        text = page.extract_text() or ""
+        if text.strip():
+            yield f"Page {number}", text
+
+
+def _docx(path: str) -> Iterator[Section]:
+    import docx
+
+    document = docx.Document(path)
+    heading = ""
+    parts: List[str] = []
+    size = 0
+    for paragraph in document.paragraphs:
+        style = paragraph.style.name if paragraph.style is not None else ""
+        if style.startswith("Heading") or size > SECTION_CHARS:
+            if parts:
+                yield heading, "\n".join(parts)
+            parts, size = [], 0
+            if style.startswith("Heading"):
+                heading = paragraph.text.strip()
+        if paragraph.text.strip():
+            parts.append(paragraph.text)
+            size += len(paragraph.text)
+    if parts:
+        yield heading, "\n".join(parts)
+    for table in document.tables:
+        yield from _rows(
+            "Table", ([cell.text for cell in row.cells] for row in table.rows)
+        )
+
+
+def _rows(heading: str, rows: Iterable[Iterable]) -> Iterator[Section]:
+    """Group table rows into CSV sections that each start with the header row"""
+    header = None
+    block = io.StringIO()
+    writer = csv.writer(block, lineterminator="\n")
+    count = 0
+    emitted = False
+    for row in rows:
+        values = ["" if value is None else str(value) for value in row]
+        if not any(value.strip() for value in values):
+            continue
+        if header is None:
+            header = values
+            continue
+        if count == 0:
+            writer.writerow(header)
+        writer.writerow(values)
+        count += 1
+        if count >= SECTION_ROWS or block.tell() > SECTION_CHARS:
+            yield heading, block.getvalue()
+            block.seek(0)
+            block.truncate()
+            count = 0
+            emitted = True
+    if count:
+        yield heading, block.getvalue()
+    elif header is not None and not emitted:
+        # A sheet with only a header row still says something
+        writer.writerow(header)
+        yield heading, block.getvalue()
+
+
+def _csv(path: str) -> Iterator[Section]:
+    with _open_text(path) as f:
+        yield from _rows("", csv.reader(f))
+
+
+def _xlsx(path: str) -> Iterator[Section]:
+    from openpyxl import load_workbook
+
+    # read_only streams rows from the archive instead of building every cell
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            yield from _rows(sheet.title, sheet.iter_rows(values_only=True))
+    finally:
+        workbook.close()
+
+
+def _xls(path: str) -> Iterator[Section]:
+    import pandas as pd
+
+    # The legacy format caps a sheet at 65536 rows, so one sheet at a time is fine
+    with pd.ExcelFile(path) as workbook:
+        for name in workbook.sheet_names:
+            frame = workbook.parse(name, header=None, dtype=str).fillna("")
+            yield from _rows(name, frame.itertuples(index=False, name=None))
+
+
+def _pptx(path: str) -> Iterator[Section]:
+    try:
+        from pptx import Presentation
+    except ImportError:
+        raise UnsupportedFileType("pptx extraction requires python-pptx")
+
+    for number, slide in enumerate(Presentation(path).slides, start=1):
+        parts = [
+            shape.text_frame.text
+            for shape in slide.shapes
+            if shape.has_text_frame and shape.text_frame.text.strip()
+        ]
+        if parts:
+            yield f"Slide {number}", "\n".join(parts)
+
+
+# file type -> (section extractor, format recorded on the document)
+EXTRACTORS: Dict[str, Tuple[Callable[[str], Iterator[Section]], str]] = {
+    "txt": (_text, "txt"),
+    "md": (lambda path: _text(path, markdown=True), "md"),
+    "html": (_html, "html"),
+    "pdf": (_pdf, "txt"),
+    "docx": (_docx, "txt"),
+    "csv": (_csv, "txt"),
+    "xlsx": (_xlsx, "md"),
+    "xls": (_xls, "md"),
+    "pptx": (_pptx, "md"),
+}
+
+
+# Extractors that need a package outside requirements.txt (pandas reads
+# legacy .xls through xlrd)
+OPTIONAL_EXTRACTOR_MODULES = {"pptx": "pptx", "xls": "xlrd"}
+
+
+def supported_file_types() -> Set[str]:
+    """File types that can be extracted with the packages installed here"""
+    return {
+        file_type
+        for file_type in EXTRACTORS
+        if file_type not in OPTIONAL_EXTRACTOR_MODULES
+        or importlib.util.find_spec(OPTIONAL_EXTRACTOR_MODULES[file_type]) is not None
+    }
+
+
+def iter_sections(path: str, file_type: str) -> Tuple[Iterator[Section], str]:
+    """Return a lazy stream of an uploaded file's sections and its format"""
+    file_type = (file_type or "").lower()
+    if file_type not in EXTRACTORS:
+        raise UnsupportedFileType(f"Cannot extract text from .{file_type} files")
+    extractor, doc_format = EXTRACTORS[file_type]
+    return extractor(path), doc_format
+
+
+def spill_sections(sections: Iterable[Section], path: str) -> Iterator[Section]:
+    """Pass sections through while writing them to a gzipped JSON-lines file
+
+    The file lets the document be re-chunked later (for the lexical index or
+    deletes) exactly as it was indexed, without keeping its text in the DB.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for heading, body in sections:
+            f.write(json.dumps([heading, body], ensure_ascii=False) + "\n")
+            yield heading, body
+
+
+def read_spilled(path: str) -> Iterator[Section]:
+    """Stream the sections written by spill_sections"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            heading, body = json.loads(line)
+            yield heading, body
+
+
+def extract_to_file(path: str, file_type: str, content_path: str) -> str:
+    """Extract a file straight into a spill file and return its format
+
+    Top-level so it can run in the extraction process pool.
+    """
+    sections, doc_format = iter_sections(path, file_type)
+    for _ in spill_sections(sections, content_path):
+        pass
+    return doc_format
+
+
+def get_extraction_pool() -> ProcessPoolExecutor:
+    """Get the app-wide process pool for CPU-bound parsing (INGEST_EXTRACT_PROCESSES)"""
+    processes = int(current_app.config.get("INGEST_EXTRACT_PROCESSES", 0))
+    return get_app_service(
+        "extraction_pool",
+        lambda: ProcessPoolExecutor(
+            max_workers=processes or os.cpu_count(),
+            mp_context=multiprocessing.get_context("spawn"),
+        ),
+    )
@@ -0,0 +1,87 @@
+import os
+import time
+import sqlite3
+import logging
+from typing import Hashable
+
+from flask import current_app
+
+from .job_queue import DEFAULT_QUEUE_PATH
+from .model_registry import get_app_service
+
+logger = logging.getLogger(__name__)
+
+
+class IndexGenerations:
+    """Per-user change counters shared by the web and worker processes
+
+    Every process that changes a user's documents bumps that user's
+    generation once the change is committed. A process that holds state
+    loaded earlier (a local vector partition, cached search results)
+    compares the generation it last saw before using that state and
+    reloads it when another process has moved the counter on.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS index_generations (
+                    scope TEXT PRIMARY KEY,
+                    generation INTEGER NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """)
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection per call: the counters are used from several processes
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def get(self, scope: Hashable) -> int:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT generation FROM index_generations WHERE scope = ?",
+                (str(scope),),
+            ).fetchone()
+            return row[0] if row else 0
+        finally:
+            conn.close()
+
+    def bump(self, scope: Hashable) -> int:
+        """Record a committed change to ``scope`` and return its new generation"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                """
+                INSERT INTO index_generations (scope, generation, updated_at)
+                VALUES (?, 1, ?)
+                ON CONFLICT (scope) DO UPDATE SET
+                    generation = generation + 1, updated_at = excluded.updated_at
+                """,
+                (str(scope), time.time()),
+            )
+            (generation,) = conn.execute(
+                "SELECT generation FROM index_generations WHERE scope = ?",
+                (str(scope),),
+            ).fetchone()
+            conn.execute("COMMIT")
+            return generation
+        finally:
+            conn.close()
+
+
+def get_index_generations() -> IndexGenerations:
+    """Get the app-wide generation counters, kept next to the ingestion queue"""
+    return get_app_service(
+        "index_generations",
+        lambda: IndexGenerations(
+            current_app.config.get("INGEST_QUEUE_PATH") or DEFAULT_QUEUE_PATH
+        ),
+    )
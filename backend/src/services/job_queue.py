@@ -0,0 +1,447 @@
+import os
+import json
+import atexit
+import time
+import sqlite3
+import logging
+import threading
+import multiprocessing
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from flask import current_app
+
+from .model_registry import get_app_service
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "..", "..", "data", "jobs", "ingest.sqlite3"
+)
+
+JOB_STATUSES = ("queued", "running", "done", "failed")
+
+
+class QueueFullError(RuntimeError):
+    """Too many jobs are pending; callers should answer 503 and retry later"""
+
+
+class LeaseLostError(RuntimeError):
+    """The running job's lease ran out and the job may now be another worker's"""
+
+
+class JobQueue:
+    """Durable FIFO job queue in SQLite, shared by web and worker processes
+
+    Workers claim the oldest queued job under a lease of ``lease_timeout``
+    seconds and renew it with ``heartbeat`` while they make progress; a job
+    whose worker died or stalled is queued again once its lease runs out,
+    and only the worker holding the lease can complete or fail it. Failed jobs are retried until they have been tried
+    ``max_attempts`` times. ``enqueue`` refuses new work once
+    ``max_pending`` jobs are queued or running.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_pending: int = 100,
+        max_attempts: int = 3,
+        lease_timeout: float = 1800,
+    ):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.lease_timeout = lease_timeout
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    lease_expires REAL
+                )
+                """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection per call: the queue is used from several processes
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _job(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def enqueue(self, kind: str, payload: Dict[str, Any]) -> int:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            job_id = self._insert(conn, kind, payload)
+            conn.execute("COMMIT")
+            return job_id
+        finally:
+            conn.close()
+
+    def enqueue_files(
+        self, user_id: int, file_ids: List[int]
+    ) -> Tuple[Optional[int], Dict[int, int]]:
+        """Queue ingestion of uploaded files that no job is working on yet
+
+        Files already in a queued or running job are left to it; the rest go
+        into one new ``ingest_file`` or ``ingest_batch`` job. Returns the new
+        job's id (None if every file was covered) and the covering job of
+        each skipped file. The check and the insert share a transaction, so
+        concurrent uploads of the same file queue it once.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            active = self._active_for_files(conn, file_ids)
+            todo = [file_id for file_id in file_ids if file_id not in active]
+            job_id = None
+            if len(todo) == 1:
+                job_id = self._insert(
+                    conn, "ingest_file", {"file_id": todo[0], "user_id": user_id}
+                )
+            elif todo:
+                job_id = self._insert(
+                    conn, "ingest_batch", {"file_ids": todo, "user_id": user_id}
+                )
+            conn.execute("COMMIT")
+            return job_id, active
+        finally:
+            conn.close()
+
+    def _insert(self, conn: sqlite3.Connection, kind: str, payload: Dict[str, Any]):
+        # Runs inside the caller's BEGIN IMMEDIATE transaction
+        (pending,) = conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+        ).fetchone()
+        if pending >= self.max_pending:
+            conn.execute("ROLLBACK")
+            raise QueueFullError(f"Ingestion queue is full ({pending} jobs pending)")
+        cursor = conn.execute(
+            "INSERT INTO jobs (kind, payload, created_at) VALUES (?, ?, ?)",
+            (kind, json.dumps(payload), time.time()),
+        )
+        return cursor.lastrowid
+
+    @staticmethod
+    def _active_for_files(
+        conn: sqlite3.Connection, file_ids: List[int]
+    ) -> Dict[int, int]:
+        """Map each of ``file_ids`` that a queued or running job covers to that job"""
+        wanted = json.dumps(file_ids)
+        rows = conn.execute(
+            """
+            SELECT file.value, jobs.id
+            FROM jobs, json_each(jobs.payload, '$.file_ids') AS file
+            WHERE jobs.status IN ('queued', 'running')
+                AND file.value IN (SELECT value FROM json_each(?))
+            UNION ALL
+            SELECT json_extract(jobs.payload, '$.file_id'), jobs.id
+            FROM jobs
+            WHERE jobs.status IN ('queued', 'running')
+                AND json_extract(jobs.payload, '$.file_id')
+                    IN (SELECT value FROM json_each(?))
+            """,
+            (wanted, wanted),
+        )
+        return {file_id: job_id for file_id, job_id in rows}
+
+    def has_capacity(self) -> bool:
+        return self.pending() < self.max_pending
+
+    def pending(self) -> int:
+        conn = self._connect()
+        try:
+            (pending,) = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchone()
+            return pending
+        finally:
+            conn.close()
+
+    def claim(self, worker: str) -> Optional[Dict[str, Any]]:
+        """Lease the oldest queued job to ``worker``, or return None"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Jobs of crashed workers go back to the queue (or fail for good)
+            conn.execute(
+                """
+                UPDATE jobs SET
+                    status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,
+                    error = 'worker lease expired',
+                    finished_at = CASE WHEN attempts >= ? THEN ? ELSE NULL END
+                WHERE status = 'running' AND lease_expires < ?
+                """,
+                (self.max_attempts, self.max_attempts, now, now),
+            )
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                """
+                UPDATE jobs SET status = 'running', attempts = attempts + 1,
+                    worker = ?, started_at = ?, lease_expires = ?
+                WHERE id = ?
+                """,
+                (worker, now, now + self.lease_timeout, row["id"]),
+            )
+            job = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],))
+            job = self._job(job.fetchone())
+            conn.execute("COMMIT")
+            return job
+        finally:
+            conn.close()
+
+    def heartbeat(self, job_id: int, worker: str) -> bool:
+        """Extend ``worker``'s lease on a running job; False if it lost the job"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                """
+                UPDATE jobs SET lease_expires = ?
+                WHERE id = ? AND worker = ? AND status = 'running'
+                """,
+                (now + self.lease_timeout, job_id, worker),
+            )
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    def complete(self, job_id: int, worker: str, result: Any = None) -> bool:
+        """Record the job's result; False if ``worker`` no longer holds it"""
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                """
+                UPDATE jobs SET status = 'done', result = ?, error = NULL,
+                    finished_at = ?, lease_expires = NULL
+                WHERE id = ? AND worker = ? AND status = 'running'
+                """,
+                (json.dumps(result), time.time(), job_id, worker),
+            )
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    def fail(self, job_id: int, worker: str, error: str) -> bool:
+        """Record a failed attempt; the job is retried while attempts remain
+
+        Returns False, changing nothing, if ``worker`` no longer holds the job.
+        """
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                """
+                UPDATE jobs SET
+                    status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,
+                    error = ?,
+                    finished_at = CASE WHEN attempts >= ? THEN ? ELSE NULL END,
+                    lease_expires = NULL
+                WHERE id = ? AND worker = ? AND status = 'running'
+                """,
+                (
+                    self.max_attempts,
+                    error,
+                    self.max_attempts,
+                    time.time(),
+                    job_id,
+                    worker,
+                ),
+            )
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return self._job(row) if row else None
+        finally:
+            conn.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        conn = self._connect()
+        try:
+            counts = dict(
+                conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+            )
+        finally:
+            conn.close()
+        return {
+            **{status: counts.get(status, 0) for status in JOB_STATUSES},
+            "max_pending": self.max_pending,
+        }
+
+
+# The job the current worker thread is running, for heartbeat()
+_current_job = threading.local()
+
+
+def heartbeat():
+    """Renew the lease of the job this worker thread is running
+
+    Long handlers call this as they make progress (the RAG service does
+    after every embedding window); renewals are spaced a tenth of the lease
+    apart. Does nothing outside a worker. Raises LeaseLostError once the job
+    has been handed back to the queue, so the handler stops duplicating
+    work another worker has taken over.
+    """
+    lease = getattr(_current_job, "lease", None)
+    if lease is None:
+        return
+    queue, job_id, worker, renewed_at = lease
+    now = time.time()
+    if now - renewed_at < heartbeat_interval():
+        return
+    if not queue.heartbeat(job_id, worker):
+        _current_job.lease = None
+        raise LeaseLostError(f"Lease on job {job_id} expired")
+    _current_job.lease = (queue, job_id, worker, now)
+
+
+def heartbeat_interval() -> Optional[float]:
+    """Seconds between lease renewals of the running job; None outside a worker
+
+    Handlers that block (waiting on extraction processes, say) wake up this
+    often to call heartbeat().
+    """
+    lease = getattr(_current_job, "lease", None)
+    return None if lease is None else lease[0].lease_timeout / 10
+
+
+def _ingest_file(app, payload: Dict[str, Any]) -> Dict[str, Any]:
+    if app.rag_service is None:
+        raise RuntimeError("RAG service is not available")
+    if not app.rag_service.process_uploaded_file(
+        payload["file_id"], payload["user_id"]
+    ):
+        raise RuntimeError("File processing failed")
+    return {"file_id": payload["file_id"]}
+
+
+def _ingest_batch(app, payload: Dict[str, Any]) -> Dict[str, Any]:
+    if app.rag_service is None:
+        raise RuntimeError("RAG service is not available")
+    result = app.rag_service.process_uploaded_files(
+        payload["file_ids"], payload["user_id"]
+    )
+    # Partial success completes the job; the failures are in its result
+    if not result["processed"]:
+        raise RuntimeError("No file in the batch could be processed")
+    return result
+
+
+# Job kind -> handler(app, payload) run inside a worker's app context
+JOB_HANDLERS: Dict[str, Callable[[Any, Dict[str, Any]], Any]] = {
+    "ingest_file": _ingest_file,
+    "ingest_batch": _ingest_batch,
+}
+
+
+def run_worker(config_object, worker: str, stop: threading.Event = None):
+    """Worker loop: build the app, then claim and run jobs until ``stop`` is set"""
+    from ..main import create_app
+    from ..models import db
+
+    app = create_app(config_object)
+    with app.app_context():
+        queue = get_job_queue()
+        poll_interval = float(app.config.get("INGEST_POLL_INTERVAL", 1.0))
+        logger.info(f"Ingestion worker {worker} started")
+        while stop is None or not stop.is_set():
+            job = queue.claim(worker)
+            if job is None:
+                time.sleep(poll_interval)
+                continue
+            _current_job.lease = (queue, job["id"], worker, time.time())
+            try:
+                result = JOB_HANDLERS[job["kind"]](app, job["payload"])
+                recorded = queue.complete(job["id"], worker, result)
+            except Exception as e:
+                logger.error(f"Job {job['id']} ({job['kind']}) failed: {e}")
+                db.session.rollback()
+                recorded = queue.fail(job["id"], worker, str(e))
+            finally:
+                _current_job.lease = None
+                db.session.remove()
+            if not recorded:
+                logger.warning(
+                    f"Job {job['id']} lease expired before {worker} finished it"
+                )
+
+
+def _stop_workers(processes):
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join(timeout=5)
+
+
+def start_workers(config_object, count: int):
+    """Start ``count`` worker processes; they are stopped when the parent exits"""
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    for number in range(count):
+        # Not daemonic: workers run their own extraction process pool, and
+        # daemonic processes may not have children
+        process = context.Process(
+            target=run_worker,
+            args=(config_object, f"{os.getpid()}-{number}"),
+            name=f"ingest-worker-{number}",
+        )
+        process.start()
+        processes.append(process)
+    atexit.register(_stop_workers, processes)
+    return processes
+
+
+def get_job_queue() -> JobQueue:
+    """Get the app-wide ingestion queue"""
+    config = current_app.config
+    return get_app_service(
+        "job_queue",
+        lambda: JobQueue(
+            config.get("INGEST_QUEUE_PATH") or DEFAULT_QUEUE_PATH,
+            max_pending=int(config.get("INGEST_MAX_PENDING", 100)),
+            max_attempts=int(config.get("INGEST_MAX_ATTEMPTS", 3)),
+            lease_timeout=float(config.get("INGEST_JOB_TIMEOUT", 1800)),
+        ),
+    )
+
+
+def ensure_workers():
+    """Start the embedded worker pool (INGEST_WORKERS) on first use in this process"""
+    app = current_app._get_current_object()
+    count = int(app.config.get("INGEST_WORKERS", 0))
+    if count <= 0:
+        return None
+    return get_app_service(
+        "ingest_workers", lambda: start_workers(app.config["CONFIG_OBJECT"], count)
+    )
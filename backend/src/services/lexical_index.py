@@ -0,0 +1,397 @@
+import os
+import re
+import math
+import sqlite3
+import logging
+import threading
+from collections import Counter
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEXICAL_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "..", "..", "data", "lexical"
+)
+
+# Values accepted for the ``mode`` of RAG search calls
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+
+# Chunks written per DiskBM25Index write transaction
+LEXICAL_WRITE_BATCH = 256
+
+# Codes such as "SKU-12345" or "v2.1" are kept whole and also split into parts
+_CODE_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_THAI_RE = re.compile(r"[\u0e00-\u0e7f]+")
+
+_thai_tokenizer = None
+
+
+def _load_thai_tokenizer():
+    """Dictionary-based Thai word segmentation if pythainlp is installed"""
+    global _thai_tokenizer
+    if _thai_tokenizer is None:
+        try:
+            from pythainlp.tokenize import word_tokenize
+
+            _thai_tokenizer = lambda text: word_tokenize(text, keep_whitespace=False)
+        except ImportError:
+            logger.info("pythainlp not installed, using Thai character bigrams")
+            _thai_tokenizer = False
+    return _thai_tokenizer
+
+
+def _thai_terms(run: str) -> List[str]:
+    segment = _load_thai_tokenizer()
+    if segment:
+        return [word for word in segment(run) if word.strip()]
+    # Thai has no spaces; overlapping bigrams match words without a dictionary
+    if len(run) < 2:
+        return [run]
+    return [run[i : i + 2] for i in range(len(run) - 1)]
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased lexical terms for mixed Thai/English text"""
+    text = (text or "").lower()
+    terms = []
+    for match in _CODE_RE.finditer(text):
+        term = match.group()
+        terms.append(term)
+        parts = re.split(r"[-_./]", term)
+        if len(parts) > 1:
+            terms.extend(part for part in parts if part)
+    for match in _THAI_RE.finditer(text):
+        terms.extend(_thai_terms(match.group()))
+    return terms
+
+
+class BM25Index:
+    """In-memory inverted index with Okapi BM25 scoring
+
+    Documents can be added and removed one at a time, so the index is kept in
+    step with the vector store instead of being rebuilt.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[Hashable, int]] = {}
+        self._doc_terms: Dict[Hashable, Counter] = {}
+        self._doc_lengths: Dict[Hashable, int] = {}
+        self._payloads: Dict[Hashable, Any] = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def __contains__(self, doc_id: Hashable) -> bool:
+        return doc_id in self._doc_terms
+
+    def add(self, doc_id: Hashable, text: str, payload: Any = None):
+        """Index (or re-index) one document"""
+        terms = Counter(tokenize(text))
+        with self._lock:
+            self.remove(doc_id)
+            self._doc_terms[doc_id] = terms
+            self._doc_lengths[doc_id] = sum(terms.values())
+            self._total_length += self._doc_lengths[doc_id]
+            for term, count in terms.items():
+                self._postings.setdefault(term, {})[doc_id] = count
+            if payload is not None:
+                self._payloads[doc_id] = payload
+
+    def add_many(self, docs: Iterable[Tuple[Hashable, str, Any]]):
+        for doc_id, text, payload in docs:
+            self.add(doc_id, text, payload)
+
+    def remove(self, doc_id: Hashable):
+        with self._lock:
+            terms = self._doc_terms.pop(doc_id, None)
+            if terms is None:
+                return
+            self._total_length -= self._doc_lengths.pop(doc_id)
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is not None:
+                    postings.pop(doc_id, None)
+                    if not postings:
+                        del self._postings[term]
+            self._payloads.pop(doc_id, None)
+
+    def payload(self, doc_id: Hashable) -> Any:
+        return self._payloads.get(doc_id)
+
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[Hashable, float]]:
+        """Return (doc_id, score) pairs for the best-matching documents"""
+        terms = set(tokenize(query))
+        scores: Dict[Hashable, float] = {}
+        with self._lock:
+            count = len(self._doc_terms)
+            if not count or not terms:
+                return []
+            avg_length = self._total_length / count
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(
+                    1 + (count - len(postings) + 0.5) / (len(postings) + 0.5)
+                )
+                for doc_id, tf in postings.items():
+                    length = self._doc_lengths[doc_id]
+                    norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (
+                        self.k1 + 1
+                    ) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+
+class DiskBM25Index:
+    """BM25 over (doc id, chunk index) keys with its postings in SQLite
+
+    Chunks are added as documents are ingested, by whichever process ingests
+    them, so searches never rebuild the index and only the postings of the
+    query's terms are read. Each chunk keeps its text as the payload shown
+    for lexical-only hits. ``ready`` is set once documents ingested before
+    the index existed have been backfilled.
+
+    Construct one instance per file and keep it: only a file without the
+    schema is written to on open. Reads never take the write lock, and
+    writes tokenize outside their transactions and commit every
+    LEXICAL_WRITE_BATCH chunks, so searches do not wait behind ingestion.
+    """
+
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        conn = self._connect()
+        try:
+            if conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'meta'"
+            ).fetchone():
+                return
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS chunks (
+                    doc_id INTEGER NOT NULL,
+                    chunk INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    payload TEXT,
+                    PRIMARY KEY (doc_id, chunk)
+                );
+                CREATE TABLE IF NOT EXISTS postings (
+                    term TEXT NOT NULL,
+                    doc_id INTEGER NOT NULL,
+                    chunk INTEGER NOT NULL,
+                    tf INTEGER NOT NULL,
+                    PRIMARY KEY (term, doc_id, chunk)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id);
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+                INSERT OR IGNORE INTO meta VALUES
+                    ('chunks', 0), ('total_length', 0), ('ready', 0);
+                """)
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection per call: web and worker processes share the file
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    # Legacy single-vector rows have chunk index None, stored as -1
+    @staticmethod
+    def _chunk(chunk_index) -> int:
+        return -1 if chunk_index is None else chunk_index
+
+    @staticmethod
+    def _key(doc_id: int, chunk: int) -> Tuple[int, Any]:
+        return doc_id, None if chunk < 0 else chunk
+
+    @staticmethod
+    def _meta(conn: sqlite3.Connection) -> Dict[str, int]:
+        return dict(conn.execute("SELECT key, value FROM meta"))
+
+    @staticmethod
+    def _delete_docs(conn: sqlite3.Connection, doc_ids: List[int]):
+        for doc_id in doc_ids:
+            count, length = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks "
+                "WHERE doc_id = ?",
+                (doc_id,),
+            ).fetchone()
+            if not count:
+                continue
+            conn.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+            conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+            conn.execute(
+                "UPDATE meta SET value = value - CASE key "
+                "WHEN 'chunks' THEN ? WHEN 'total_length' THEN ? ELSE 0 END",
+                (count, length),
+            )
+
+    def add_chunks(self, doc_id: int, chunks: Iterable[Tuple[Any, str]]):
+        """Index (or re-index) (chunk index, text) pairs of one document"""
+        batch = []
+        for chunk_index, text in chunks:
+            batch.append((self._chunk(chunk_index), text, Counter(tokenize(text))))
+            if len(batch) >= LEXICAL_WRITE_BATCH:
+                self._write_chunks(doc_id, batch)
+                batch = []
+        if batch:
+            self._write_chunks(doc_id, batch)
+
+    def _write_chunks(self, doc_id: int, batch: List[Tuple[int, str, Counter]]):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            count = length = 0
+            for chunk, text, terms in batch:
+                old = conn.execute(
+                    "SELECT length FROM chunks WHERE doc_id = ? AND chunk = ?",
+                    (doc_id, chunk),
+                ).fetchone()
+                if old is not None:
+                    conn.execute(
+                        "DELETE FROM postings WHERE doc_id = ? AND chunk = ?",
+                        (doc_id, chunk),
+                    )
+                    count -= 1
+                    length -= old[0]
+                chunk_length = sum(terms.values())
+                conn.execute(
+                    "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)",
+                    (doc_id, chunk, chunk_length, text),
+                )
+                conn.executemany(
+                    "INSERT INTO postings VALUES (?, ?, ?, ?)",
+                    ((term, doc_id, chunk, tf) for term, tf in terms.items()),
+                )
+                count += 1
+                length += chunk_length
+            conn.execute(
+                "UPDATE meta SET value = value + CASE key "
+                "WHEN 'chunks' THEN ? WHEN 'total_length' THEN ? ELSE 0 END",
+                (count, length),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def remove_documents(self, doc_ids: Iterable[int]):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            self._delete_docs(conn, list(doc_ids))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def document_ids(self) -> List[int]:
+        conn = self._connect()
+        try:
+            return [
+                doc_id
+                for (doc_id,) in conn.execute("SELECT DISTINCT doc_id FROM chunks")
+            ]
+        finally:
+            conn.close()
+
+    @property
+    def ready(self) -> bool:
+        conn = self._connect()
+        try:
+            return bool(self._meta(conn)["ready"])
+        finally:
+            conn.close()
+
+    def mark_ready(self):
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE meta SET value = 1 WHERE key = 'ready'")
+        finally:
+            conn.close()
+
+    def __len__(self) -> int:
+        conn = self._connect()
+        try:
+            return self._meta(conn)["chunks"]
+        finally:
+            conn.close()
+
+    def payloads(self, keys: Iterable[Tuple[int, Any]]) -> Dict[Tuple[int, Any], str]:
+        conn = self._connect()
+        try:
+            found = {}
+            for doc_id, chunk_index in keys:
+                row = conn.execute(
+                    "SELECT payload FROM chunks WHERE doc_id = ? AND chunk = ?",
+                    (doc_id, self._chunk(chunk_index)),
+                ).fetchone()
+                if row is not None:
+                    found[(doc_id, chunk_index)] = row[0]
+            return found
+        finally:
+            conn.close()
+
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[Hashable, float]]:
+        """Return ((doc id, chunk index), score) pairs for the best matches"""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        scores: Dict[Tuple[int, int], float] = {}
+        conn = self._connect()
+        try:
+            # One read transaction, so the statistics match the postings
+            conn.execute("BEGIN")
+            meta = self._meta(conn)
+            count = meta["chunks"]
+            if count <= 0:
+                return []
+            avg_length = meta["total_length"] / count
+            for term in terms:
+                postings = conn.execute(
+                    "SELECT p.doc_id, p.chunk, p.tf, c.length FROM postings p "
+                    "JOIN chunks c ON c.doc_id = p.doc_id AND c.chunk = p.chunk "
+                    "WHERE p.term = ?",
+                    (term,),
+                ).fetchall()
+                if not postings:
+                    continue
+                idf = math.log(
+                    1 + (count - len(postings) + 0.5) / (len(postings) + 0.5)
+                )
+                for doc_id, chunk, tf, length in postings:
+                    norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                    key = (doc_id, chunk)
+                    scores[key] = scores.get(key, 0.0) + idf * tf * (self.k1 + 1) / (
+                        tf + norm
+                    )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return [(self._key(*key), score) for key, score in ranked[:top_k]]
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[Hashable]], k: int = 60, weights: Optional[List[float]] = None
+) -> List[Tuple[Hashable, float]]:
+    """Fuse ranked id lists: score(d) = sum(weight / (k + rank of d))"""
+    weights = weights or [1.0] * len(rankings)
+    scores: Dict[Hashable, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,273 @@
+import time
+import random
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from contextlib import contextmanager
+from typing import Any, Callable, Dict
+
+from flask import current_app
+
+from .model_registry import get_app_service
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamUnavailableError(RuntimeError):
+    """An upstream call was refused or abandoned; callers should answer 503"""
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    pass
+
+
+class UpstreamBusyError(UpstreamUnavailableError):
+    pass
+
+
+class UpstreamTimeoutError(UpstreamUnavailableError):
+    pass
+
+
+class CircuitBreaker:
+    """Stop calling a provider after repeated failures, then probe it again
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    calls fail fast for ``reset_timeout`` seconds; then one trial call is let
+    through and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if (
+                self.state == "open"
+                and time.monotonic() - self.opened_at >= self.reset_timeout
+            ):
+                self.state = "half_open"
+                return True
+            return False
+
+    def abandon_trial(self):
+        """Hand back a trial call that ended without an outcome
+
+        The circuit goes back to open with its old ``opened_at``, so the
+        next call is let through as the trial instead.
+        """
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+class LLMClient:
+    """Shared gateway for outbound model and vector-store calls
+
+    Calls run on a bounded thread pool. Each provider ("gemini",
+    "huggingface", "pinecone", ...) has its own concurrency limit and
+    circuit breaker, and failed calls are retried with exponential backoff
+    and jitter. A request thread waits at most ``timeout`` seconds for a
+    result and at most ``queue_timeout`` seconds for a provider slot, so a
+    slow upstream turns into fast 503s instead of exhausting WSGI workers.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 16,
+        provider_limits: Dict[str, int] = None,
+        default_limit: int = 4,
+        timeout: float = 30,
+        queue_timeout: float = 2,
+        max_retries: int = 2,
+        retry_backoff: float = 0.5,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+    ):
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.default_limit = default_limit
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._provider_limits = dict(provider_limits or {})
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="llm-client"
+        )
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _provider(self, provider: str):
+        with self._lock:
+            if provider not in self._semaphores:
+                limit = self._provider_limits.get(provider, self.default_limit)
+                self._semaphores[provider] = threading.BoundedSemaphore(limit)
+                self._breakers[provider] = CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout
+                )
+                self._stats[provider] = {
+                    "calls": 0,
+                    "failures": 0,
+                    "retries": 0,
+                    "rejected": 0,
+                    "timeouts": 0,
+                }
+            return self._semaphores[provider], self._breakers[provider]
+
+    def _count(self, provider: str, name: str):
+        with self._lock:
+            self._stats[provider][name] += 1
+
+    def _acquire(self, provider: str, block: bool):
+        """Take a provider slot and check the breaker, or raise
+
+        The slot comes first: a half-open breaker lets exactly one trial
+        through, and that trial must not then be lost waiting for a slot.
+        """
+        semaphore, breaker = self._provider(provider)
+        if not semaphore.acquire(timeout=None if block else self.queue_timeout):
+            self._count(provider, "rejected")
+            raise UpstreamBusyError(f"{provider} is at its concurrency limit")
+        if not breaker.allow():
+            semaphore.release()
+            self._count(provider, "rejected")
+            raise CircuitOpenError(f"{provider} circuit is open")
+        return semaphore, breaker
+
+    @contextmanager
+    def slot(self, provider: str, block: bool = False):
+        """Hold a provider slot around a call made on the current thread (streaming)"""
+        semaphore, breaker = self._acquire(provider, block)
+        self._count(provider, "calls")
+        try:
+            yield
+        except Exception:
+            breaker.record_failure()
+            self._count(provider, "failures")
+            raise
+        except BaseException:
+            # GeneratorExit when a streaming client disconnects: no verdict
+            # on the provider, but a trial call must not stay pending
+            breaker.abandon_trial()
+            raise
+        else:
+            breaker.record_success()
+        finally:
+            semaphore.release()
+
+    def _run(self, provider, semaphore, breaker, func, args, kwargs):
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    result = func(*args, **kwargs)
+                    breaker.record_success()
+                    return result
+                except Exception as e:
+                    breaker.record_failure()
+                    self._count(provider, "failures")
+                    if attempt == self.max_retries or not breaker.allow():
+                        raise
+                    self._count(provider, "retries")
+                    delay = self.retry_backoff * (2**attempt) * (1 + random.random())
+                    logger.warning(
+                        f"{provider} call failed ({e}), retrying in {delay:.2f}s"
+                    )
+                    time.sleep(delay)
+        finally:
+            semaphore.release()
+
+    def submit(
+        self, provider: str, func: Callable, *args, block: bool = False, **kwargs
+    ) -> Future:
+        """Schedule a call on the pool once a provider slot is free
+
+        The slot is taken on the calling thread, so bulk producers pass
+        ``block=True`` and are slowed down to the provider's pace instead of
+        piling up blocked pool threads; request paths give up after
+        ``queue_timeout``.
+        """
+        semaphore, breaker = self._acquire(provider, block)
+        self._count(provider, "calls")
+        try:
+            return self._executor.submit(
+                self._run, provider, semaphore, breaker, func, args, kwargs
+            )
+        except Exception:
+            breaker.abandon_trial()
+            semaphore.release()
+            raise
+
+    def call(self, provider: str, func: Callable, *args, timeout=None, **kwargs) -> Any:
+        """Run a call through the pool and wait for its result"""
+        future = self.submit(provider, func, *args, **kwargs)
+        return self.result(provider, future, timeout)
+
+    def result(self, provider: str, future: Future, timeout=None) -> Any:
+        """Wait for a submitted call, giving up after ``timeout`` seconds"""
+        try:
+            return future.result(timeout=timeout or self.timeout)
+        except TimeoutError:
+            # The worker keeps its slot until the upstream call returns
+            self._count(provider, "timeouts")
+            self._provider(provider)[1].record_failure()
+            raise UpstreamTimeoutError(
+                f"{provider} did not respond within {timeout or self.timeout}s"
+            )
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                provider: {**stats, "circuit": self._breakers[provider].state}
+                for provider, stats in self._stats.items()
+            }
+
+
+def _parse_limits(value: str) -> Dict[str, int]:
+    """Parse "gemini=8,pinecone=16" into a dict"""
+    limits = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            provider, limit = item.split("=", 1)
+            limits[provider.strip()] = int(limit)
+    return limits
+
+
+def get_llm_client() -> LLMClient:
+    """Get the app-wide LLMClient"""
+    config = current_app.config
+    return get_app_service(
+        "llm_client",
+        lambda: LLMClient(
+            max_workers=int(config.get("LLM_MAX_WORKERS", 16)),
+            provider_limits=_parse_limits(config.get("LLM_PROVIDER_CONCURRENCY")),
+            default_limit=int(config.get("LLM_DEFAULT_CONCURRENCY", 4)),
+            timeout=float(config.get("LLM_TIMEOUT", 30)),
+            queue_timeout=float(config.get("LLM_QUEUE_TIMEOUT", 2)),
+            max_retries=int(config.get("LLM_MAX_RETRIES", 2)),
+            retry_backoff=float(config.get("LLM_RETRY_BACKOFF", 0.5)),
+            failure_threshold=int(config.get("LLM_BREAKER_THRESHOLD", 5)),
+            reset_timeout=float(config.get("LLM_BREAKER_RESET", 30)),
+        ),
+    )
@@ -0,0 +1,107 @@
+import time
+import threading
+import logging
+from typing import Any, Callable, Hashable, List
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# Process-wide objects that are expensive to build (transformer weights,
+# tokenizers). They are shared by every app, service instance and thread.
+_registry = {}
+_registry_lock = threading.Lock()
+_key_locks = {}
+# key -> (consecutive failed loads, monotonic time of the next attempt)
+_failures = {}
+LOAD_RETRY_BASE = 5
+LOAD_RETRY_MAX = 300
+_app_services_lock = threading.RLock()
+
+
+def get_or_create(key: Hashable, factory: Callable[[], Any]) -> Any:
+    """Return the shared object for ``key``, building it once on first use
+
+    Loaders return None when they fail. That is not cached: the load is
+    tried again on a later call, backing off exponentially up to
+    LOAD_RETRY_MAX seconds, so a transient error does not last until restart.
+    """
+    try:
+        return _registry[key]
+    except KeyError:
+        pass
+
+    with _registry_lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+
+    # Per-key lock so a slow load does not block unrelated lookups
+    with key_lock:
+        if key in _registry:
+            return _registry[key]
+        failures, retry_at = _failures.get(key, (0, 0.0))
+        if time.monotonic() < retry_at:
+            return None
+        value = factory()
+        if value is None:
+            delay = min(LOAD_RETRY_BASE * 2**failures, LOAD_RETRY_MAX)
+            _failures[key] = (failures + 1, time.monotonic() + delay)
+            logger.warning(f"Loading {key} failed; retrying in {delay}s")
+            return None
+        _failures.pop(key, None)
+        _registry[key] = value
+        return value
+
+
+def get_tokenizer(model_name: str):
+    """Return the shared tokenizer for a Hugging Face model"""
+
+    def load():
+        from transformers import AutoTokenizer
+
+        try:
+            return AutoTokenizer.from_pretrained(model_name)
+        except Exception as e:
+            logger.error(f"Error loading Hugging Face tokenizer: {e}")
+            return None
+
+    return get_or_create(("hf_tokenizer", model_name), load)
+
+
+def get_embedding_model(model_name: str):
+    """Return the shared (tokenizer, model) pair for a Hugging Face model"""
+
+    def load():
+        from transformers import AutoModel
+
+        try:
+            model = AutoModel.from_pretrained(model_name)
+            model.eval()
+            logger.info(f"Loaded embedding model {model_name}")
+            return model
+        except Exception as e:
+            logger.error(f"Error loading Hugging Face model: {e}")
+            return None
+
+    return get_tokenizer(model_name), get_or_create(("hf_model", model_name), load)
+
+
+def get_app_service(name: str, factory: Callable[[], Any]) -> Any:
+    """Return a service cached on the current app, creating it once under a lock"""
+    extensions = current_app.extensions
+    if name not in extensions:
+        with _app_services_lock:
+            if name not in extensions:
+                extensions[name] = factory()
+    return extensions[name]
+
+
+def warm_up(app, loaders: List[Callable[[], Any]]):
+    """Run model loaders in a background thread so the first request does not pay for it"""
+
+    def run():
+        with app.app_context():
+            for loader in loaders:
+                loader()
+
+    thread = threading.Thread(target=run, name="model-warmup", daemon=True)
+    thread.start()
+    return thread
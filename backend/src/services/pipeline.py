@@ -0,0 +1,59 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import Dict
+
+from flask import current_app
+
+from .model_registry import get_app_service
+
+
+class StageTimer:
+    """Wall-clock milliseconds per named stage of one request
+
+    Stages may run on several threads at once; overlapping stages each record
+    their own duration, so their sum can exceed the request's total time.
+    """
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+    def summary(self) -> Dict[str, float]:
+        """Stage timings plus the total, rounded to 0.1 ms"""
+        with self._lock:
+            timings = dict(self.timings)
+        timings["total"] = (time.perf_counter() - self._started) * 1000
+        return {name: round(ms, 1) for name, ms in timings.items()}
+
+    def server_timing(self) -> str:
+        """Value for the ``Server-Timing`` response header"""
+        return ", ".join(f"{name};dur={ms}" for name, ms in self.summary().items())
+
+
+def stage(timer: StageTimer, name: str):
+    """``timer.stage(name)``, or a no-op when no timer is being recorded"""
+    return timer.stage(name) if timer else nullcontext()
+
+
+def get_pipeline_executor() -> ThreadPoolExecutor:
+    """Shared pool for running independent steps of one request side by side"""
+    return get_app_service(
+        "pipeline_executor",
+        lambda: ThreadPoolExecutor(
+            max_workers=int(current_app.config.get("RAG_PIPELINE_WORKERS", 8)),
+            thread_name_prefix="rag-pipeline",
+        ),
+    )
@@ -0,0 +1,80 @@
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+def normalize_query(query: str) -> str:
+    """Case-, whitespace- and Unicode-normalized form used in cache keys"""
+    query = unicodedata.normalize("NFC", query or "")
+    return " ".join(query.lower().split())
+
+
+class QueryResultCache:
+    """TTL + LRU cache of search results with per-scope invalidation
+
+    Each scope (usually a user id) has a version number that is part of every
+    key; bumping it when that scope's documents change makes all of its old
+    entries unreachable without scanning the cache.
+    """
+
+    def __init__(self, max_items: int = 1024, ttl: float = 300):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+        self._versions: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "invalidations": 0}
+
+    def key(self, scope: Hashable, query: str, *params) -> Tuple:
+        with self._lock:
+            version = self._versions.get(scope, 0)
+        return (scope, version, normalize_query(query)) + tuple(params)
+
+    def get(self, key: Tuple) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def put(self, key: Tuple, value: Any):
+        with self._lock:
+            # A result computed before an invalidation must not be stored
+            if key[1] != self._versions.get(key[0], 0):
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, scope: Hashable):
+        """Drop every cached result for a scope"""
+        with self._lock:
+            self._versions[scope] = self._versions.get(scope, 0) + 1
+            self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions = {
+                scope: version + 1 for scope, version in self._versions.items()
+            }
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["items"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,198 @@
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from flask import current_app
+
+from .model_registry import get_app_service, get_or_create, get_tokenizer
+from .query_cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+
+def get_cross_encoder(model_name: str):
+    """Return the shared (tokenizer, model) pair for a sequence-classification model"""
+
+    def load():
+        from transformers import AutoModelForSequenceClassification
+
+        try:
+            model = AutoModelForSequenceClassification.from_pretrained(model_name)
+            model.eval()
+            logger.info(f"Loaded cross-encoder {model_name}")
+            return model
+        except Exception as e:
+            logger.error(f"Error loading cross-encoder: {e}")
+            return None
+
+    return get_tokenizer(model_name), get_or_create(
+        ("hf_cross_encoder", model_name), load
+    )
+
+
+class CrossEncoderReranker:
+    """Re-score retrieved chunks against the query with a CPU cross-encoder
+
+    Pairs are scored in batches and each score is cached under a hash of the
+    normalized query and the chunk text, so repeated questions over the same
+    documents are free. Scoring stops once ``budget_ms`` has passed; the
+    caller then gets the candidates back in their original (vector) order.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        batch_size: int = 16,
+        budget_ms: float = 300,
+        max_length: int = 512,
+        cache_items: int = 4096,
+    ):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.budget_ms = budget_ms
+        self.max_length = max_length
+        self.cache_items = cache_items
+        self._scores: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Fast tokenizers are not safe to call from several threads at once
+        self._tokenizer_lock = threading.Lock()
+        self._stats = {
+            "calls": 0,
+            "scored_pairs": 0,
+            "cache_hits": 0,
+            "fallbacks": 0,
+        }
+
+    def load(self) -> bool:
+        """Load the model (also used for warm-up); False if it is unavailable"""
+        tokenizer, model = get_cross_encoder(self.model_name)
+        return tokenizer is not None and model is not None
+
+    @staticmethod
+    def _pair_key(query: str, text: str) -> str:
+        pair = f"{normalize_query(query)}\x00{text}".encode("utf-8")
+        return hashlib.sha1(pair).hexdigest()
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _score_batch(self, query: str, texts: List[str]) -> List[float]:
+        import torch
+
+        tokenizer, model = get_cross_encoder(self.model_name)
+        with self._tokenizer_lock:
+            inputs = tokenizer(
+                [query] * len(texts),
+                texts,
+                return_tensors="pt",
+                truncation=True,
+                padding=True,
+                max_length=self.max_length,
+            )
+        with torch.no_grad():
+            logits = model(**inputs).logits
+        # Single-logit models give the relevance directly; otherwise use the
+        # "relevant" (last) class
+        return logits[:, -1].tolist()
+
+    def _fallback(self, candidates, top_k, reason):
+        self._count("fallbacks")
+        logger.info(f"Re-ranking skipped ({reason}); keeping retrieval order")
+        return candidates[:top_k], False
+
+    def rerank(
+        self,
+        query: str,
+        candidates: List[Dict[str, Any]],
+        top_k: int,
+        text_key: str = "text",
+    ) -> Tuple[List[Dict[str, Any]], bool]:
+        """Return the ``top_k`` candidates by cross-encoder score, and whether
+        they were re-ranked
+
+        Each returned candidate gets a ``rerank_score``. If the model is not
+        available, scoring fails or the latency budget runs out, the first
+        ``top_k`` candidates are returned unchanged with False, so callers
+        do not cache them as re-ranked results.
+        """
+        self._count("calls")
+        if len(candidates) <= 1:
+            return candidates[:top_k], True
+        if not self.load():
+            return self._fallback(candidates, top_k, "model unavailable")
+
+        # The clock starts after loading so a cold start does not count
+        deadline = time.perf_counter() + self.budget_ms / 1000
+        keys = [self._pair_key(query, c.get(text_key) or "") for c in candidates]
+        scores: Dict[str, float] = {}
+        with self._lock:
+            for key in keys:
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    scores[key] = self._scores[key]
+            self._stats["cache_hits"] += len(scores)
+
+        pending = {}
+        for key, candidate in zip(keys, candidates):
+            if key not in scores:
+                pending.setdefault(key, candidate.get(text_key) or "")
+        pending = list(pending.items())
+
+        try:
+            for start in range(0, len(pending), self.batch_size):
+                if time.perf_counter() >= deadline:
+                    return self._fallback(candidates, top_k, "latency budget spent")
+                batch = pending[start : start + self.batch_size]
+                batch_scores = self._score_batch(query, [text for _, text in batch])
+                self._count("scored_pairs", len(batch))
+                with self._lock:
+                    for (key, _), score in zip(batch, batch_scores):
+                        scores[key] = score
+                        self._scores[key] = score
+                        self._scores.move_to_end(key)
+                    while len(self._scores) > self.cache_items:
+                        self._scores.popitem(last=False)
+        except Exception as e:
+            logger.error(f"Error re-ranking candidates: {e}")
+            return self._fallback(candidates, top_k, "scoring failed")
+
+        # sorted() is stable, so ties keep their retrieval order
+        ranked = sorted(
+            zip(keys, candidates), key=lambda item: scores[item[0]], reverse=True
+        )
+        results = []
+        for key, candidate in ranked[:top_k]:
+            candidate["rerank_score"] = scores[key]
+            results.append(candidate)
+        return results, True
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._stats,
+                "model": self.model_name,
+                "cached_scores": len(self._scores),
+                "budget_ms": self.budget_ms,
+            }
+
+
+def get_reranker() -> Optional[CrossEncoderReranker]:
+    """Get the app-wide reranker, or None when RAG_RERANK_ENABLED is off"""
+    config = current_app.config
+    if not config.get("RAG_RERANK_ENABLED", False):
+        return None
+    return get_app_service(
+        "reranker",
+        lambda: CrossEncoderReranker(
+            config.get(
+                "RAG_RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+            ),
+            batch_size=int(config.get("RAG_RERANK_BATCH_SIZE", 16)),
+            budget_ms=float(config.get("RAG_RERANK_BUDGET_MS", 300)),
+            cache_items=int(config.get("RAG_RERANK_CACHE_SIZE", 4096)),
+        ),
+    )
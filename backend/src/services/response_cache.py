@@ -0,0 +1,94 @@
+import time
+import hashlib
+import threading
+import itertools
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+def context_fingerprint(context: Optional[str]) -> str:
+    """Stable digest of the retrieved context an answer was generated from"""
+    return hashlib.sha256((context or "").encode("utf-8")).hexdigest()
+
+
+class SemanticResponseCache:
+    """Reuse LLM answers for near-duplicate questions
+
+    Entries are scoped by (user, context fingerprint) so an answer is only
+    reused for the same user and the same retrieved context. Within a scope
+    the stored question embedding with the highest cosine similarity wins if
+    it clears ``threshold``. Entries expire after ``ttl`` seconds and the
+    least recently used are evicted beyond ``max_items``.
+    """
+
+    def __init__(self, max_items: int = 2000, ttl: float = 3600, threshold=0.95):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._scopes: Dict[Tuple[Hashable, str], set] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def _drop(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        scope = self._scopes.get(entry["scope"])
+        if scope is not None:
+            scope.discard(entry_id)
+            if not scope:
+                del self._scopes[entry["scope"]]
+
+    def lookup(
+        self, user_id: Hashable, fingerprint: str, vector: np.ndarray
+    ) -> Optional[Dict[str, Any]]:
+        """Return ``{"response", "similarity"}`` for the closest cached question"""
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        now = time.monotonic()
+        with self._lock:
+            best_id, best_score = None, self.threshold
+            for entry_id in list(self._scopes.get((user_id, fingerprint), ())):
+                entry = self._entries[entry_id]
+                if entry["expires_at"] < now:
+                    self._drop(entry_id)
+                    continue
+                score = float(np.dot(entry["vector"], vector))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+
+            if best_id is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self._stats["hits"] += 1
+            return {
+                "response": self._entries[best_id]["response"],
+                "similarity": best_score,
+            }
+
+    def store(
+        self, user_id: Hashable, fingerprint: str, vector: np.ndarray, response: str
+    ):
+        scope = (user_id, fingerprint)
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = {
+                "scope": scope,
+                "vector": np.asarray(vector, dtype=np.float32).reshape(-1),
+                "response": response,
+                "expires_at": time.monotonic() + self.ttl,
+            }
+            self._scopes.setdefault(scope, set()).add(entry_id)
+            self._stats["stores"] += 1
+            while len(self._entries) > self.max_items:
+                self._drop(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["items"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
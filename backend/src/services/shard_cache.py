@@ -0,0 +1,125 @@
+import re
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+
+# Tenant namespaces become directory and file names
+NAMESPACE_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+class InvalidNamespaceError(ValueError):
+    """A namespace (or the user id it is built from) is malformed; a client error"""
+
+
+def validate_namespace(namespace: str) -> str:
+    """Return ``namespace`` if it is safe to use as a shard name, else raise"""
+    if not isinstance(namespace, str) or not NAMESPACE_PATTERN.fullmatch(namespace):
+        raise InvalidNamespaceError(
+            "namespace must be 1-64 letters, digits, '-' or '_'"
+        )
+    return namespace
+
+
+def user_namespace(user_id) -> str:
+    """Namespace holding one user's vectors"""
+    return validate_namespace(f"user-{user_id}")
+
+
+class ShardCache:
+    """LRU of lazily loaded per-tenant shards under a memory budget
+
+    ``loader(key)`` builds a shard on first use. Least recently used shards
+    are dropped once more than ``max_shards`` are resident or their summed
+    ``size(shard)`` exceeds ``max_size``; the shard just requested is always
+    kept. A dropped shard that is still referenced (by an in-flight request)
+    is handed out again rather than loaded a second time, so one tenant never
+    has two live copies writing the same files.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[Hashable], Any],
+        max_shards: int = 32,
+        max_size: int = 0,
+        size: Callable[[Any], int] = None,
+    ):
+        self.loader = loader
+        self.max_shards = max_shards
+        self.max_size = max_size
+        self.size = size or (lambda shard: 0)
+        self._shards: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._evicted = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        self._stats = {"hits": 0, "loads": 0, "revived": 0, "evictions": 0}
+
+    def _lookup(self, key: Hashable):
+        """Resident or still-referenced shard for ``key``; caller holds the lock"""
+        shard = self._shards.get(key)
+        if shard is not None:
+            self._shards.move_to_end(key)
+            self._stats["hits"] += 1
+            return shard
+        shard = self._evicted.pop(key, None)
+        if shard is not None:
+            self._shards[key] = shard
+            self._stats["revived"] += 1
+        return shard
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            shard = self._lookup(key)
+            if shard is not None:
+                self._evict()
+                return shard
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Per-key lock so a slow load does not block other tenants
+        with key_lock:
+            with self._lock:
+                shard = self._lookup(key)
+            if shard is None:
+                shard = self.loader(key)
+                with self._lock:
+                    self._shards[key] = shard
+                    self._stats["loads"] += 1
+            with self._lock:
+                self._evict()
+        return shard
+
+    def _evict(self):
+        total = sum(self.size(shard) for shard in self._shards.values())
+        while len(self._shards) > 1 and (
+            len(self._shards) > self.max_shards
+            or (self.max_size and total > self.max_size)
+        ):
+            key, shard = self._shards.popitem(last=False)
+            total -= self.size(shard)
+            self._evicted[key] = shard
+            self._stats["evictions"] += 1
+
+    def peek(self, key: Hashable) -> Any:
+        """The shard for ``key`` if it is in memory, without loading it"""
+        with self._lock:
+            shard = self._shards.get(key)
+            if shard is None:
+                shard = self._evicted.get(key)
+            return shard
+
+    def resident(self) -> Dict[Hashable, Any]:
+        """Snapshot of the shards currently held in memory"""
+        with self._lock:
+            return dict(self._shards)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._stats,
+                "resident": len(self._shards),
+                "resident_size": sum(
+                    self.size(shard) for shard in self._shards.values()
+                ),
+                "max_shards": self.max_shards,
+                "max_size": self.max_size,
+            }
@@ -0,0 +1,125 @@
+import math
+import faiss
+import numpy as np
+from typing import Optional
+
+# Index tiers ordered by how far along the growth path they are. An index is
+# only ever migrated to a tier with a higher rank; IVF-PQ is lossy, so its
+# vectors cannot be reconstructed faithfully for another migration.
+INDEX_TIERS = {"flat": 0, "hnsw": 1, "ivf_flat": 1, "ivf_pq": 2}
+
+# faiss recommends roughly 39 training points per IVF centroid
+MIN_POINTS_PER_CENTROID = 39
+
+
+def index_tier(index) -> str:
+    """Return the tier name of an existing FAISS index"""
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def choose_nlist(ntotal: int, nlist: int = 0) -> int:
+    """Pick the number of IVF lists, defaulting to ~4*sqrt(n) bounded by training size"""
+    if not nlist:
+        nlist = int(4 * math.sqrt(max(ntotal, 1)))
+    return max(1, min(nlist, ntotal // MIN_POINTS_PER_CENTROID))
+
+
+def target_tier(
+    ntotal: int,
+    index_type: str = "auto",
+    ivf_threshold: int = 50000,
+    pq_threshold: int = 1000000,
+) -> str:
+    """Decide which tier an index holding ``ntotal`` vectors should be on"""
+    if index_type == "auto":
+        if ntotal >= pq_threshold:
+            return "ivf_pq"
+        if ntotal >= ivf_threshold:
+            return "ivf_flat"
+        return "flat"
+
+    if index_type not in INDEX_TIERS:
+        raise ValueError(f"Unknown index type: {index_type}")
+
+    # IVF tiers need enough vectors to train their coarse quantizer; until then
+    # an exact flat index is both faster and more accurate.
+    if index_type in ("ivf_flat", "ivf_pq") and ntotal < ivf_threshold:
+        return "flat"
+    return index_type
+
+
+def create_index(
+    tier: str,
+    dim: int,
+    metric: int = faiss.METRIC_INNER_PRODUCT,
+    nlist: int = 1,
+    pq_m: int = 48,
+    pq_bits: int = 8,
+    hnsw_m: int = 32,
+    ef_construction: int = 200,
+):
+    """Create an empty (untrained) FAISS index for the given tier"""
+    if tier == "flat":
+        if metric == faiss.METRIC_INNER_PRODUCT:
+            return faiss.IndexFlatIP(dim)
+        return faiss.IndexFlatL2(dim)
+
+    if tier == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m, metric)
+        index.hnsw.efConstruction = ef_construction
+        return index
+
+    if metric == faiss.METRIC_INNER_PRODUCT:
+        quantizer = faiss.IndexFlatIP(dim)
+    else:
+        quantizer = faiss.IndexFlatL2(dim)
+
+    if tier == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+    elif tier == "ivf_pq":
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_bits, metric)
+    else:
+        raise ValueError(f"Unknown index type: {tier}")
+
+    # Keep the quantizer alive for as long as the index that wraps it
+    index.own_fields = True
+    quantizer.this.disown()
+    return index
+
+
+def reconstruct_all(index) -> np.ndarray:
+    """Return every vector stored in an index as a float32 matrix"""
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype="float32")
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def migrate_index(index, tier: str, **index_kwargs):
+    """Copy all vectors of ``index`` into a freshly trained index of ``tier``"""
+    vectors = reconstruct_all(index)
+    if tier in ("ivf_flat", "ivf_pq"):
+        index_kwargs["nlist"] = choose_nlist(len(vectors), index_kwargs.get("nlist", 0))
+    new_index = create_index(tier, index.d, index.metric_type, **index_kwargs)
+    if not new_index.is_trained:
+        new_index.train(vectors)
+    new_index.add(vectors)
+    return new_index
+
+
+def search_params(
+    index, nprobe: Optional[int] = None, ef_search: Optional[int] = None
+) -> Optional[faiss.SearchParameters]:
+    """Build per-query recall/latency parameters for the index, if it takes any"""
+    if isinstance(index, faiss.IndexIVF) and nprobe:
+        return faiss.SearchParametersIVF(nprobe=min(int(nprobe), index.nlist))
+    if isinstance(index, faiss.IndexHNSW) and ef_search:
+        return faiss.SearchParametersHNSW(efSearch=int(ef_search))
+    return None
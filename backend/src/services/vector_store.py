@@ -0,0 +1,489 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+import numpy as np
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+from flask import current_app
+
+from .model_registry import get_app_service
+from .shard_cache import ShardCache, validate_namespace
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STORE_DIR = os.path.join(
+    os.path.dirname(__file__), "..", "..", "..", "data", "vector_store"
+)
+
+# Pinecone comparison operators supported by the local store's filters
+_COMPARISONS = {
+    "$eq": "=",
+    "$ne": "!=",
+    "$gt": ">",
+    "$gte": ">=",
+    "$lt": "<",
+    "$lte": "<=",
+}
+
+# Keep IN (...) lists well below SQLite's bound-parameter limit
+_SQL_BATCH = 500
+
+
+class VectorMatch(NamedTuple):
+    id: str
+    score: float
+    metadata: Dict[str, Any]
+
+
+class VectorStore:
+    """Pinecone-style vector store used by EnhancedRAGService
+
+    Vectors are dicts with ``id``, ``values`` and ``metadata``; ``query``
+    ranks by cosine similarity and takes a Pinecone metadata filter such as
+    ``{"user_id": 1}`` or ``{"doc_id": {"$in": [1, 2]}}``. Every call can be
+    scoped to a ``namespace`` (a tenant partition); None is the default one.
+    ``provider`` is the LLMClient provider name its calls are routed through.
+    """
+
+    name = None
+    provider = None
+
+    def upsert(self, vectors: List[Dict[str, Any]], namespace: str = None):
+        raise NotImplementedError
+
+    def query(
+        self,
+        vector: List[float],
+        top_k: int,
+        filter: Dict[str, Any] = None,
+        namespace: str = None,
+    ) -> List[VectorMatch]:
+        raise NotImplementedError
+
+    def delete(self, ids: List[str], namespace: str = None):
+        raise NotImplementedError
+
+    def count(self, namespace: str = None) -> int:
+        raise NotImplementedError
+
+    def refresh(self, namespace: str = None):
+        """Pick up writes other processes made to ``namespace``
+
+        Only stores that hold vectors in this process need to do anything.
+        """
+
+    def get_stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+class PineconeVectorStore(VectorStore):
+    """Serverless Pinecone index, created on first use"""
+
+    name = "pinecone"
+    provider = "pinecone"
+
+    def __init__(
+        self,
+        api_key: str,
+        index_name: str,
+        dimension: int,
+        cloud: str = "gcp",
+        region: str = "asia-southeast1",
+    ):
+        from pinecone import Pinecone, ServerlessSpec
+
+        self.pc = Pinecone(api_key=api_key)
+        if index_name not in self.pc.list_indexes().names():
+            self.pc.create_index(
+                name=index_name,
+                dimension=dimension,
+                metric="cosine",
+                spec=ServerlessSpec(cloud=cloud, region=region),
+            )
+        self.index = self.pc.Index(index_name)
+
+    @staticmethod
+    def _scope(namespace: str) -> Dict[str, str]:
+        return {"namespace": namespace} if namespace else {}
+
+    def upsert(self, vectors: List[Dict[str, Any]], namespace: str = None):
+        self.index.upsert(vectors=vectors, **self._scope(namespace))
+
+    def query(
+        self,
+        vector: List[float],
+        top_k: int,
+        filter: Dict[str, Any] = None,
+        namespace: str = None,
+    ) -> List[VectorMatch]:
+        result = self.index.query(
+            vector=vector,
+            top_k=top_k,
+            filter=filter,
+            include_metadata=True,
+            **self._scope(namespace),
+        )
+        return [
+            VectorMatch(match.id, match.score, match.metadata or {})
+            for match in result.matches or []
+        ]
+
+    def delete(self, ids: List[str], namespace: str = None):
+        self.index.delete(ids=ids, **self._scope(namespace))
+
+    def count(self, namespace: str = None) -> int:
+        stats = self.index.describe_index_stats()
+        if namespace is None:
+            return int(stats.total_vector_count)
+        summary = (stats.namespaces or {}).get(namespace)
+        return int(summary.vector_count) if summary else 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = self.index.describe_index_stats()
+        return {
+            "vectors": int(stats.total_vector_count),
+            "namespaces": len(stats.namespaces or {}),
+        }
+
+
+def _filter_sql(filter: Dict[str, Any]) -> Tuple[str, List[Any]]:
+    """Translate a Pinecone metadata filter into a WHERE clause over JSON metadata"""
+    clauses = []
+    params = []
+    for key, condition in filter.items():
+        if key.startswith("$") or '"' in key:
+            raise ValueError(f"Unsupported filter field: {key}")
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        field = "json_extract(metadata, ?)"
+        path = f'$."{key}"'
+        for op, value in condition.items():
+            if op in ("$in", "$nin"):
+                values = list(value)
+                if not values:
+                    clauses.append("0" if op == "$in" else "1")
+                    continue
+                negate = "NOT " if op == "$nin" else ""
+                placeholders = ", ".join("?" * len(values))
+                clauses.append(f"{field} {negate}IN ({placeholders})")
+                params.extend([path, *values])
+            elif op in _COMPARISONS:
+                clauses.append(f"{field} {_COMPARISONS[op]} ?")
+                params.extend([path, value])
+            else:
+                raise ValueError(f"Unsupported filter operator: {op}")
+    return " AND ".join(clauses) or "1", params
+
+
+class LocalPartition:
+    """One namespace of the local store: SQLite rows plus an in-memory FAISS index
+
+    Ids, metadata and normalized vectors are stored in SQLite, which is
+    durable on its own; the exact inner-product FAISS index is rebuilt from
+    it when the partition is loaded. Filters are evaluated in SQL and passed
+    to FAISS as an id selector, so a query only ranks the vectors it is
+    allowed to see. faiss is imported here rather than with the module, so
+    a Pinecone deployment does not need faiss-cpu installed.
+    """
+
+    def __init__(self, path: str, dimension: int):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.dimension = dimension
+        # Guards the connection and the FAISS index across request threads
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS vectors (
+                iid INTEGER PRIMARY KEY AUTOINCREMENT,
+                id TEXT NOT NULL UNIQUE,
+                metadata TEXT NOT NULL,
+                vector BLOB NOT NULL
+            )
+            """)
+        self._conn.commit()
+        import faiss
+
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+        self._load()
+
+    def _load(self):
+        cursor = self._conn.execute("SELECT iid, vector FROM vectors")
+        while True:
+            rows = cursor.fetchmany(10000)
+            if not rows:
+                break
+            vectors = np.vstack(
+                [np.frombuffer(blob, dtype=np.float32) for _, blob in rows]
+            )
+            iids = np.array([iid for iid, _ in rows], dtype=np.int64)
+            self.index.add_with_ids(vectors, iids)
+        logger.info(f"Loaded {self.index.ntotal} vectors from {self.path}")
+
+    def _normalize(self, vectors) -> np.ndarray:
+        import faiss
+
+        vectors = np.array(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    def _iids(self, ids: List[str]) -> List[int]:
+        iids = []
+        for start in range(0, len(ids), _SQL_BATCH):
+            batch = ids[start : start + _SQL_BATCH]
+            placeholders = ", ".join("?" * len(batch))
+            iids.extend(
+                iid
+                for (iid,) in self._conn.execute(
+                    f"SELECT iid FROM vectors WHERE id IN ({placeholders})", batch
+                )
+            )
+        return iids
+
+    def _remove(self, ids: List[str]):
+        iids = self._iids(ids)
+        if not iids:
+            return
+        self.index.remove_ids(np.array(iids, dtype=np.int64))
+        for start in range(0, len(iids), _SQL_BATCH):
+            batch = iids[start : start + _SQL_BATCH]
+            placeholders = ", ".join("?" * len(batch))
+            self._conn.execute(
+                f"DELETE FROM vectors WHERE iid IN ({placeholders})", batch
+            )
+
+    def upsert(self, vectors: List[Dict[str, Any]]):
+        # The last vector wins when an id repeats within one call
+        latest = list({vector["id"]: vector for vector in vectors}.values())
+        if not latest:
+            return
+        values = self._normalize([vector["values"] for vector in latest])
+        with self._lock:
+            # Replaced vectors get a fresh internal id
+            self._remove([vector["id"] for vector in latest])
+            iids = []
+            for vector, row in zip(latest, values):
+                cursor = self._conn.execute(
+                    "INSERT INTO vectors (id, metadata, vector) VALUES (?, ?, ?)",
+                    (
+                        vector["id"],
+                        json.dumps(vector.get("metadata") or {}, ensure_ascii=False),
+                        row.tobytes(),
+                    ),
+                )
+                iids.append(cursor.lastrowid)
+            self._conn.commit()
+            self.index.add_with_ids(values, np.array(iids, dtype=np.int64))
+
+    def query(
+        self, vector: List[float], top_k: int, filter: Dict[str, Any] = None
+    ) -> List[VectorMatch]:
+        import faiss
+
+        query = self._normalize([vector])
+        with self._lock:
+            if not self.index.ntotal:
+                return []
+            params = None
+            if filter:
+                where, args = _filter_sql(filter)
+                allowed = [
+                    iid
+                    for (iid,) in self._conn.execute(
+                        f"SELECT iid FROM vectors WHERE {where}", args
+                    )
+                ]
+                if not allowed:
+                    return []
+                params = faiss.SearchParameters(
+                    sel=faiss.IDSelectorBatch(np.array(allowed, dtype=np.int64))
+                )
+            scores, iids = self.index.search(
+                query, min(top_k, self.index.ntotal), params=params
+            )
+            hits = [
+                (int(iid), float(score))
+                for score, iid in zip(scores[0], iids[0])
+                if iid >= 0
+            ]
+            rows = {}
+            for start in range(0, len(hits), _SQL_BATCH):
+                batch = [iid for iid, _ in hits[start : start + _SQL_BATCH]]
+                placeholders = ", ".join("?" * len(batch))
+                rows.update(
+                    (iid, (vector_id, metadata))
+                    for iid, vector_id, metadata in self._conn.execute(
+                        "SELECT iid, id, metadata FROM vectors "
+                        f"WHERE iid IN ({placeholders})",
+                        batch,
+                    )
+                )
+
+        return [
+            VectorMatch(rows[iid][0], score, json.loads(rows[iid][1]))
+            for iid, score in hits
+            if iid in rows
+        ]
+
+    def delete(self, ids: List[str]):
+        with self._lock:
+            self._remove(list(ids))
+            self._conn.commit()
+
+    def refresh(self):
+        """Bring the FAISS index in line with rows other processes wrote
+
+        Ingestion workers write the same SQLite file through their own
+        partition objects. Replaced and deleted vectors lose their internal
+        id and new ones get a fresh id, so comparing the id sets is enough.
+        """
+        import faiss
+
+        with self._lock:
+            stored = np.fromiter(
+                (iid for (iid,) in self._conn.execute("SELECT iid FROM vectors")),
+                dtype=np.int64,
+            )
+            held = faiss.vector_to_array(self.index.id_map).astype(np.int64)
+            gone = np.setdiff1d(held, stored, assume_unique=True)
+            if len(gone):
+                self.index.remove_ids(gone)
+            new = np.setdiff1d(stored, held, assume_unique=True).tolist()
+            for start in range(0, len(new), _SQL_BATCH):
+                batch = new[start : start + _SQL_BATCH]
+                placeholders = ", ".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT iid, vector FROM vectors WHERE iid IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                if rows:
+                    self.index.add_with_ids(
+                        np.vstack(
+                            [np.frombuffer(blob, dtype=np.float32) for _, blob in rows]
+                        ),
+                        np.array([iid for iid, _ in rows], dtype=np.int64),
+                    )
+        if len(gone) or new:
+            logger.info(
+                f"Refreshed {self.path}: {len(new)} vectors added, {len(gone)} removed"
+            )
+
+    def count(self) -> int:
+        return int(self.index.ntotal)
+
+
+class LocalVectorStore(VectorStore):
+    """On-disk stand-in for Pinecone, partitioned by namespace
+
+    The default namespace lives in ``<path>.sqlite3`` and every other one in
+    ``<path>/<namespace>.sqlite3``. Partitions are loaded on first use and
+    the least recently used are dropped from memory once more than
+    ``max_partitions`` are resident or they hold over ``max_vectors``
+    vectors, so a query only touches its tenant's data. Meant for offline
+    deployments, benchmarks and small tenants.
+    """
+
+    name = "local"
+    provider = "local_vectors"
+
+    def __init__(
+        self,
+        path: str,
+        dimension: int,
+        max_partitions: int = 32,
+        max_vectors: int = 0,
+    ):
+        self.path = path
+        self.dimension = dimension
+        self.partitions = ShardCache(
+            self._load_partition,
+            max_shards=max_partitions,
+            max_size=max_vectors,
+            size=LocalPartition.count,
+        )
+
+    def _load_partition(self, namespace: str) -> LocalPartition:
+        if namespace is None:
+            return LocalPartition(f"{self.path}.sqlite3", self.dimension)
+        return LocalPartition(
+            os.path.join(self.path, f"{validate_namespace(namespace)}.sqlite3"),
+            self.dimension,
+        )
+
+    def _partition(self, namespace: str = None) -> LocalPartition:
+        return self.partitions.get(namespace or None)
+
+    def upsert(self, vectors: List[Dict[str, Any]], namespace: str = None):
+        self._partition(namespace).upsert(vectors)
+
+    def query(
+        self,
+        vector: List[float],
+        top_k: int,
+        filter: Dict[str, Any] = None,
+        namespace: str = None,
+    ) -> List[VectorMatch]:
+        return self._partition(namespace).query(vector, top_k, filter)
+
+    def delete(self, ids: List[str], namespace: str = None):
+        self._partition(namespace).delete(ids)
+
+    def count(self, namespace: str = None) -> int:
+        return self._partition(namespace).count()
+
+    def refresh(self, namespace: str = None):
+        # A partition that is not in memory is read fresh when next loaded
+        partition = self.partitions.peek(namespace or None)
+        if partition is not None:
+            partition.refresh()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"partitions": self.partitions.get_stats()}
+
+
+def get_vector_store(dimension: int) -> VectorStore:
+    """Get the app-wide vector store selected by VECTOR_STORE
+
+    "pinecone" requires PINECONE_API_KEY and PINECONE_ENV; "local" keeps
+    vectors on disk under VECTOR_STORE_PATH; "auto" uses Pinecone when it is
+    configured and the local store otherwise.
+    """
+    config = current_app.config
+    index_name = config.get("PINECONE_INDEX_NAME") or "rag-index"
+    kind = (config.get("VECTOR_STORE") or "auto").lower()
+    if kind == "auto":
+        pinecone_ready = config.get("PINECONE_API_KEY") and config.get("PINECONE_ENV")
+        kind = "pinecone" if pinecone_ready else "local"
+
+    def create():
+        if kind == "pinecone":
+            missing_vars = [
+                name
+                for name in ("PINECONE_API_KEY", "PINECONE_ENV")
+                if not config.get(name)
+            ]
+            if missing_vars:
+                raise ValueError(
+                    f"Pinecone configuration incomplete. Please set the following environment variables: {', '.join(missing_vars)}"
+                )
+            return PineconeVectorStore(
+                config["PINECONE_API_KEY"],
+                index_name,
+                dimension,
+                cloud=config.get("PINECONE_CLOUD", "gcp"),
+                region=config.get("PINECONE_REGION", "asia-southeast1"),
+            )
+        if kind == "local":
+            store_dir = config.get("VECTOR_STORE_PATH") or DEFAULT_STORE_DIR
+            return LocalVectorStore(
+                os.path.join(store_dir, index_name),
+                dimension,
+                max_partitions=int(config.get("RAG_TENANT_MAX_PARTITIONS", 32)),
+                max_vectors=int(config.get("RAG_TENANT_MAX_VECTORS", 2000000)),
+            )
+        raise ValueError(f"Unknown vector store: {kind}")
+
+    return get_app_service("vector_store", create)